@@ -1,48 +1,67 @@
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import *
-from pyspark.sql.types import *
-import matplotlib.pyplot as plt
-import seaborn as sns
-from pyecharts.charts import Map
-from pyecharts import options as opts
-
-# 初始化Spark
-spark = SparkSession.builder \
-    .appName("UserAnalysis") \
-    .config("spark.sql.files.maxPartitionBytes", "256MB") \
-    .config("spark.sql.shuffle.partitions", "200") \
-    .getOrCreate()
+# pyspark与绘图库在首次使用时才导入，SparkSession在首次调用get_spark()时才启动；
+# 导入本模块（如只使用其中的函数或模式定义）不会启动JVM
+_spark = None
 
 # 增强的省份提取正则
 province_pattern = r"^([\u4e00-\u9fa5]{2,7}?(省|自治区|市|特别行政区))"
 
-# 统一模式定义
-purchase_schema = StructType([
-    StructField("average_price", DoubleType()),
-    StructField("category", StringType()),
-    StructField("items", ArrayType(StructType([StructField("id", IntegerType())])))
-])
+def get_spark():
+    """获取（首次调用时创建）SparkSession"""
+    global _spark
+    if _spark is None:
+        from pyspark.sql import SparkSession
+        # 初始化Spark
+        _spark = SparkSession.builder \
+            .appName("UserAnalysis") \
+            .config("spark.sql.files.maxPartitionBytes", "256MB") \
+            .config("spark.sql.shuffle.partitions", "200") \
+            .getOrCreate()
+    return _spark
+
+def build_schemas():
+    """统一模式定义，返回(purchase_schema, main_schema)"""
+    from pyspark.sql.types import (StructType, StructField, DoubleType, StringType, ArrayType,
+                                   IntegerType, TimestampType, BooleanType, DateType)
+    purchase_schema = StructType([
+        StructField("average_price", DoubleType()),
+        StructField("category", StringType()),
+        StructField("items", ArrayType(StructType([StructField("id", IntegerType())])))
+    ])
 
-main_schema = StructType([
-    StructField("timestamp", TimestampType()),
-    StructField("user_name", StringType()),
-    StructField("chinese_name", StringType()),
-    StructField("income", DoubleType()),
-    StructField("chinese_address", StringType()),
-    StructField("purchase_history", purchase_schema),
-    StructField("is_active", BooleanType()),
-    StructField("registration_date", DateType()),
-    StructField("credit_score", IntegerType()),
-    StructField("phone_number", StringType())
-])
+    main_schema = StructType([
+        StructField("timestamp", TimestampType()),
+        StructField("user_name", StringType()),
+        StructField("chinese_name", StringType()),
+        StructField("income", DoubleType()),
+        StructField("chinese_address", StringType()),
+        StructField("purchase_history", purchase_schema),
+        StructField("is_active", BooleanType()),
+        StructField("registration_date", DateType()),
+        StructField("credit_score", IntegerType()),
+        StructField("phone_number", StringType())
+    ])
+    return purchase_schema, main_schema
+
+def __getattr__(name):
+    """兼容旧用法：analysis.spark / analysis.main_schema / analysis.purchase_schema按需创建"""
+    if name == 'spark':
+        return get_spark()
+    if name in ('purchase_schema', 'main_schema'):
+        purchase_schema, main_schema = build_schemas()
+        globals().update(purchase_schema=purchase_schema, main_schema=main_schema)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def load_and_preprocess(file_list):
     """
     多CSV文件加载与预处理
     参数：file_list - CSV文件路径列表
     """
+    from pyspark.sql.functions import (col, current_date, datediff, expr, regexp_extract,
+                                       size, year)
+    _, main_schema = build_schemas()
     # 并行读取多个CSV
-    df = spark.read.csv(
+    df = get_spark().read.csv(
         file_list,
         schema=main_schema,
         header=True,
@@ -92,6 +111,8 @@ def generate_heatmap(df, metric='user_count', title='用户分布热力图'):
         metric - 度量字段名
         title - 图表标题
     """
+    from pyecharts.charts import Map
+    from pyecharts import options as opts
     # 转换为PyEcharts需要的格式
     value_list = df[['province', metric]].values.tolist()
     
@@ -116,6 +137,9 @@ def generate_heatmap(df, metric='user_count', title='用户分布热力图'):
 
 # 主分析流程
 if __name__ == "__main__":
+    from pyspark.sql.functions import avg, col, count, sum
+    from visualization import plot_province_dashboard
+    
     # 输入CSV文件列表（示例路径）
     csv_files = [
         "csv_file\\test.csv",
@@ -129,17 +153,16 @@ if __name__ == "__main__":
     province_dist = df.groupBy("province").agg(
         count("user_name").alias("user_count"),
         sum("income").alias("total_income"),
-        avg("credit_score").alias("avg_credit")
+        avg("credit_score").alias("avg_credit"),
+        sum(col("avg_purchase_price") * col("purchase_count")).alias("sales")
     ).orderBy("user_count", ascending=False)
 
     # 转换为Pandas DataFrame
     province_pd = province_dist.toPandas()
     
-    # 生成热力图（用户数分布）
-    user_map = generate_heatmap(province_pd, 'user_count', '用户数量分布')
-    income_map = generate_heatmap(province_pd, 'total_income', '总收入分布')
-    credit_map = generate_heatmap(province_pd, 'avg_credit', '平均信用分分布')
+    # 生成多指标热力图（用户数/总收入/平均信用分/销售额，单页面切换）
+    plot_province_dashboard(province_pd)
     
     # 其他分析流程...
     
-    spark.stop()
\ No newline at end of file
+    get_spark().stop()
\ No newline at end of file
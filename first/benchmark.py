@@ -0,0 +1,114 @@
+# benchmark.py
+"""
+基准测试
+- 计算内核：kernels与原pandas/NumPy写法的耗时对比，并校验结果一致
+- 启动延迟：新进程中各模块的导入耗时、--help耗时、从启动到首个分析阶段完成的耗时
+
+python benchmark.py [--rows 行数] [--repeat 次数]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import kernels
+from kernels import quantile_bins, hour_counts, fixed_histogram
+
+def best_time(func, repeat):
+    """多次运行取最短耗时"""
+    costs = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func()
+        costs.append(time.perf_counter() - start_time)
+    return min(costs), result
+
+def qcut_baseline(values, q=5):
+    """原dynamic_binning写法：百分比排名 + qcut"""
+    ranked = pd.Series(values).rank(pct=True, method='first')
+    return (pd.qcut(ranked, q=q, labels=False, duplicates='drop') + 1).to_numpy()
+
+def hour_baseline(hours):
+    """原hourly_counts写法：value_counts + sort_index"""
+    counts = pd.Series(hours).value_counts().sort_index()
+    return counts.reindex(range(kernels.HOURS), fill_value=0).to_numpy()
+
+def run_benchmarks(rows, repeat=3, seed=0):
+    """运行全部基准，返回[(名称, 原写法耗时, 内核耗时, 结果一致)]"""
+    rng = np.random.default_rng(seed)
+    monetary = rng.exponential(2000, rows).round(2)
+    hours = rng.integers(0, kernels.HOURS, rows).astype(np.int8)
+    prices = rng.lognormal(7, 1, rows)
+    edges = np.linspace(prices.min(), np.quantile(prices, 0.95), 50)
+
+    cases = [
+        ('分位数分箱', lambda: qcut_baseline(monetary), lambda: quantile_bins(monetary, 5)),
+        ('24小时计数', lambda: hour_baseline(hours), lambda: hour_counts(hours)),
+        ('等宽直方图', lambda: np.histogram(prices, bins=edges)[0], lambda: fixed_histogram(prices, edges)),
+    ]
+    report = []
+    for name, baseline, kernel in cases:
+        kernel()  # 预热（numba首次调用包含编译）
+        base_cost, expected = best_time(baseline, repeat)
+        kernel_cost, actual = best_time(kernel, repeat)
+        report.append((name, base_cost, kernel_cost, np.array_equal(expected, actual)))
+    return report
+
+HERE = Path(__file__).resolve().parent
+
+def run_python(args):
+    """在新进程中运行python（工作目录为本目录），返回标准输出"""
+    result = subprocess.run([sys.executable, *args], cwd=HERE, capture_output=True, text=True, check=True)
+    return result.stdout
+
+def import_time(module):
+    """新进程中导入模块的耗时"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    return float(run_python(['-c', code]).strip().splitlines()[-1])
+
+def command_time(args):
+    """新进程运行命令的总耗时（含解释器启动）"""
+    start_time = time.perf_counter()
+    run_python(args)
+    return time.perf_counter() - start_time
+
+def startup_benchmarks(repeat=3, rows=10000):
+    """启动延迟，返回[(项目, 耗时)]"""
+    report = [(f"import {module}", min(import_time(module) for _ in range(repeat)))
+              for module in ('main', 'analysis', 'load_and_preprocess', 'visualization')]
+    report.append(('main.py --help', min(command_time(['main.py', '--help']) for _ in range(repeat))))
+    with tempfile.TemporaryDirectory() as tmp:
+        # 小数据集上只运行province_counts阶段：耗时主要是启动与首个阶段的导入
+        addresses = np.random.default_rng(0).choice(['广东省深圳市南山区', '北京市海淀区', '浙江省杭州市西湖区'], rows)
+        pq.write_table(pa.table({'address': addresses}), os.path.join(tmp, 'sample.parquet'))
+        args = ['main.py', os.path.join(tmp, 'sample.parquet'), '--only', 'province_counts', '-o', os.path.join(tmp, 'out')]
+        report.append(('启动到首个阶段完成', min(command_time(args) for _ in range(repeat))))
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="计算内核基准测试")
+    parser.add_argument('--rows', type=int, default=2000000, help="测试数据行数")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复次数（取最短耗时）")
+    parser.add_argument('--skip-startup', action='store_true', help="不测试启动延迟")
+    args = parser.parse_args(argv)
+
+    print(f"内核实现: {'numba' if kernels.HAS_NUMBA else 'numpy'}，数据量: {args.rows:,}行")
+    print(f"{'项目':<8}{'原写法(秒)':>12}{'内核(秒)':>12}{'加速比':>10}  结果一致")
+    for name, base_cost, kernel_cost, same in run_benchmarks(args.rows, args.repeat):
+        print(f"{name:<8}{base_cost:>12.4f}{kernel_cost:>12.4f}{base_cost / kernel_cost:>10.1f}x  {'是' if same else '否'}")
+
+    if not args.skip_startup:
+        print(f"\n{'启动延迟':<24}{'耗时(秒)':>10}")
+        for name, cost in startup_benchmarks(args.repeat):
+            print(f"{name:<28}{cost:>10.3f}")
+
+if __name__ == "__main__":
+    main()
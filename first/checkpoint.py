@@ -0,0 +1,101 @@
+"""
+加载检查点：每个文件标准化完成后写出Arrow IPC，可在中断后续跑
+
+- 每个源文件对应一个检查点文件（未压缩的Arrow IPC，续跑时可直接内存映射），内容为标准化后的表
+- manifest.json记录已完成的文件、源文件大小与修改时间、读取的列与地址解析层级、数据质量计数
+- 检查点与manifest都先写临时文件再替换，进程中途崩溃不会留下损坏的检查点
+- 续跑时源文件未变化且检查点覆盖所需列的文件直接从检查点读取（内存映射）
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pyarrow.feather as feather
+
+MANIFEST_NAME = 'manifest.json'
+
+def source_key(file):
+    """源文件在manifest中的键（绝对路径）"""
+    return str(Path(file).resolve())
+
+def source_state(file):
+    """源文件状态：大小与修改时间，任一变化时检查点失效"""
+    st = os.stat(file)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def atomic_replace(path, write):
+    """write(tmp)写出临时文件后替换到path"""
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    write(tmp)
+    os.replace(tmp, path)
+    return path
+
+class Checkpoint:
+    """按文件的加载检查点
+
+    directory: 检查点目录；columns: 本次需要的标准列（None为全部）；
+    geo_level: 地址解析层级；resume: 是否沿用已有的manifest（否则从头开始记录）
+    """
+    def __init__(self, directory, columns=None, geo_level='province', resume=False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.directory / MANIFEST_NAME
+        self.columns = sorted(columns) if columns is not None else None
+        self.geo_level = geo_level
+        self.entries = {}
+        if resume and self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                print(f"警告：检查点清单 {self.manifest_path} 无法解析，将重新加载全部文件")
+
+    def covers(self, entry):
+        """检查点是否覆盖本次所需的列与地址解析层级"""
+        if self.geo_level == 'city' and entry['geo_level'] != 'city':
+            return False
+        if entry['columns'] is None:
+            return True
+        return self.columns is not None and set(self.columns) <= set(entry['columns'])
+
+    def lookup(self, file):
+        """返回可用的检查点记录，不存在或已失效时返回None"""
+        entry = self.entries.get(source_key(file))
+        if entry is None or not os.path.exists(file) or entry['source'] != source_state(file):
+            return None
+        if not self.covers(entry) or not (self.directory / entry['path']).exists():
+            return None
+        return entry
+
+    def load(self, file):
+        """读取检查点（内存映射），返回(表, 数据质量计数)"""
+        entry = self.lookup(file)
+        table = feather.read_table(self.directory / entry['path'], memory_map=True)
+        if self.columns is not None:
+            table = table.select([name for name in table.column_names if name in self.columns])
+        return table, entry['quality']
+
+    def save(self, file, table, quality=None):
+        """写出文件的检查点并更新manifest；quality为该文件的数据质量计数"""
+        key = source_key(file)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.arrow'
+        atomic_replace(self.directory / name,
+                       lambda tmp: feather.write_feather(table, tmp, compression='uncompressed'))
+        self.entries[key] = {
+            'path': name,
+            'source': source_state(file),
+            'columns': self.columns,
+            'geo_level': self.geo_level,
+            'rows': table.num_rows,
+            'quality': quality,
+        }
+        self.save_manifest()
+
+    def save_manifest(self):
+        def write(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        atomic_replace(self.manifest_path, write)
@@ -0,0 +1,208 @@
+# cube.py
+"""
+多维聚合立方体：省份 × 品类 × 小时 × 价格区间，在加载时按批次累计
+
+- 维度：province（geo统一字典，含'unknown'）、categories（按出现顺序登记）、hour（0-23）、price（固定价格区间）
+- 度量：count（记录数）、price（avg_price之和，即品类销售额口径）、sales（avg_price × items_count之和）
+- 抽样数据（带sample_weight列）所有度量按权重累计，为总体估计值
+- 缺失值（空品类、空时间戳、空/负客单价）单独占一个位置，计入总量但按该维度分组时默认不显示
+- 各图表与下钻查询（如"广东省20点各品类销售额"）都是对这个小数组的求和，与数据量无关
+
+python cube.py cube.npz [--measure sales] [--by categories] [--province 广东省] [--hour 20]
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from geo import PROVINCE_DICTIONARY
+from kernels import HOURS
+
+# 价格区间边界（元），最后一个区间为[100000, +∞)
+PRICE_EDGES = np.array([0, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000], dtype=float)
+MEASURES = ('count', 'price', 'sales')
+DIMENSIONS = ('province', 'categories', 'hour', 'price')
+# 构建立方体需要的数据列
+CUBE_COLUMNS = ['province', 'categories', 'hour', 'avg_price', 'items_count']
+
+def price_labels(edges=PRICE_EDGES):
+    """价格区间标签，末位None为缺失"""
+    bounds = [f"{lo:g}" for lo in edges]
+    return [f"{lo}-{hi}" for lo, hi in zip(bounds, bounds[1:])] + [f"{bounds[-1]}+", None]
+
+def column_codes(batch, name, size, missing):
+    """整数编码列（空值为missing），列不存在时全部为missing"""
+    if name not in batch.schema.names:
+        return np.full(batch.num_rows, missing, dtype=np.int64)
+    column = batch.column(name)
+    if pa.types.is_dictionary(column.type):
+        column = column.indices
+    codes = column.fill_null(missing).to_numpy(zero_copy_only=False).astype(np.int64)
+    codes[(codes < 0) | (codes >= size)] = missing
+    return codes
+
+def float_column(batch, name, default):
+    if name not in batch.schema.names:
+        return np.full(batch.num_rows, default, dtype=float)
+    return batch.column(name).to_numpy(zero_copy_only=False).astype(float)
+
+class Cube:
+    """密集聚合数组data[度量, 省份, 品类, 小时, 价格区间]，品类维度在合并时增长"""
+    def __init__(self, categories=(), data=None, weighted=False, edges=PRICE_EDGES):
+        self.edges = np.asarray(edges, dtype=float)
+        self.provinces = PROVINCE_DICTIONARY.to_pylist()
+        # 品类首位None为缺失；小时末位None为缺失
+        self.categories = [None] + list(categories)
+        self.hours = list(range(HOURS)) + [None]
+        self.prices = price_labels(self.edges)
+        self.weighted = weighted
+        shape = (len(MEASURES), len(self.provinces), len(self.categories), len(self.hours), len(self.prices))
+        self.data = np.zeros(shape) if data is None else data
+
+    @classmethod
+    def from_table(cls, table, edges=PRICE_EDGES):
+        """从标准化后的Arrow表（或批次）构建立方体"""
+        cube = cls(edges=edges, weighted='sample_weight' in table.schema.names)
+        batches = table.to_batches() if isinstance(table, pa.Table) else [table]
+        for batch in batches:
+            cube.merge(cls.from_batch(batch, edges))
+        return cube
+
+    @classmethod
+    def from_batch(cls, batch, edges=PRICE_EDGES):
+        """单批次：各维度编码后展平为一维下标，每个度量一次bincount"""
+        if 'categories' in batch.schema.names:
+            categories = batch.column('categories')
+            if not pa.types.is_dictionary(categories.type):
+                categories = pc.dictionary_encode(categories)
+            labels = [str(v) for v in categories.dictionary.to_pylist()]
+            category = categories.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64) + 1
+        else:
+            labels, category = [], np.zeros(batch.num_rows, dtype=np.int64)
+        cube = cls(labels, weighted='sample_weight' in batch.schema.names, edges=edges)
+        _, num_provinces, num_categories, num_hours, num_prices = cube.data.shape
+
+        province = column_codes(batch, 'province', num_provinces, num_provinces - 1)
+        hour = column_codes(batch, 'hour', HOURS, HOURS)
+        price = float_column(batch, 'avg_price', np.nan)
+        bucket = np.searchsorted(cube.edges, price, side='right') - 1
+        bucket[(bucket < 0) | np.isnan(price)] = num_prices - 1
+        weights = float_column(batch, 'sample_weight', 1.0)
+
+        flat = ((province * num_categories + category) * num_hours + hour) * num_prices + bucket
+        price = np.nan_to_num(price)
+        values = {'count': weights, 'price': price * weights,
+                  'sales': price * float_column(batch, 'items_count', 0) * weights}
+        size = cube.data[0].size
+        for i, measure in enumerate(MEASURES):
+            cube.data[i] = np.bincount(flat, weights=values[measure], minlength=size).reshape(cube.data.shape[1:])
+        return cube
+
+    def merge(self, other):
+        """合并另一个立方体（品类按标签对齐，新品类追加到末尾）"""
+        positions = {label: i for i, label in enumerate(self.categories)}
+        new = [label for label in other.categories if label not in positions]
+        if new:
+            pad = np.zeros(self.data.shape[:2] + (len(new),) + self.data.shape[3:])
+            self.data = np.concatenate([self.data, pad], axis=2)
+            for label in new:
+                positions[label] = len(self.categories)
+                self.categories.append(label)
+        index = [positions[label] for label in other.categories]
+        self.data[:, :, index] += other.data
+        self.weighted = self.weighted or other.weighted
+        return self
+
+    def labels(self, dimension):
+        return {'province': self.provinces, 'categories': self.categories,
+                'hour': self.hours, 'price': self.prices}[dimension]
+
+    def query(self, measure='count', by=(), dropna=True, **filters):
+        """切片 + 汇总：filters按维度取值过滤（单个值或列表），by为保留的维度
+
+        by为空时返回标量；一个维度返回以标签为索引的Series，多个维度返回MultiIndex的Series；
+        dropna为True时去掉缺失值位置
+        """
+        by = (by,) if isinstance(by, str) else tuple(by)
+        unknown = [d for d in (*by, *filters) if d not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"未知维度: {', '.join(unknown)}（可选: {', '.join(DIMENSIONS)}）")
+        if measure not in MEASURES:
+            raise ValueError(f"未知度量: {measure}（可选: {', '.join(MEASURES)}）")
+        data = self.data[MEASURES.index(measure)]
+        axes = {}
+        for axis, dimension in enumerate(DIMENSIONS):
+            labels = self.labels(dimension)
+            if dimension in filters:
+                wanted = filters[dimension]
+                wanted = wanted if isinstance(wanted, (list, tuple)) else [wanted]
+                index = [labels.index(v) for v in wanted if v in labels]
+            elif dimension in by and dropna:
+                index = [i for i, label in enumerate(labels) if label is not None]
+            else:
+                index = list(range(len(labels)))
+            data = np.take(data, index, axis=axis)
+            axes[dimension] = [labels[i] for i in index]
+        data = data.sum(axis=tuple(i for i, d in enumerate(DIMENSIONS) if d not in by))
+        if not by:
+            return float(data)
+        order = [d for d in DIMENSIONS if d in by]
+        index = pd.MultiIndex.from_product([axes[d] for d in order], names=order) if len(order) > 1 \
+            else pd.Index(axes[order[0]], name=order[0])
+        result = pd.Series(data.ravel(), index=index, name=measure)
+        # by的顺序与维度顺序不同时调整索引层级
+        return result.reorder_levels(list(by)) if len(order) > 1 and list(by) != order else result
+
+    def counts(self, values):
+        """计数结果：抽样数据的估计值取整，否则为整数"""
+        return np.rint(values).astype(np.int64)
+
+    # 与visualization中各聚合函数口径一致的结果
+    def province_counts(self):
+        """各省记录数（降序），同count_by(df['province'])"""
+        counts = self.query('count', by='province')
+        return pd.Series(self.counts(counts.to_numpy()), index=counts.index.rename(None)) \
+            .sort_values(ascending=False, kind='stable')
+
+    def hourly_counts(self):
+        """各小时活跃记录数，同hourly_counts(df)"""
+        counts = self.query('count', by='hour')
+        counts = pd.Series(self.counts(counts.to_numpy()), index=pd.RangeIndex(HOURS, name='hour'), name='count')
+        return counts[counts > 0]
+
+    def category_sales(self):
+        """各品类销售额（avg_price求和），同category_sales(df)"""
+        return self.query('price', by='categories').rename(None).rename_axis(None)
+
+    def save(self, path):
+        """保存为.npz（标签以字符串数组保存，不依赖pickle）"""
+        np.savez_compressed(path, data=self.data, categories=np.array(self.categories[1:], dtype=str),
+                            edges=self.edges, weighted=self.weighted, measures=np.array(MEASURES))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['categories'].tolist(), data=f['data'], weighted=bool(f['weighted']), edges=f['edges'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="聚合立方体查询")
+    parser.add_argument('path', help="cube.npz文件（main.py --cube生成）")
+    parser.add_argument('--measure', choices=MEASURES, default='count', help="度量")
+    parser.add_argument('--by', default='', help=f"分组维度（逗号分隔），可选: {','.join(DIMENSIONS)}")
+    parser.add_argument('--province', default=None, help="只统计指定省份")
+    parser.add_argument('--categories', default=None, help="只统计指定品类")
+    parser.add_argument('--hour', type=int, default=None, help="只统计指定小时")
+    parser.add_argument('--price', default=None, help="只统计指定价格区间（如100-200）")
+    args = parser.parse_args(argv)
+
+    cube = Cube.load(args.path)
+    filters = {d: getattr(args, d) for d in DIMENSIONS if getattr(args, d) is not None}
+    by = [d for d in args.by.split(',') if d]
+    result = cube.query(args.measure, by=by, **filters)
+    print(result if by else f"{args.measure}: {result:,.2f}")
+
+if __name__ == "__main__":
+    main()
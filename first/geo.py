@@ -0,0 +1,241 @@
+"""
+省/市/区县三级地址解析
+
+基于chinese_province_city_area_mapper的行政区划名称，在加载时已解析的省份名称之后
+依次做最长匹配：市 -> 区县，缺失的市由区县反推。匹配按名称长度整列查表，全部在Arrow上完成。
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import chinese_province_city_area_mapper.mappers as mapper
+
+# 从mapper.province_country_mapper的key中获取省信息列表
+# 筛选只以市，省，自治区，特别行政区结尾的省信息
+PROVINCE_LIST = [p for p in mapper.province_country_mapper.keys()
+                 if p.endswith(('市', '省', '自治区', '特别行政区'))]
+
+# 地级市标准名称（简称如"深圳"归并到"深圳市"）
+CITY_PROVINCE = {city: province for city, province in mapper.city_province_mapper.items()
+                 if city + '市' not in mapper.city_province_mapper}
+CITY_LIST = sorted(CITY_PROVINCE)
+AREA_LIST = sorted(mapper.area_city_mapper)
+
+# 三级字典（末位均为'unknown'），所有批次共用
+PROVINCE_DICTIONARY = pa.array(PROVINCE_LIST + ['unknown'])
+CITY_DICTIONARY = pa.array(CITY_LIST + ['unknown'])
+AREA_DICTIONARY = pa.array(AREA_LIST + ['unknown'])
+
+# 市/区县解析时批次内去重的地址开头长度：先覆盖常见的"省+市+区县"，再覆盖自治区/自治州等长名称
+GEO_KEY_LENS = (9, 12, 15, 18)
+
+# pyecharts省级地图名称需要的特殊简称
+MAP_NAMES = {
+    '内蒙古自治区': '内蒙古',
+    '广西壮族自治区': '广西',
+    '西藏自治区': '西藏',
+    '宁夏回族自治区': '宁夏',
+    '新疆维吾尔自治区': '新疆',
+    '香港特别行政区': '香港',
+    '澳门特别行政区': '澳门',
+}
+
+def map_name(province):
+    """省份全称 -> pyecharts地图名称（如"广东省" -> "广东"）"""
+    return MAP_NAMES.get(province, province.rstrip('省市'))
+
+def find_provinces(values):
+    """对字符串数组逐省份查找子串，返回(省份编码, 匹配起始字节位置)
+
+    地址中出现多个省份名称时取最早出现的一个（省级名称互不为前缀，同一位置至多一个）；
+    未匹配为'unknown'的编码，起始位置为-1
+    """
+    codes = np.full(len(values), len(PROVINCE_LIST), dtype=np.int8)
+    starts = np.full(len(values), -1, dtype=np.int64)
+    for code, province in enumerate(PROVINCE_LIST):
+        pos = pc.find_substring(values, province).fill_null(-1).to_numpy(zero_copy_only=False)
+        better = (pos >= 0) & ((starts < 0) | (pos < starts))
+        codes[better], starts[better] = code, pos[better]
+    return codes, starts
+
+def match_provinces(values):
+    """对字符串数组做省份名称匹配，返回省份编码（未匹配为'unknown'的编码）"""
+    return find_provinces(values)[0]
+
+_province_codes = {name: code for code, name in enumerate(PROVINCE_LIST)}
+_city_codes = {name: code for code, name in enumerate(CITY_LIST)}
+_area_codes = {name: code for code, name in enumerate(AREA_LIST)}
+
+# 编码形式的上下级关系（末位对应'unknown'，其上级为-1）
+CITY_PARENT = np.array([_province_codes.get(CITY_PROVINCE[c], len(PROVINCE_LIST)) for c in CITY_LIST] + [-1])
+AREA_PARENT = np.array([_city_codes.get(mapper.area_city_mapper[a], len(CITY_LIST))
+                        if a not in mapper.rep_areas else len(CITY_LIST) for a in AREA_LIST] + [-1])
+# 直辖市：省级编码 -> 同名的市级编码（其余为市级'unknown'）
+PROVINCE_CITY = np.array([_city_codes.get(p, len(CITY_LIST)) for p in PROVINCE_LIST] + [len(CITY_LIST)])
+
+# 定位省份名称之后的位置：与省份解析相同，取地址中最早出现的省级全称
+PROVINCE_PATTERN = '^.*?(?:' + '|'.join(re.escape(p) for p in PROVINCE_LIST) + ')'
+
+def names_by_length(names):
+    """{名称: 编码} -> [(长度, 名称数组, 编码数组)]，按长度从长到短排列，用于最长匹配"""
+    groups = {}
+    for name, code in names.items():
+        groups.setdefault(len(name), []).append((name, code))
+    return [(length, pa.array([name for name, _ in items]), np.array([code for _, code in items]))
+            for length, items in sorted(groups.items(), reverse=True)]
+
+def match_prefix(values, groups, unknown):
+    """每个值开头的最长名称匹配，返回(编码, 匹配长度)；未匹配为unknown与0
+
+    每种名称长度截取一次开头并整列查表，耗时与名称数量无关
+    """
+    codes = np.full(len(values), unknown, dtype=np.int64)
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for length, names, name_codes in groups:
+        index = pc.index_in(pc.utf8_slice_codeunits(values, 0, length), value_set=names)
+        found = index.is_valid().to_numpy(zero_copy_only=False) & (lengths == 0)
+        codes[found] = name_codes[index.fill_null(0).to_numpy()[found]]
+        lengths[found] = length
+    return codes, lengths
+
+def skip_chars(values, counts):
+    """逐行跳过开头counts个字符"""
+    distinct = np.unique(counts)
+    if len(distinct) == 1:
+        return pc.utf8_slice_codeunits(values, int(distinct[0]))
+    slices = [pc.utf8_slice_codeunits(values, int(count)) for count in distinct]
+    return pc.choose(pa.array(np.searchsorted(distinct, counts)), *slices)
+
+def name_prefixes(groups):
+    """名称的所有真前缀（含空串）：剩余文本属于其中时，更长的文本可能匹配到更长的名称"""
+    names = [name for _, values, _ in groups for name in values.to_pylist()]
+    return pa.array(sorted({name[:i] for name in names for i in range(len(name))}))
+
+class GeoResolver:
+    """列式市/区县解析：在加载时已解析的省份之后依次做最长匹配 省 -> 市 -> 区县
+
+    市必须属于该省（直辖市的省级名称即为市），区县必须属于该市（重名区县只要求市已识别），
+    市缺失时由区县反推；省份未识别的地址市、区县均为'unknown'，三级结果始终一致。
+    批次内按地址开头的若干字符去重解析，开头不足以确定结果的地址再用更长的开头或逐行完整匹配
+    """
+    def __init__(self, key_lens=GEO_KEY_LENS):
+        self.key_lens = key_lens
+        # 地级市简称（如"深圳"）也参与匹配，映射到全称的编码
+        self.city_names = names_by_length({**{name: _city_codes[name + '市'] for name in mapper.city_province_mapper
+                                              if name + '市' in _city_codes}, **_city_codes})
+        self.area_names = names_by_length(_area_codes)
+        self.city_prefixes, self.area_prefixes = name_prefixes(self.city_names), name_prefixes(self.area_names)
+        # 匹配只需要省份名称之后的一小段
+        self.window = self.city_names[0][0] + self.area_names[0][0]
+
+    def match(self, values, province):
+        """逐行匹配字符串数组的市/区县编码，province为对应的省份编码数组
+
+        返回(市编码, 区县编码, 省之后的文本, 市之后的文本)
+        """
+        unknown_p, unknown_c, unknown_a = len(PROVINCE_LIST), len(CITY_LIST), len(AREA_LIST)
+        rest = pc.replace_substring_regex(values, PROVINCE_PATTERN, '', max_replacements=1)
+        rest = pc.utf8_slice_codeunits(rest, 0, self.window)
+
+        # 市：紧跟省之后匹配，且必须属于该省；不属于时区县仍从省之后匹配
+        city, length = match_prefix(rest, self.city_names, unknown_c)
+        accepted = CITY_PARENT[city] == province
+        city, length = np.where(accepted, city, unknown_c), np.where(accepted, length, 0)
+        city = np.where(city == unknown_c, PROVINCE_CITY[province], city)
+
+        # 区县：紧跟市之后匹配
+        area_rest = skip_chars(rest, length)
+        area, _ = match_prefix(area_rest, self.area_names, unknown_a)
+        parent = AREA_PARENT[area]
+        inferred = (city == unknown_c) & (parent != unknown_c) & (CITY_PARENT[np.maximum(parent, 0)] == province)
+        city = np.where(inferred & (area != unknown_a), parent, city)
+        belongs = (city != unknown_c) & ((parent == city) | (parent == unknown_c))
+        area = np.where(belongs & (area != unknown_a), area, unknown_a)
+
+        known = province != unknown_p
+        return np.where(known, city, unknown_c), np.where(known, area, unknown_a), rest, area_rest
+
+    def resolve_keys(self, values, key_len):
+        """按地址开头key_len个字符去重解析，返回(市编码, 区县编码, 已确定)，已确定为False的行需要更长的key"""
+        keys = pc.dictionary_encode(pc.utf8_slice_codeunits(values, 0, key_len))
+        # 每个key按与加载相同的规则确定省份，再解析市/区县
+        key_province = match_provinces(keys.dictionary).astype(np.int64)
+        city, area, city_rest, area_rest = self.match(keys.dictionary, key_province)
+        # key即完整地址，或省/市之后剩余的文本不可能是更长名称的开头时，key的结果即为完整地址的结果
+        decided = (pc.utf8_length(keys.dictionary).to_numpy(zero_copy_only=False) < key_len) | ~(
+            pc.is_in(city_rest, value_set=self.city_prefixes).to_numpy(zero_copy_only=False)
+            | pc.is_in(area_rest, value_set=self.area_prefixes).to_numpy(zero_copy_only=False))
+        # 空地址映射到末位：'unknown'且已确定
+        index = keys.indices.fill_null(len(keys.dictionary)).to_numpy()
+        return (np.append(city, len(CITY_LIST))[index], np.append(area, len(AREA_LIST))[index],
+                np.append(decided, True)[index], np.append(key_province, -1)[index], index < len(keys.dictionary))
+
+    def resolve(self, values, province):
+        """解析字符串数组的市/区县编码，province为对应的省份编码数组（加载时的解析结果）
+
+        依次用key_lens中的长度去重解析尚未确定的行，最后剩余的行逐行完整匹配
+        """
+        city = np.full(len(values), len(CITY_LIST), dtype=np.int64)
+        area = np.full(len(values), len(AREA_LIST), dtype=np.int64)
+        pending = np.arange(len(values))
+        for key_len in self.key_lens:
+            if not len(pending):
+                break
+            rows = values if len(pending) == len(values) else values.take(pa.array(pending))
+            city_k, area_k, decided, key_province, valid = self.resolve_keys(rows, key_len)
+            # 省份与加载结果不一致（省份名称不完整地落在key内）的行同样需要更长的key
+            done = decided & ((key_province == province[pending]) | ~valid)
+            city[pending[done]], area[pending[done]] = city_k[done], area_k[done]
+            pending = pending[~done]
+        if len(pending):
+            city[pending], area[pending], _, _ = self.match(values.take(pa.array(pending)), province[pending])
+        return city, area
+
+    def resolve_columns(self, address, province):
+        """地址列 + 省份列（字典数组）-> (city, area) 字典数组；字典编码的地址只解析去重后的值"""
+        province = province.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+        if pa.types.is_dictionary(address.type):
+            # 同一地址的省份相同，按字典值取其省份编码；空地址映射到末位的'unknown'
+            index = address.indices.fill_null(len(address.dictionary)).to_numpy()
+            value_province = np.full(len(address.dictionary) + 1, len(PROVINCE_LIST), dtype=np.int64)
+            value_province[index] = province
+            city, area = self.resolve(address.dictionary, value_province[:-1])
+            city = np.append(city, len(CITY_LIST))[index]
+            area = np.append(area, len(AREA_LIST))[index]
+        else:
+            city, area = self.resolve(address, province)
+        return (pa.DictionaryArray.from_arrays(pa.array(city.astype(np.int16)), CITY_DICTIONARY),
+                pa.DictionaryArray.from_arrays(pa.array(area.astype(np.int16)), AREA_DICTIONARY))
+
+def geo_breakdown(df, level='city', province=None):
+    """地域分组聚合：按省-市（或市-区县）统计记录数与销售额
+
+    level: 'city'或'area'；province: 只统计指定省份（全称）；
+    抽样数据（带sample_weight列）按权重放大为估计值
+    """
+    parent, child = ('province', 'city') if level == 'city' else ('city', 'area')
+    mask = np.ones(len(df), dtype=bool) if province is None \
+        else (df['province'] == province).to_numpy()
+    parent_codes = df[parent].cat.codes.to_numpy()[mask].astype(np.int64)
+    child_codes = df[child].cat.codes.to_numpy()[mask].astype(np.int64)
+    n_child = len(df[child].cat.categories)
+    key = parent_codes * n_child + child_codes
+    size = len(df[parent].cat.categories) * n_child
+
+    weights = df['sample_weight'].to_numpy(dtype=float)[mask] if 'sample_weight' in df.columns else None
+    counts = np.bincount(key, minlength=size)
+    result = {'count': counts if weights is None else np.rint(np.bincount(key, weights, size)).astype(np.int64)}
+    if 'avg_price' in df.columns and 'items_count' in df.columns:
+        sales = (df['avg_price'].to_numpy(dtype=float) * df['items_count'].to_numpy(dtype=float))[mask]
+        result['sales'] = np.bincount(key, weights=sales if weights is None else sales * weights, minlength=size)
+
+    nonzero = np.flatnonzero(counts)
+    out = pd.DataFrame({
+        parent: df[parent].cat.categories[nonzero // n_child],
+        child: df[child].cat.categories[nonzero % n_child],
+        **{name: values[nonzero] for name, values in result.items()},
+    })
+    return out.sort_values('count', ascending=False, ignore_index=True)
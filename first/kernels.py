@@ -0,0 +1,113 @@
+"""
+数值计算内核：分位数分箱、24小时计数、等宽直方图
+
+安装了numba时使用JIT编译的单遍循环，否则回退到等价的NumPy实现；
+两种实现的结果与原pandas/NumPy写法一致（见benchmark.py）。
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+HOURS = 24
+
+def _quantile_edges(n, q):
+    """百分比排名(k/n, k=1..n)的q等分位数边界，与Series.quantile的线性插值一致
+
+    pandas内部按百分数调用np.percentile，这里同样先乘100，保证边界逐位相同
+    （直接用np.quantile在边界恰好等于某个排名时会有末位误差，导致个别记录分箱不同）
+    """
+    ranked = np.arange(1, n + 1) / n
+    return np.percentile(ranked, np.linspace(0, 1, q + 1) * 100)
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _assign_sorted_bins(order, edges, n):
+        # 排序后的百分比排名单调递增，边界指针只需前移
+        labels = np.empty(n, dtype=np.int64)
+        b = 1
+        for k in range(n):
+            pct = (k + 1) / n
+            while b < len(edges) - 1 and pct > edges[b]:
+                b += 1
+            labels[order[k]] = b
+        return labels
+
+    @njit(cache=True)
+    def _hour_counts(hours):
+        counts = np.zeros(HOURS, dtype=np.int64)
+        for h in hours:
+            if 0 <= h < HOURS:
+                counts[h] += 1
+        return counts
+
+    @njit(cache=True)
+    def _weighted_hour_counts(hours, weights):
+        counts = np.zeros(HOURS, dtype=np.float64)
+        for i in range(len(hours)):
+            if 0 <= hours[i] < HOURS:
+                counts[hours[i]] += weights[i]
+        return counts
+
+    @njit(cache=True)
+    def _fixed_histogram(values, edges):
+        n = len(edges) - 1
+        lo, hi = edges[0], edges[-1]
+        counts = np.zeros(n, dtype=np.int64)
+        scale = n / (hi - lo)
+        for x in values:
+            if not (lo <= x <= hi):  # 同时排除NaN
+                continue
+            i = min(int((x - lo) * scale), n - 1)
+            # 浮点误差修正，与np.histogram的边界判定一致
+            if x < edges[i]:
+                i -= 1
+            elif i < n - 1 and x >= edges[i + 1]:
+                i += 1
+            counts[i] += 1
+        return counts
+
+def quantile_bins(values, q=5):
+    """分位数分箱（1..q），等价于pd.qcut(rank(pct=True, method='first'), q, labels=False) + 1
+
+    values不能包含NaN；q不超过唯一值数量时分箱边界不会重复。
+    """
+    values = np.asarray(values)
+    n = len(values)
+    # 稳定排序：并列值按出现顺序排名（method='first'）
+    order = np.argsort(values, kind='stable')
+    edges = _quantile_edges(n, q)
+    if HAS_NUMBA:
+        return _assign_sorted_bins(order, edges, n)
+    labels = np.empty(n, dtype=np.int64)
+    labels[order] = np.maximum(np.searchsorted(edges, np.arange(1, n + 1) / n, side='left'), 1)
+    return labels
+
+def hour_counts(hours, weights=None):
+    """0-23小时计数（长度24，越界值忽略），提供weights时为加权计数"""
+    hours = np.asarray(hours)
+    weights = np.asarray(weights, dtype=float) if weights is not None else None
+    if hours.dtype.kind == 'f':
+        valid = ~np.isnan(hours)
+        hours = hours[valid].astype(np.int64)
+        weights = weights[valid] if weights is not None else None
+    if HAS_NUMBA:
+        hours = hours.astype(np.int64, copy=False)
+        return _hour_counts(hours) if weights is None else _weighted_hour_counts(hours, weights)
+    if len(hours) and (hours.min() < 0 or hours.max() >= HOURS):
+        valid = (hours >= 0) & (hours < HOURS)
+        hours = hours[valid]
+        weights = weights[valid] if weights is not None else None
+    return np.bincount(hours, weights=weights, minlength=HOURS)
+
+def fixed_histogram(values, edges):
+    """等宽直方图计数，edges为np.linspace生成的分箱边界（末箱右闭，范围外的值忽略）"""
+    values = np.asarray(values, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    if HAS_NUMBA:
+        return _fixed_histogram(values, edges)
+    return np.histogram(values, bins=edges)[0]
@@ -1,124 +1,738 @@
 import pandas as pd
+import numpy as np
 import json
-import chinese_province_city_area_mapper.mappers as mapper
 import glob
 import warnings
+from pathlib import Path
 from tqdm import tqdm
-import pyarrow.parquet as pq
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 import time
 import os
+import threading
+from collections import OrderedDict
+from functools import partial
+from prefetch import prefetch, parallel_map, PREFETCH_DEPTH
+# 省份列表与字典（末位为'unknown'）由geo统一定义，所有批次共用同一字典，编码可跨批次比较
+from geo import PROVINCE_LIST, PROVINCE_DICTIONARY, GeoResolver, find_provinces, match_provinces
+from quality import PRICE_RANGE, QualityStats
+from memory import DICTIONARY_RATIO, SCAN_ROWS, SPILL_PREFIX, conform_tables
+from checkpoint import MANIFEST_NAME
+from cube import CUBE_COLUMNS
+from sketches import SKETCH_COLUMNS
+from sampling import SAMPLE_COLUMNS
+
+# 时间戳解析配置：显式格式，避免逐行推断（'ISO8601'或strptime格式串）
+TIMESTAMP_FORMAT = 'ISO8601'
+# 统一换算到的时区（不含时区的时间戳视为该时区的本地时间）
+TIMEZONE = 'UTC'
+
+# 每批读取行数
+BATCH_SIZE = 1250000
+# 解析线程数
+PARSE_WORKERS = min(8, os.cpu_count() or 1)
+# 省份缓存：地址前缀长度（省级名称最长8个字符）与最大条目数
+ADDRESS_PREFIX_LEN = 8
+PROVINCE_CACHE_SIZE = 200000
+# 持久化缓存的格式版本：匹配规则变化时递增，旧文件不再加载
+PROVINCE_CACHE_VERSION = 2
+
+# 列名别名：不同批次导出的数据列名不一致，统一为标准列名
+COLUMN_ALIASES = {
+    'last_login': 'timestamp',
+    'fullname': 'chinese_name',
+    'chinese_address': 'address',
+}
+# 标准列类型：CSV类型推断与parquet存储类型不一致时统一转换，保证多文件可合并
+COLUMN_TYPES = {
+    'income': pa.float64(),
+    'credit_score': pa.int64(),
+    'is_active': pa.bool_(),
+    'registration_date': pa.date32(),
+}
+# 派生列 -> 来源列（按需读取时据此决定要读取的原始列）
+DERIVED_COLUMNS = {
+    'avg_price': 'purchase_history',
+    'categories': 'purchase_history',
+    'items_count': 'purchase_history',
+    'province': 'address',
+    'city': 'address',
+    'area': 'address',
+    'hour': 'timestamp',
+    'date': 'timestamp',
+}
+# purchase_history内部字段别名（标准名: 可能出现的键名）
+PURCHASE_ALIASES = {
+    'avg_price': ('avg_price', 'average_price'),
+    'categories': ('categories', 'category'),
+}
+
+# 文件后缀与pyarrow.dataset格式的对应关系（压缩CSV按扩展名自动解压）
+FILE_FORMATS = {
+    '.parquet': 'parquet',
+    '.parq': 'parquet',
+    '.csv': 'csv',
+    '.csv.gz': 'csv',
+    '.csv.zst': 'csv',
+    '.csv.bz2': 'csv',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.ipc': 'feather',
+}
+
+# CSV原始列类型：显式指定，避免逐块推断类型（后续块类型不一致时读取失败）
+CSV_COLUMN_TYPES = {
+    **COLUMN_TYPES,
+    'id': pa.int64(),
+    **dict.fromkeys(['timestamp', 'last_login', 'user_name', 'chinese_name', 'fullname', 'address',
+                     'chinese_address', 'purchase_history', 'gender', 'country'], pa.string()),
+}
+# CSV每次解析的块大小（字节），块内多线程解析
+CSV_BLOCK_SIZE = 64 * 1024**2
+
+# 低基数字符串列：parquet按字典编码读取，其余格式在批次内编码，pandas侧为Categorical
+DICTIONARY_COLUMNS = ['categories', 'category', 'province', 'gender', 'country']
+# 地址列的基数随数据而定（通常接近每行唯一）：按批次内唯一值占比决定是否字典编码
+ADDRESS_COLUMNS = ['address', 'chinese_address']
+# 估计唯一值占比时检查的行数
+ENCODE_PROBE_ROWS = 4096
+
+
+# 购买记录解析失败时的默认值
+PURCHASE_DEFAULTS = {'avg_price': 0, 'categories': 'unknown', 'items_count': 0}
+PURCHASE_ERRORS = (ValueError, TypeError, AttributeError)
+
+def purchase_patterns():
+    """购买记录快速路径的正则（RE2）：只接受顶层为简单键值对、items为扁平元素列表的JSON记录
+
+    符合record的记录中唯一的方括号就是items数组，据此把记录拆成顶层部分与items内容，
+    价格、品类只在顶层部分抽取（不会匹配到items内对象的键）
+    """
+    q = r"""['"]"""
+    string = rf"{q}[^'\"\\{{}}\[\]]*{q}"              # 不含引号、反斜杠、括号的字符串
+    flat_string = rf"{q}[^'\"\\{{}}\[\],]*{q}"        # 另不含逗号（items的标量元素）
+    number = r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?"
+    scalar = rf"(?:{string}|{number}|true|false|null)"
+    flat_scalar = rf"(?:{flat_string}|{number}|true|false|null)"
+    pair = rf"{string}\s*:\s*{scalar}"
+    obj = rf"\{{\s*(?:{pair}(?:\s*,\s*{pair})*)?\s*\}}"
+    elements = rf"(?:{obj}(?:\s*,\s*{obj})*|{flat_scalar}(?:\s*,\s*{flat_scalar})*)?"
+    top = rf"(?:{q}items{q}\s*:\s*\[\s*{elements}\s*\]|{pair})"
+    price_keys = '|'.join(PURCHASE_ALIASES['avg_price'])
+    category_keys = '|'.join(PURCHASE_ALIASES['categories'])
+    end = r"\s*[,}]"
+    return {
+        'record': rf"^\s*\{{\s*{top}(?:\s*,\s*{top})*\s*\}}\s*$",
+        'split': r"^(?P<head>[^\[\]]*)\[(?P<items>[^\[\]]*)\](?P<tail>[^\[\]]*)$",
+        # 三个字段的键各出现一次时总数为3；重复键、别名同时出现时退回json解析
+        'keys': rf"{q}(?:{price_keys}|{category_keys}|items){q}\s*:",
+        'price': rf"{q}(?:{price_keys}){q}\s*:\s*(?P<v>{number}){end}",
+        'category': rf"{q}(?:{category_keys}){q}\s*:\s*{q}(?P<v>[^'\"\\{{}}\[\]]*){q}{end}",
+        'items': rf"{q}items{q}\s*:\s*\[\]",
+    }
+
+PURCHASE_PATTERNS = purchase_patterns()
+
+def parse_purchase_record(record):
+    """解析单条JSON购买记录为字典，格式错误时抛出PURCHASE_ERRORS中的异常"""
+    data = json.loads(record.replace("'", '"'))
+    return {
+        'avg_price': next((data[k] for k in PURCHASE_ALIASES['avg_price'] if k in data), 0),
+        'categories': next((data[k] for k in PURCHASE_ALIASES['categories'] if k in data), 'unknown'),
+        'items_count': len(data.get('items', []))
+    }
 
 def parse_purchase_history(record):
     """解析JSON格式的购买记录"""
     try:
-        data = json.loads(record.replace("'", '"'))
-        return pd.Series({
-            'avg_price': data.get('avg_price', 0),
-            'categories': data.get('categories', 'unknown'),
-            'items_count': len(data.get('items', []))
-        })
-    except:
-        return pd.Series({'avg_price': 0, 'category': 'unknown', 'items_count': 0})
+        return pd.Series(parse_purchase_record(record))
+    except PURCHASE_ERRORS:
+        return pd.Series(PURCHASE_DEFAULTS)
 
-def load_data(file_pattern):
-    """高效加载合并多个CSV文件"""
-    chunks = []
-    for file in glob.glob(file_pattern):
-        for chunk in pd.read_csv(file, chunksize=10000):
-            # 解析关键字段
-            chunk[['avg_price', 'categories', 'items_count']] = chunk['purchase_history'].apply(parse_purchase_history)
-            
-            # 地址解析
-            # 从中文地址中提取省市信息
-            # 从mapper.province_country_mapper的key中获取省信息列表（包含市，省，自治区）
-            province_mapper = mapper.province_country_mapper
-            province_list = list(province_mapper.keys())
-            # 筛选只以市，省，自治区，特别行政区结尾的省信息
-            province_list = [i for i in province_list if i.endswith(('市', '省', '自治区', '特别行政区'))]
-            # 解析chunk["chinese_address"]列
-            chunk['province'] = chunk['chinese_address'].apply(lambda x: [i for i in province_list if i in x])
-            chunk['province'] = chunk['province'].apply(lambda x: x[0] if len(x) > 0 else 'unknown') # 如果没有匹配到省份，则标记为'unknown'
-            # print(chunk['province'])
-            
-            # 将last_login键名称改为timestamp
-            if 'last_login' in chunk.columns and 'timestamp' not in chunk.columns:
-                chunk.rename(columns={'last_login': 'timestamp'}, inplace=True)
-            # 将fullname键名称改为chinese_name
-            if 'fullname' in chunk.columns and 'chinese_name' not in chunk.columns:
-                chunk.rename(columns={'fullname': 'chinese_name'}, inplace=True)
-            
-            chunks.append(chunk)
-    return pd.concat(chunks)
+def file_format(file):
+    """根据后缀判断文件格式（含.csv.gz等双重后缀），不支持时返回None"""
+    suffixes = [s.lower() for s in Path(file).suffixes]
+    return FILE_FORMATS.get(''.join(suffixes[-2:])) or FILE_FORMATS.get(''.join(suffixes[-1:]))
 
-def load_csv_data(valid_files, if_file_pattern=False):
-    """高效加载合并多个CSV文件"""
-    chunks = []
+def generated_file(file, root, exclude=()):
+    """是否为本程序写出的文件：exclude目录（如输出目录）下的文件、检查点目录与落盘目录中的文件、
+    隐藏文件（共享数据集句柄.dataset-*.arrow等）"""
+    if any(parent in exclude for parent in file.resolve().parents):
+        return True
+    parts = file.relative_to(root).parts
+    return any(part.startswith(('.', SPILL_PREFIX)) for part in parts) or (file.parent / MANIFEST_NAME).exists()
+
+def collect_files(paths, exclude=()):
+    """展开文件/目录参数：目录下递归收集所有支持格式的文件（不检查文件是否存在）
+
+    目录中本程序写出的文件（输出、检查点、落盘、共享数据集）不作为输入；
+    exclude为需要跳过的目录，本身就是所扫描目录（或其上级）的不跳过
+    """
+    files = []
+    for path in paths:
+        p = Path(path)
+        if p.is_dir():
+            resolved = p.resolve()
+            skip = {Path(d).resolve() for d in exclude} - {resolved, *resolved.parents}
+            for suffix in FILE_FORMATS:
+                files.extend(f for f in p.glob(f"**/*{suffix}") if not generated_file(f, p, skip))
+        else:
+            files.append(p)
+    return files
+
+def source_columns(schema_names, columns):
+    """按需读取：返回文件中需要读取的原始列名，columns为None时读取全部"""
+    if columns is None:
+        return None
+    needed = {DERIVED_COLUMNS.get(c, c) for c in columns}
+    return [n for n in schema_names if n in needed or COLUMN_ALIASES.get(n) in needed]
+
+def rebatch(batches, rows):
+    """把任意大小的批次流整理为每批rows行（最后一批可能不足）"""
+    pending, count = [], 0
+    for batch in batches:
+        while batch.num_rows:
+            take = min(rows - count, batch.num_rows)
+            pending.append(batch.slice(0, take))
+            batch, count = batch.slice(take), count + take
+            if count == rows:
+                yield pa.concat_batches(pending)
+                pending, count = [], 0
+    if pending:
+        yield pa.concat_batches(pending)
+
+def open_csv(file, include_columns=None, block_size=CSV_BLOCK_SIZE):
+    """流式读取CSV（.gz/.zst/.bz2按扩展名解压）：显式列类型 + 只转换所需列，块内多线程解析"""
+    return pacsv.open_csv(
+        pa.input_stream(str(file), compression='detect'),
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=block_size),
+        convert_options=pacsv.ConvertOptions(column_types=CSV_COLUMN_TYPES, include_columns=include_columns),
+    )
+
+def scan_csv(file, batch_size=BATCH_SIZE, columns=None):
+    """CSV扫描：先读表头确定要读取的列，再按batch_size行产出批次"""
+    names = open_csv(file, block_size=1024**2).schema.names
+    include = source_columns(names, columns)
+    yield from rebatch(open_csv(file, include), batch_size)
+
+def dataset_format(file):
+    """构造pyarrow.dataset读取格式，parquet的低基数列保留字典编码"""
+    fmt = file_format(file)
+    if fmt == 'parquet':
+        return ds.ParquetFileFormat(read_options={'dictionary_columns': DICTIONARY_COLUMNS})
+    return fmt
+
+def localize_naive(values, tz=TIMEZONE):
+    """不含时区的pandas时间视为tz的本地时间，夏令时切换造成的重复/不存在时刻记为空，返回UTC时间"""
+    return values.dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT').dt.tz_convert('UTC')
+
+def parse_mixed_timestamps(ts, tz=TIMEZONE):
+    """格式混杂的ISO8601字符串：带偏移的按偏移换算，不带偏移的视为tz本地时间，无法解析的记为空"""
+    aware = pc.match_substring_regex(ts, r'(Z|[+-]\d{2}(:?\d{2})?)$').fill_null(False).to_numpy(zero_copy_only=False)
+    strings = ts.to_pandas()
+    result = pd.Series(pd.NaT, index=strings.index, dtype='datetime64[us, UTC]')
+    if aware.any():
+        result[aware] = pd.to_datetime(strings[aware], format='ISO8601', utc=True, errors='coerce')
+    if not aware.all():
+        naive = pd.to_datetime(strings[~aware], format='ISO8601', errors='coerce')
+        result[~aware] = localize_naive(naive, tz)
+    return pa.array(result, type=pa.timestamp('us', tz='UTC'))
+
+def normalize_timestamp(ts, fmt=TIMESTAMP_FORMAT, tz=TIMEZONE):
+    """时间戳标准化：解析为目标时区的本地时间，返回(timestamp, hour, date)三列
+
+    不含时区的时间视为tz的本地时间；夏令时切换造成的重复/不存在时刻无法确定，记为空
+    """
+    if pa.types.is_string(ts.type) or pa.types.is_large_string(ts.type):
+        if fmt == 'ISO8601':
+            try:
+                # 带时区偏移的字符串直接解析为UTC时间
+                ts = pc.cast(ts, pa.timestamp('us', tz='UTC'))
+            except pa.ArrowInvalid:
+                try:
+                    # 不含时区的字符串视为目标时区的本地时间
+                    ts = pc.assume_timezone(pc.cast(ts, pa.timestamp('us')), tz)
+                except pa.ArrowInvalid:
+                    # 格式混杂或遇到夏令时切换时退回pandas解析
+                    ts = parse_mixed_timestamps(ts, tz)
+        else:
+            ts = pc.strptime(ts, format=fmt, unit='us', error_is_null=True)
+    if pa.types.is_timestamp(ts.type):
+        if ts.type.tz is None:
+            try:
+                ts = pc.assume_timezone(ts, tz)
+            except pa.ArrowInvalid:
+                ts = pa.array(localize_naive(ts.to_pandas(), tz), type=pa.timestamp('us', tz='UTC'))
+        # 换算到目标时区后去掉时区信息，下游直接使用本地时间
+        ts = pc.local_timestamp(pc.cast(ts, pa.timestamp(ts.type.unit, tz=tz)))
+    # 派生列：小时(0-23)与日期(距1970-01-01的天数)
+    hour = pc.cast(pc.hour(ts), pa.int8())
+    date = pc.cast(pc.cast(ts, pa.date32()), pa.int32())
+    return ts, hour, date
+
+def parse_purchase_column(ph, stats=None):
+    """purchase_history列解析，返回avg_price/categories/items_count三列
+
+    提供stats时累计空记录数与解析失败数
+    """
+    if stats is not None:
+        stats.add('null_purchases', ph.null_count)
+    if pa.types.is_struct(ph.type):
+        # 已是结构体（如Spark导出的数据）时直接取字段
+        fields = {f.name for f in ph.type}
+        def field(names, default):
+            name = next((n for n in names if n in fields), None)
+            return pc.struct_field(ph, name) if name else pa.array(np.full(len(ph), default))
+        avg_price = pc.cast(field(PURCHASE_ALIASES['avg_price'], 0), pa.float64())
+        categories = pc.cast(field(PURCHASE_ALIASES['categories'], 'unknown'), pa.string())
+        items_count = pc.cast(pc.list_value_length(pc.struct_field(ph, 'items')), pa.int64()) \
+            if 'items' in fields else pa.array(np.zeros(len(ph), dtype=np.int64))
+        return (avg_price.fill_null(0), categories.fill_null('unknown'), items_count.fill_null(0))
+
+    # JSON字符串：格式规整的记录用正则直接在Arrow上抽取，避免逐行json.loads；
+    # 其余记录（嵌套结构、值中含引号/括号/转义、键重复或缺失、非法JSON等）退回json解析，结果与parse_purchase_record一致
+    pattern = PURCHASE_PATTERNS
+    parts = pc.extract_regex(ph, pattern['split'])
+    items = pc.struct_field(parts, 'items')
+    top = pc.binary_join_element_wise(pc.struct_field(parts, 'head'), pc.struct_field(parts, 'tail'), '[]')
+    price = pc.struct_field(pc.extract_regex(top, pattern['price']), 'v')
+    cats = pc.struct_field(pc.extract_regex(top, pattern['category']), 'v')
+    eligible = pc.match_substring_regex(ph, pattern['record'])
+    for check in (pc.equal(pc.count_substring_regex(top, pattern['keys']), 3),
+                  pc.match_substring_regex(top, pattern['items']), pc.is_valid(price), pc.is_valid(cats)):
+        eligible = pc.and_(eligible, check)
+    # 商品数：元素为对象时数'{'，否则按逗号分隔计数（字符串元素不含逗号与括号）
+    n_obj = pc.count_substring(items, '{')
+    n_flat = pc.if_else(pc.equal(pc.utf8_length(pc.utf8_trim_whitespace(items)), 0), 0,
+                        pc.add(pc.count_substring(items, ','), 1))
+    items_count = pc.cast(pc.if_else(pc.greater(n_obj, 0), n_obj, n_flat), pa.int64())
+
+    eligible = eligible.fill_null(False)
+    avg_price = pc.if_else(eligible, pc.cast(price, pa.float64()), 0).fill_null(0)
+    categories = pc.if_else(eligible, cats, 'unknown').fill_null('unknown')
+    items_count = pc.if_else(eligible, items_count, 0).fill_null(0)
+    missing = pc.and_(pc.is_valid(ph), pc.invert(eligible))
+    missing = missing.to_numpy(zero_copy_only=False)
+    if missing.any():
+        idx = np.flatnonzero(missing)
+        records, failures = [], 0
+        for record in ph.take(pa.array(idx)).to_pylist():
+            try:
+                records.append(parse_purchase_record(record))
+            except PURCHASE_ERRORS:
+                records.append(PURCHASE_DEFAULTS)
+                failures += 1
+        if stats is not None:
+            stats.add('purchase_parse_failures', failures)
+        parsed = pd.DataFrame(records, columns=list(PURCHASE_DEFAULTS))
+        avg_price = avg_price.to_numpy(zero_copy_only=False).copy()
+        avg_price[idx] = parsed['avg_price'].astype(float).values
+        categories = np.asarray(categories.to_pylist(), dtype=object)
+        categories[idx] = parsed['categories'].astype(str).values
+        items_count = items_count.to_numpy(zero_copy_only=False).copy()
+        items_count[idx] = parsed['items_count'].values
+        avg_price, categories, items_count = (pa.array(avg_price), pa.array(categories, pa.string()),
+                                              pa.array(items_count))
+    return avg_price, categories, items_count
+
+def dictionary_encode(column):
+    """字符串列字典编码（已编码的列原样返回）"""
+    if pa.types.is_dictionary(column.type):
+        return column
+    return pc.dictionary_encode(pc.cast(column, pa.string()))
+
+def adaptive_encode(column, ratio=DICTIONARY_RATIO, probe=ENCODE_PROBE_ROWS):
+    """唯一值占比不超过ratio时字典编码，否则保持为普通字符串（已编码的列按同一规则解码）
+
+    先用开头probe行估计占比，明显接近唯一的列不做整列编码
+    """
+    if not len(column):
+        return column
+    plain = pc.cast(column, pa.string()) if pa.types.is_dictionary(column.type) else column
+    head = plain.slice(0, probe)
+    if pc.count_distinct(head).as_py() > len(head) * ratio:
+        return plain
+    encoded = dictionary_encode(column)
+    return encoded if len(encoded.dictionary) <= len(column) * ratio else plain
+
+class ProvinceCache:
+    """地址前缀 -> 省份编码的有界LRU缓存
     
-    # 获取文件列表
-    files = glob.glob(valid_files) if if_file_pattern else valid_files
-    print(f"读取 {len(files)} 个文件")
+    同一用户的地址在其每条交易记录中重复出现，且大量用户共享地址前缀，
+    以前缀为键缓存匹配结果后，绝大多数行的省份解析只需一次哈希查找。
+    只缓存前缀足以确定的结果，命中与否都与不带缓存的match_provinces结果一致。
+    指定path时可在多次运行间持久化（JSON，保存省份名称）。
+    """
+    def __init__(self, maxsize=PROVINCE_CACHE_SIZE, prefix_len=ADDRESS_PREFIX_LEN, path=None):
+        self.maxsize = maxsize
+        self.prefix_len = prefix_len
+        # 匹配起始位置（字符）小于该值时，前缀内的匹配即为整串的最早匹配
+        self.decided_len = max(prefix_len - max(map(len, PROVINCE_LIST)) + 1, 0)
+        self.path = Path(path) if path else None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.lookups = 0
+        self.lock = threading.Lock()
+        if self.path and self.path.exists():
+            self.load(self.path)
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def resolve(self, values, weights=None):
+        """解析地址数组的省份编码，weights为每个地址在批次中的出现次数（用于统计行级命中率）"""
+        unknown = len(PROVINCE_LIST)
+        prefixes = pc.dictionary_encode(pc.utf8_slice_codeunits(values, 0, self.prefix_len))
+        keys = prefixes.dictionary.to_pylist()
+        key_codes = np.full(len(keys) + 1, unknown, dtype=np.int8)  # 末位对应空地址
+        hit = np.zeros(len(keys) + 1, dtype=bool)
+
+        # 查缓存
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                code = self.entries.get(key)
+                if code is None:
+                    missing.append(i)
+                else:
+                    self.entries.move_to_end(key)
+                    key_codes[i], hit[i] = code, True
+        # 未命中的前缀批量匹配后写入缓存
+        if missing:
+            prefixes_missing = pa.array([keys[i] for i in missing], pa.string())
+            computed, starts = find_provinces(prefixes_missing)
+            # 前缀只在匹配从开头decided_len个字符内开始时才能确定结果：更早开始、延伸到前缀之外的
+            # 省份名称不可能存在。其余前缀记为'unknown'，与未匹配的一样退回整串匹配
+            decided = starts < pc.binary_length(pc.utf8_slice_codeunits(
+                prefixes_missing, 0, self.decided_len)).to_numpy(zero_copy_only=False)
+            computed[~decided] = unknown
+            key_codes[missing] = computed
+            with self.lock:
+                for i, code in zip(missing, computed):
+                    self.entries[keys[i]] = code
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+
+        index = prefixes.indices.fill_null(len(keys)).to_numpy()
+        codes = key_codes[index]
+        # 前缀不能确定省份的地址，退回整串匹配（不缓存）
+        fallback = np.flatnonzero((codes == unknown) & values.is_valid().to_numpy(zero_copy_only=False))
+        if len(fallback):
+            codes[fallback] = match_provinces(values.take(pa.array(fallback)))
+
+        weights = np.ones(len(values), dtype=np.int64) if weights is None else weights
+        with self.lock:
+            self.hits += int(weights[hit[index]].sum())
+            self.lookups += int(weights.sum())
+        return codes
+
+    def load(self, path):
+        """从JSON文件加载缓存（版本或前缀长度不一致的文件忽略）"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != PROVINCE_CACHE_VERSION or data.get('prefix_len') != self.prefix_len:
+            return
+        names = {name: code for code, name in enumerate(PROVINCE_LIST + ['unknown'])}
+        with self.lock:
+            for key, name in data['entries'].items():
+                if name in names:
+                    self.entries[key] = np.int8(names[name])
+
+    def save(self, path=None):
+        """保存缓存到JSON文件（先写临时文件再替换）"""
+        path = Path(path or self.path)
+        names = PROVINCE_LIST + ['unknown']
+        with self.lock:
+            entries = {key: names[code] for key, code in self.entries.items()}
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': PROVINCE_CACHE_VERSION, 'prefix_len': self.prefix_len, 'entries': entries},
+                      f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+def resolve_province(address, cache=None):
+    """地址解析：向量化匹配省份名称，未匹配的标记为'unknown'
     
-    # 第一层进度条：文件处理进度
-    with tqdm(files, desc="Processing files", unit="file") as file_pbar:
-        for file in file_pbar:
-            # 设置当前文件的进度描述
-            file_pbar.set_postfix(file=str(file).split("\\")[-1][:10])  # 显示文件名（取后10字符）
-            
-            # 第二层进度条：块处理进度
-            chunk_iter = pd.read_csv(file, chunksize=1000000)
-            with tqdm(desc="Processing chunks", unit="chunk", leave=False) as chunk_pbar:
-                for chunk in chunk_iter:
-                    # 解析关键字段
-                    chunk[['avg_price', 'categories', 'items_count']] = chunk['purchase_history'].apply(parse_purchase_history)
-                    
-                    # 地址解析
-                    # 将chinese_address建名称改为address
-                    if 'chinese_address' in chunk.columns and 'address' not in chunk.columns:
-                        chunk.rename(columns={'chinese_address': 'address'}, inplace=True)
-                    # 从中文地址中提取省市信息
-                    province_mapper = mapper.province_country_mapper
-                    province_list = [p for p in province_mapper.keys() 
-                                   if p.endswith(('市', '省', '自治区', '特别行政区'))]
-                    # 解析chunk["chinese_address"]列
-                    chunk['province'] = chunk['address'].apply(
-                        lambda x: next((p for p in province_list if p in x), 'unknown'))
-                    
-                    # 将last_login键名称改为timestamp
-                    if 'last_login' in chunk.columns and 'timestamp' not in chunk.columns:
-                        chunk.rename(columns={'last_login': 'timestamp'}, inplace=True)
-                    # 将fullname键名称改为chinese_name
-                    if 'fullname' in chunk.columns and 'chinese_name' not in chunk.columns:
-                        chunk.rename(columns={'fullname': 'chinese_name'}, inplace=True)
-                    
-                    chunks.append(chunk)
-                    chunk_pbar.update(1)  # 更新块进度条
-                    chunk_pbar.set_postfix(current_size=f"{len(chunks)*10000:,} rows") 
-    return pd.concat(chunks)
+    address为字典数组时只匹配去重后的字典值，再按索引映射回每一行；
+    提供cache时按地址前缀查缓存
+    """
+    is_dict = pa.types.is_dictionary(address.type)
+    values = address.dictionary if is_dict else address
+    if cache is None:
+        codes = match_provinces(values)
+    else:
+        # 每个字典值在批次中的出现次数，用于统计行级命中率
+        weights = np.bincount(address.indices.drop_null().to_numpy(), minlength=len(values)) if is_dict else None
+        codes = cache.resolve(values, weights)
+    if is_dict:
+        # 空地址映射到末位的'unknown'
+        lookup = np.append(codes, np.int8(len(PROVINCE_LIST)))
+        codes = lookup[address.indices.fill_null(len(values)).to_numpy()]
+    return pa.DictionaryArray.from_arrays(pa.array(codes), PROVINCE_DICTIONARY)
 
-def load_parquet_data(valid_files, if_file_pattern=False):
-    """Parquet文件读取"""
+def take_rows(columns, index):
+    """按行号抽取各列"""
+    index = pa.array(index)
+    return {name: column.take(index) for name, column in columns.items()}
+
+def normalize_batch(batch, province_cache=None, geo_resolver=None, keep=None, stats=None,
+                    sampler=None, file=None, row_filter=None, offset=0):
+    """单批次标准化：列名别名映射 + 派生列计算，全部在Arrow上完成
+    
+    提供geo_resolver时额外解析city/area两列；keep不为None时只保留其中的列；
+    提供stats时顺带统计数据质量（复用解析过程中已有的结果）；
+    提供sampler时在批次内抽样并添加sample_weight、sample_cluster列，派生列只对入样的行计算
+    （file为批次所属文件，offset为批次首行在该文件扫描数据中的位置，决定抽样随机数）；
+    提供row_filter时在省份解析与时间戳标准化之后按行筛选，之后的解析只对保留的行进行
+    """
+    columns = {}
+    for name, column in zip(batch.schema.names, batch.columns):
+        alias = COLUMN_ALIASES.get(name, name)
+        # 标准列名已存在时保留原列名
+        columns[name if alias in batch.schema.names and alias != name else alias] = column
+
+    # 统一列类型（无法转换时保留原类型）
+    for name, dtype in COLUMN_TYPES.items():
+        if name in columns and columns[name].type != dtype:
+            try:
+                columns[name] = pc.cast(columns[name], dtype)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                pass
+
+    # 均匀抽样：解析之前抽取，只解析入样的行
+    num_rows, weights = batch.num_rows, None
+    if sampler is not None and not sampler.stratify:
+        index, weights, clusters = sampler.sample(num_rows, file, offset=offset)
+        columns, num_rows = take_rows(columns, index), len(index)
+    # 低基数字符串列字典编码
+    for name in DICTIONARY_COLUMNS:
+        if name in columns:
+            columns[name] = dictionary_encode(columns[name])
+    for name in ADDRESS_COLUMNS:
+        if name in columns:
+            columns[name] = adaptive_encode(columns[name])
+    # 地址解析
+    if 'address' in columns:
+        columns['province'] = resolve_province(columns['address'], province_cache)
+    # 按省份分层抽样：省份解析之后抽取
+    if sampler is not None and sampler.stratify:
+        strata = columns['province'].indices.to_numpy(zero_copy_only=False) if 'province' in columns else None
+        index, weights, clusters = sampler.sample(num_rows, file, strata, offset)
+        columns, num_rows = take_rows(columns, index), len(index)
+    if weights is not None:
+        columns['sample_weight'] = pa.array(weights)
+        columns['sample_cluster'] = pa.array(clusters)
+    # 时间戳标准化（在按行筛选之前，筛选直接使用date列）
+    if 'timestamp' in columns:
+        columns['timestamp'], columns['hour'], columns['date'] = normalize_timestamp(columns['timestamp'])
+    if row_filter is not None and num_rows:
+        index = np.flatnonzero(row_filter.mask(columns).to_numpy(zero_copy_only=False))
+        if len(index) < num_rows:
+            columns, num_rows = take_rows(columns, index), len(index)
+    if geo_resolver is not None and 'address' in columns:
+        columns['city'], columns['area'] = geo_resolver.resolve_columns(columns['address'], columns['province'])
+    # 解析purchase_history
+    if 'purchase_history' in columns:
+        columns['avg_price'], columns['categories'], columns['items_count'] = \
+            parse_purchase_column(columns['purchase_history'], stats)
+        columns['categories'] = dictionary_encode(columns['categories'])
+    if stats is not None:
+        batch_quality(columns, num_rows, stats)
+    if keep is not None:
+        columns = {name: column for name, column in columns.items() if name in keep}
+    return pa.table(columns)
+
+def batch_quality(columns, num_rows, stats):
+    """标准化后的批次数据质量计数：未识别省份、空时间戳、异常客单价、批次内重复记录"""
+    stats.add('rows', num_rows)
+    if 'province' in columns:
+        stats.add('unknown_provinces', np.count_nonzero(
+            columns['province'].indices.to_numpy(zero_copy_only=False) == len(PROVINCE_LIST)))
+    if 'hour' in columns:
+        stats.add('null_timestamps', columns['hour'].null_count)
+    if 'avg_price' in columns:
+        price = columns['avg_price'].to_numpy(zero_copy_only=False)
+        stats.add('out_of_range_prices', np.count_nonzero((price < PRICE_RANGE[0]) | (price > PRICE_RANGE[1])))
+    if 'user_name' in columns and 'timestamp' in columns:
+        keys = pa.table({'user_name': columns['user_name'], 'timestamp': columns['timestamp']})
+        stats.add('duplicate_user_rows_in_batch', num_rows - keys.group_by(['user_name', 'timestamp']).aggregate([]).num_rows)
+
+def select_row_groups(dataset, file, sampler=None, row_filter=None):
+    """Parquet行组选择：行组抽样和/或按行组索引跳过不符合筛选条件的行组"""
+    fragments = []
+    for fragment in dataset.get_fragments():
+        row_groups = range(fragment.num_row_groups)
+        if sampler is not None:
+            row_groups = sampler.row_groups(file, fragment.num_row_groups)
+        if row_filter is not None:
+            selected = set(row_filter.select(file))
+            row_groups = [i for i in row_groups if i in selected]
+        if sampler is not None:
+            sampler.record_row_groups(file, row_groups, [fragment.metadata.row_group(i).num_rows for i in row_groups])
+        if row_groups:
+            fragments.append(fragment.subset(row_group_ids=list(row_groups)))
+    return ds.FileSystemDataset(fragments, dataset.schema, dataset.format, dataset.filesystem)
+
+def scan_files(files, batch_size=BATCH_SIZE, readahead=PREFETCH_DEPTH, columns=None, sampler=None,
+               row_filter=None):
+    """依次扫描文件产出(file, batch, offset)，读取失败时产出(file, 异常, offset)
+
+    offset为批次首行在该文件扫描数据中的位置（与批次划分方式无关，用于确定抽样随机数）；
+    提供sampler时对parquet做行组抽样；提供row_filter时跳过不相关的行组，
+    保留的行组可能零散且大小不一，重新划分为batch_size行的均衡批次再交给解析线程
+    """
+    for file in files:
+        offset = 0
+        try:
+            if file_format(file) == 'csv':
+                for batch in scan_csv(file, batch_size, columns):
+                    yield file, batch, offset
+                    offset += batch.num_rows
+                continue
+            dataset = ds.dataset(str(file), format=dataset_format(file))
+            if file_format(file) == 'parquet' and (sampler is not None or row_filter is not None):
+                dataset = select_row_groups(dataset, file, sampler, row_filter)
+            # batch_readahead：在Arrow线程池中提前读取并解码后续批次
+            batches = dataset.to_batches(columns=source_columns(dataset.schema.names, columns),
+                                         batch_size=batch_size, batch_readahead=readahead)
+            if row_filter is not None:
+                batches = rebatch(batches, batch_size)
+            for batch in batches:
+                yield file, batch, offset
+                offset += batch.num_rows
+        except Exception as e:
+            yield file, e, offset
+
+def process_batch(item, province_cache=None, geo_resolver=None, keep=None, sampler=None, summaries=(),
+                  row_filter=None):
+    """解析工作线程：标准化单个批次，返回(file, 表或异常, 耗时, 批次质量统计, 批次汇总)
+
+    summaries为需要按批次构建的汇总类型（名称 -> 带from_table的类，如Cube、Sketches），批次汇总为名称 -> 结果
+    """
+    file, batch, offset = item
+    stats = QualityStats()
+    if isinstance(batch, Exception):
+        return file, batch, 0.0, stats, {}
+    start_time = time.time()
+    try:
+        table = normalize_batch(batch, province_cache, geo_resolver, keep, stats, sampler, file, row_filter, offset)
+        partials = {name: kind.from_table(table) for name, kind in dict(summaries).items()}
+        return file, table, time.time() - start_time, stats, partials
+    except Exception as e:
+        return file, e, 0.0, stats, {}
+
+def load_dataset(valid_files, if_file_pattern=False, batch_size=BATCH_SIZE, as_pandas=True,
+                 workers=PARSE_WORKERS, prefetch_depth=PREFETCH_DEPTH, province_cache=None,
+                 geo_level='province', columns=None, quality=None, checkpoint=None, sampler=None,
+                 governor=None, cube=None, sketches=None, row_filter=None):
+    """统一数据加载：CSV/Parquet/Feather，标准化在Arrow上完成，最后再转换为pandas
+    
+    读取（后台线程+Arrow解码线程池）与解析（workers个线程）流水线并行，
+    prefetch_depth控制预取队列深度，队列满时读取端阻塞（背压）；
+    province_cache为地址前缀缓存，未提供时新建（仅在本次运行内有效）；
+    geo_level为'city'时额外解析市、区县两级（city/area列）；
+    columns为需要的标准列名（含派生列），为None时读取全部列；
+    quality为QualityStats时按文件合并各批次的数据质量统计（读取失败的文件不计入）；
+    checkpoint为Checkpoint时每个文件完成后写出检查点，已有有效检查点的文件直接从检查点读取；
+    sampler为Sampler时只读取抽样数据（parquet行组抽样 + 批次内抽样），结果带sample_weight、sample_cluster列；
+    governor为MemoryGovernor时按内存预算自适应调整批大小（batch_size不再生效），接近上限时压缩/落盘已读取的数据；
+    cube为Cube时在解析线程中按批次构建聚合立方体，按文件合并（读取失败的文件不计入）；
+    sketches为Sketches时同样按批次构建去重计数与高频项统计；
+    row_filter为RowGroupFilter时按行组索引跳过不相关的行组，并按行筛选（日期范围、省份）
+    """
+    province_cache = province_cache if province_cache is not None else ProvinceCache()
+    geo_resolver = GeoResolver() if geo_level == 'city' and (columns is None or 'city' in columns) else None
+    if sampler is not None and sampler.stratify and columns is not None:
+        columns = list(columns) + ['province']  # 分层抽样需要省份
+    # 按批次构建的汇总（合并到调用方传入的对象）
+    summaries = {name: target for name, target in (('cube', cube), ('sketches', sketches)) if target is not None}
+    if columns is not None:
+        if cube is not None:
+            columns = sorted(set(columns) | set(CUBE_COLUMNS))
+        if sketches is not None:
+            columns = sorted(set(columns) | set(SKETCH_COLUMNS))
+        if row_filter is not None:
+            columns = sorted(set(columns) | set(row_filter.columns))
+    keep = set(columns) | set(SAMPLE_COLUMNS) if columns is not None else None
     files = glob.glob(valid_files) if if_file_pattern else valid_files
     print(f"读取 {len(files)} 个文件")
-    all_dfs = []
-    
+    unsupported = [f for f in files if file_format(f) is None]
+    for file in unsupported:
+        print(f"警告：不支持的文件类型 {''.join(Path(file).suffixes[-2:])}，跳过 {file}")
+    files = [f for f in files if file_format(f) is not None]
+    tables = []
+
+    # 从检查点恢复已完成的文件
+    if checkpoint is not None:
+        restored = [f for f in files if checkpoint.lookup(f) is not None]
+        for file in restored:
+            table, counts = checkpoint.load(file)
+            tables.append(table)
+            for target in summaries.values():
+                target.merge(type(target).from_table(table))
+            if quality is not None and counts is not None:
+                file_quality = QualityStats()
+                # 旧版本检查点中已不再统计的项忽略
+                file_quality.counts.update({name: count for name, count in counts.items() if name in file_quality.counts})
+                quality.merge(file_quality, file=file)
+        if restored:
+            print(f"从检查点恢复 {len(restored)} 个文件（{sum(t.num_rows for t in tables):,}行）")
+        files = [f for f in files if f not in restored]
+
     # 进度条配置
-    file_progress = tqdm(files, desc="文件进度", unit="file", 
+    file_progress = tqdm(total=len(files), desc="文件进度", unit="file",
                        bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]")
-    
-    for file in file_progress:
-        try:
-            # 获取文件元数据
-            parquet_file = pq.ParquetFile(file)
-            total_rows = parquet_file.metadata.num_rows
-            file_size = os.path.getsize(file) / 1024**2  # MB
-            
+    current, batches, read_progress, file_quality, file_summaries = None, [], None, None, {}
+
+    def finish_file():
+        """合并当前文件数据并关闭其进度条"""
+        if batches:
+            tables.append(pa.concat_tables(conform_tables(batches), promote_options='permissive'))
+            if quality is not None:
+                quality.merge(file_quality, file=current)
+            for name, target in summaries.items():
+                target.merge(file_summaries[name])
+            if checkpoint is not None:
+                checkpoint.save(current, tables[-1], dict(file_quality.counts))
+        if read_progress is not None:
+            read_progress.close()
+            file_progress.update(1)
+
+    # 读取 -> 预取队列 -> 并行解析，输出保持文件与批次顺序
+    if governor is None:
+        scanned = scan_files(files, batch_size, prefetch_depth, columns, sampler, row_filter)
+    else:
+        # 按较小粒度扫描，再按内存预算合并为批次
+        scanned = governor.coalesce(scan_files(files, SCAN_ROWS, prefetch_depth, columns, sampler, row_filter))
+    pipeline = parallel_map(partial(process_batch, province_cache=province_cache,
+                                    geo_resolver=geo_resolver, keep=keep, sampler=sampler,
+                                    summaries={name: type(target) for name, target in summaries.items()},
+                                    row_filter=row_filter),
+                            prefetch(scanned, prefetch_depth),
+                            workers=workers, depth=workers + prefetch_depth)
+    for file, table, time_cost, batch_stats, partials in pipeline:
+        if file != current:
+            finish_file()
+            current, batches, file_quality = file, [], QualityStats()
+            file_summaries = {name: type(target)() for name, target in summaries.items()}
+            fmt = file_format(file)
+            # parquet从元数据获取行数，CSV需要完整扫描才能得到，不统计（抽样时不统计）；筛选运行为保留行组的行数
+            total_rows = ds.dataset(str(file), format=fmt).count_rows() \
+                if fmt != 'csv' and sampler is None and not isinstance(table, Exception) else None
+            if row_filter is not None and total_rows is not None:
+                total_rows = row_filter.selected_rows(file)
+            file_size = os.path.getsize(file) / 1024**2 if os.path.exists(file) else 0  # MB
+
             # 初始化文件进度条
             file_progress.set_postfix(
                 file=os.path.basename(file)[:10],
                 size=f"{file_size:.1f}MB",
-                rows=f"{total_rows//10000}万行"
+                rows=f"{total_rows//10000}万行" if total_rows is not None else "未知"
             )
-            
+
             # 创建读取进度条
             read_progress = tqdm(
                 total=total_rows,
@@ -127,68 +741,69 @@ def load_parquet_data(valid_files, if_file_pattern=False):
                 leave=False,
                 bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]"
             )
-            
-            # 分批次读取（自动内存管理）
-            batches = []
-            for batch in parquet_file.iter_batches(batch_size=1250000):
-                # 记录读取开始时间
-                start_time = time.time()
-                
-                # 转换batch为pandas DataFrame
-                df = batch.to_pandas()
-                
-                # 解析字段
-                df[['avg_price', 'categories', 'items_count']] = df['purchase_history'].apply(parse_purchase_history)
-                
-                # 地址解析
-                # 将chinese_address建名称改为address
-                if 'chinese_address' in df.columns and 'address' not in df.columns:
-                    df.rename(columns={'chinese_address': 'address'}, inplace=True)
-                # 从mapper.province_country_mapper的key中获取省信息列表（包含市，省，自治区）
-                province_mapper = mapper.province_country_mapper
-                province_list = list(province_mapper.keys())
-                # 筛选只以市，省，自治区，特别行政区结尾的省信息
-                province_list = [i for i in province_list if i.endswith(('市', '省', '自治区', '特别行政区'))]
-                # 解析chunk["chinese_address"]列
-                df['province'] = 'unknown'
-                for province in province_list:
-                    # mask = df['chinese_address'].str.contains(province, na=False)
-                    mask = df['address'].str.contains(province, na=False)
-                    df.loc[mask, 'province'] = province
-                
-                # 将last_login键名称改为timestamp
-                if 'last_login' in df.columns and 'timestamp' not in df.columns:
-                    df.rename(columns={'last_login': 'timestamp'}, inplace=True)
-                # 将fullname键名称改为chinese_name
-                if 'fullname' in df.columns and 'chinese_name' not in df.columns:
-                    df.rename(columns={'fullname': 'chinese_name'}, inplace=True)
-                
-                batches.append(df)
-                
-                # 更新进度条
-                batch_rows = len(df)
-                time_cost = time.time() - start_time
-                read_progress.update(batch_rows)
-                read_progress.set_postfix(
-                    speed=f"{batch_rows/time_cost:.0f} rows/s",
-                    mem=f"{df.memory_usage(deep=True).sum()/1024**2:.1f}MB"
-                )
-            
-            # 合并当前文件数据
-            file_df = pd.concat(batches, ignore_index=True)
-            all_dfs.append(file_df)
-            read_progress.close()
-            
-        except Exception as e:
-            print(f"\n 文件 {file} 读取失败: {str(e)}")
+        if batches is None:
+            # 当前文件已失败，丢弃其余批次
             continue
-    
-    # 合并所有文件数据
-    return pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()
+        if isinstance(table, Exception):
+            print(f"\n 文件 {file} 读取失败: {str(table)}")
+            if quality is not None:
+                quality.failed_files.append(str(file))
+            batches = None
+            continue
+        batches.append(table)
+        file_quality.merge(batch_stats)
+        for name, partial_summary in partials.items():
+            file_summaries[name].merge(partial_summary)
+        if governor is not None:
+            governor.observe('normalized', table.nbytes, table.num_rows)
+            governor.relieve(tables)
+            governor.relieve(batches)
+
+        # 更新进度条
+        batch_rows = table.num_rows
+        read_progress.update(batch_rows)
+        read_progress.set_postfix(
+            speed=f"{batch_rows/max(time_cost, 1e-9):.0f} rows/s",
+            mem=f"{table.nbytes/1024**2:.1f}MB",
+            hit=f"{province_cache.hit_rate:.0%}",
+            **({'batch': f"{governor.batch_size:,}"} if governor is not None else {})
+        )
+    finish_file()
+    file_progress.close()
+    print(f"省份缓存命中率: {province_cache.hit_rate:.1%}")
+    if quality is not None:
+        print(quality.summary())
+    if province_cache.path:
+        province_cache.save()
+
+    # 合并所有文件数据（不同文件的列类型不一致时自动提升）
+    table = pa.concat_tables(conform_tables(tables), promote_options='permissive') if tables else pa.table({})
+    tables = batches = None
+    # 日期列（date32）转为datetime64而不是逐个datetime.date对象，后续按月份计算时无需再逐值解析
+    if governor is None:
+        return table.to_pandas(date_as_object=False) if as_pandas else table
+    try:
+        # 逐列转换并释放Arrow内存
+        return table.to_pandas(split_blocks=True, self_destruct=True, date_as_object=False) if as_pandas else table
+    finally:
+        print(governor.summary())
+        governor.cleanup()
+
+def load_data(file_pattern):
+    """高效加载合并多个文件（支持通配符）"""
+    return load_dataset(file_pattern, if_file_pattern=True)
+
+def load_csv_data(valid_files, if_file_pattern=False):
+    """高效加载合并多个CSV文件"""
+    return load_dataset(valid_files, if_file_pattern=if_file_pattern)
+
+def load_parquet_data(valid_files, if_file_pattern=False):
+    """Parquet文件读取"""
+    return load_dataset(valid_files, if_file_pattern=if_file_pattern)
 
 def main():
     # 使用示例
     df = load_data("./data/*.csv")  # 支持通配符匹配多个文件
-    
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
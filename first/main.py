@@ -1,41 +1,212 @@
 # main.py
 import time
-import sys
+import argparse
 from pathlib import Path
 # from new import *
-from load_and_preprocess import *
-from visualization import *
-from user_analysis import *
-
-def main():
-    # 命令行参数处理
-    if len(sys.argv) < 2:
-        print("用法: python main.py [文件/文件夹]... [-o 分析结果输出目录]")
+# 加载、绘图与分析模块依赖pandas/matplotlib/pyecharts等，导入较慢：
+# 数据加载模块在main中导入，各阶段在执行时才导入所需模块（--help等无需加载）
+from pipeline import Stage, select_stages, required_columns, run_stages
+from prefetch import PREFETCH_DEPTH
+from writers import OUTPUT_FORMATS, write_outputs
+from quality import QualityStats
+
+"""分析阶段定义：每个阶段声明所需数据列与依赖的上游阶段"""
+def stage_province_counts(df, results, base_dir):
+    """各省记录数（地域分布与城市下钻共用）"""
+    if results.get('cube') is not None:
+        return results['cube'].province_counts()
+    from visualization import count_by
+    from sampling import sample_weights
+    return count_by(df['province'], sample_weights(df))
+
+def stage_province(df, results, base_dir):
+    """地域分布热力图"""
+    from visualization import plot_province_distribution
+    plot_province_distribution(df, base_dir=base_dir, province_count=results['province_counts'])
+
+def stage_province_metrics(df, results, base_dir):
+    """各省多指标聚合（用户数、总收入、平均信用分、销售额）"""
+    from visualization import province_aggregates
+    return province_aggregates(df)
+
+def stage_dashboard(df, results, base_dir):
+    """多指标省份看板（单页面，浏览器端切换指标）"""
+    from visualization import plot_province_dashboard
+    from sampling import sample_note
+    plot_province_dashboard(results['province_metrics'], base_dir=base_dir, note=sample_note(df))
+
+def stage_city(df, results, base_dir):
+    """城市级下钻热力图"""
+    from visualization import plot_city_distribution
+    if 'city' not in df.columns:
+        print("提示：未解析城市信息（--geo province），跳过城市级下钻")
+        return
+    plot_city_distribution(df, base_dir=base_dir, province_count=results['province_counts'])
+
+def stage_price(df, results, base_dir):
+    """客单价分布"""
+    from visualization import init_plot_style, plot_price_distribution
+    init_plot_style()
+    plot_price_distribution(df, base_dir=base_dir)
+
+def stage_category_sales(df, results, base_dir):
+    """各品类销售额"""
+    if results.get('cube') is not None:
+        return results['cube'].category_sales()
+    from visualization import category_sales
+    return category_sales(df)
+
+def stage_category(df, results, base_dir):
+    """品类销售额top 10"""
+    from visualization import init_plot_style, plot_category_sales
+    init_plot_style()
+    plot_category_sales(df, base_dir=base_dir, category_data=results['category_sales'])
+
+def stage_hourly_counts(df, results, base_dir):
+    """各小时活跃记录数"""
+    if results.get('cube') is not None:
+        return results['cube'].hourly_counts()
+    from visualization import hourly_counts
+    return hourly_counts(df)
+
+def stage_timeline(df, results, base_dir):
+    """用户活跃时段分布"""
+    from visualization import init_plot_style, plot_activity_timeline
+    init_plot_style()
+    plot_activity_timeline(df, base_dir=base_dir, hourly_count=results['hourly_counts'])
+
+def stage_rfm(df, results, base_dir):
+    """用户画像构建（RFM）"""
+    from user_analysis import build_user_profiles
+    return build_user_profiles(df)
+
+def stage_hv(df, results, base_dir):
+    """高价值用户识别"""
+    from user_analysis import identify_high_value_users
+    return identify_high_value_users(results['rfm'], df)
+
+def stage_cohort(df, results, base_dir):
+    """注册月份 × 活跃月份留存矩阵"""
+    from user_analysis import cohort_retention
+    if 'registration_date' not in df.columns:
+        print("提示：数据集中不包含'registration_date'列，跳过留存分析")
+        return
+    return cohort_retention(df)
+
+def stage_retention(df, results, base_dir):
+    """留存热力图"""
+    from visualization import plot_cohort_retention
+    if results['cohort'] is None:
+        return
+    # 去重用户数无法按权重放大，抽样时留存率为样本内比例
+    note = "抽样预览：留存率为样本内比例" if 'sample_weight' in df.columns else ''
+    plot_cohort_retention(results['cohort'], base_dir=base_dir, note=note)
+
+STAGES = [
+    Stage('province_counts', stage_province_counts, columns=['province']),
+    Stage('province', stage_province, requires=['province_counts']),
+    Stage('province_metrics', stage_province_metrics,
+          columns=['province', 'income', 'credit_score', 'avg_price', 'items_count']),
+    Stage('dashboard', stage_dashboard, requires=['province_metrics']),
+    Stage('city', stage_city, columns=['province', 'city', 'area'], requires=['province_counts']),
+    Stage('price', stage_price, columns=['avg_price'], plotting=True),
+    Stage('category_sales', stage_category_sales, columns=['categories', 'avg_price']),
+    Stage('category', stage_category, columns=['categories', 'avg_price'], requires=['category_sales'],
+          plotting=True),
+    Stage('hourly_counts', stage_hourly_counts, columns=['hour']),
+    Stage('timeline', stage_timeline, columns=['hour'], requires=['hourly_counts'], plotting=True),
+    Stage('rfm', stage_rfm, columns=['user_name', 'timestamp', 'avg_price', 'items_count']),
+    Stage('hv', stage_hv, columns=['user_name', 'chinese_name', 'province', 'income', 'is_active', 'credit_score'],
+          requires=['rfm']),
+    Stage('cohort', stage_cohort, columns=['user_name', 'registration_date', 'timestamp']),
+    Stage('retention', stage_retention, requires=['cohort']),
+]
+
+def intermediate_outputs(results):
+    """可导出的中间聚合结果（只包含本次运行过的阶段）"""
+    named = {
+        'province_counts': lambda r: r.rename_axis('province').rename('count'),
+        'province_metrics': lambda r: r,
+        'hourly_counts': lambda r: r.rename_axis('hour').rename('count'),
+        'category_sales': lambda r: r.rename_axis('categories').rename('sales'),
+        'rfm': lambda r: r,
+        'cohort': lambda r: r.rename(columns=str).reset_index(),
+    }
+    return {name: convert(results[name]) for name, convert in named.items() if results.get(name) is not None}
+
+def parse_args(argv=None):
+    """命令行参数处理"""
+    parser = argparse.ArgumentParser(description="乐学数据分析：地域分布、消费分析与RFM高价值用户识别")
+    parser.add_argument('paths', nargs='+', metavar='文件/文件夹', help="数据文件或目录（CSV/Parquet/Feather）")
+    parser.add_argument('-o', dest='output_dir', default=None, help="分析结果输出目录")
+    parser.add_argument('--only', default=None,
+                        help=f"只运行指定阶段（逗号分隔，自动包含依赖），可选: {','.join(s.name for s in STAGES)}")
+    parser.add_argument('--jobs', type=int, default=4, help="并发执行的分析阶段数")
+    parser.add_argument('--workers', type=int, default=None, help="解析线程数（默认min(8, CPU核数)）")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="绘图阶段在N个子进程中并行执行（数据集写出为内存映射Arrow文件共享，不复制到子进程）")
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_DEPTH, help="预取深度")
+    parser.add_argument('--max-memory', default=None, metavar='SIZE',
+                        help="加载内存上限（如4G、512M）：按内存预算自适应调整批大小，接近上限时压缩/落盘已读取的数据；"
+                             "只作用于加载过程，加载结束转换为DataFrame时落盘数据会读回内存，分析阶段的内存约为整个数据集")
+    parser.add_argument('--province-cache', default=None, help="省份缓存文件（跨运行持久化）")
+    parser.add_argument('--geo', choices=['province', 'city'], default='province',
+                        help="地址解析层级：province只解析省份；city额外解析市、区县两级（用于城市级下钻，加载耗时明显增加）")
+    parser.add_argument('--assets-host', default=None,
+                        help="ECharts资源地址（如本地目录assets/，需包含echarts.min.js与maps/），所有地图页面共用")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="每个文件加载完成后在输出目录的checkpoints/下写出检查点")
+    parser.add_argument('--resume', action='store_true',
+                        help="从已有检查点续跑，跳过已完成的文件（隐含--checkpoint）")
+    parser.add_argument('--sample', type=float, default=None, metavar='RATE',
+                        help="抽样预览（如0.01）：parquet行组抽样 + 批次内抽样，计数类结果按权重放大")
+    parser.add_argument('--stratify', choices=['province'], default=None, help="按省份分层抽样（配合--sample）")
+    parser.add_argument('--seed', type=int, default=0, help="抽样随机种子")
+    parser.add_argument('--cube', action='store_true',
+                        help="加载时构建省份×品类×小时×价格区间聚合立方体（保存为cube.npz），计数与销售额类结果由立方体汇总")
+    parser.add_argument('--sketches', action='store_true',
+                        help="加载时统计各省去重用户数与地址/品类高频项（固定内存，保存为sketches.npz与sketches_report.txt）")
+    parser.add_argument('--top', type=int, default=20, help="概要统计报告中高频项的显示数量")
+    parser.add_argument('--summary', action='store_true',
+                        help="只显示数据集概况（行数、时间范围、收入范围、各省行数），由parquet行组索引得到，不加载数据")
+    parser.add_argument('--start', default=None, metavar='YYYY-MM-DD', help="只分析该日期及之后的记录")
+    parser.add_argument('--end', default=None, metavar='YYYY-MM-DD', help="只分析该日期及之前的记录")
+    parser.add_argument('--provinces', default=None, help="只分析指定省份的记录（逗号分隔）")
+    parser.add_argument('--index-dir', default=None,
+                        help="parquet行组索引目录（默认为输出目录下的rgindex，--summary与筛选运行时使用）")
+    parser.add_argument('--index-beside-data', action='store_true',
+                        help="行组索引写在源文件旁，供其他输出目录的运行复用（需要数据目录可写）")
+    parser.add_argument('--format', default='csv',
+                        help=f"结果输出格式（逗号分隔），可选: {','.join(OUTPUT_FORMATS)}")
+    parser.add_argument('--export-intermediates', action='store_true',
+                        help="同时导出中间聚合结果（省份计数、省份指标、小时分布、品类销售额、完整RFM表、留存矩阵）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """命令行参数处理"""
+    args = parse_args(argv)
+    from load_and_preprocess import PARSE_WORKERS, ProvinceCache, collect_files, file_format, load_dataset
+    # 收集目录下所有支持格式的文件（跳过输出目录，输出目录可能位于数据目录内）
+    file_paths, output_dir = collect_files(args.paths, exclude=[args.output_dir or '.']), args.output_dir
+    
+    # 输出格式
+    formats = args.format.split(',')
+    unknown_formats = [f for f in formats if f not in OUTPUT_FORMATS]
+    if unknown_formats:
+        print(f"错误：不支持的输出格式 {', '.join(unknown_formats)}（可选: {', '.join(OUTPUT_FORMATS)}）")
         return False
     
-    """命令行参数处理"""
-    # 读取命令行参数
-    file_paths, args, output_dir, i = [], sys.argv[1:], None, 0
-    while i < len(args):
-        if args[i] == '-o':
-            output_dir = args[i+1]
-            i += 2
-        else:
-            p = Path(args[i])
-            if p.is_dir():
-                file_paths.extend(p.glob("**/*.parquet"))
-                file_paths.extend(p.glob("**/*.parq"))
-                file_paths.extend(p.glob("**/*.csv"))
-            else:
-                file_paths.append(p)
-            i += 1
+    # 选择分析阶段（自动包含依赖的上游阶段）
+    try:
+        stages = select_stages(STAGES, args.only.split(',') if args.only else None)
+    except ValueError as e:
+        print(f"错误：{e}")
+        return False
     
-    # 判断file_paths中文件是否为相同类型
-    if len(file_paths) > 1:
-        file_types = set(p.suffix for p in file_paths)
-        if len(file_types) > 1:
-            print("警告：混合文件类型，可能导致读取错误")
-            return False
+    # 地图页面统一引用本地ECharts资源
+    if args.assets_host:
+        from pyecharts.globals import CurrentConfig
+        CurrentConfig.ONLINE_HOST = args.assets_host
     
     # 输出目录处理
     if output_dir:
@@ -55,50 +226,111 @@ def main():
     
     """数据加载"""
     start_time = time.time()
-    # 判断文件类型
-    if len(valid_files) == 1:
-        file_path = valid_files[0]
-        if file_path.suffix in ['.parquet', '.parq']:
-            print("正在读取单个parquet文件...")
-            # 读取单个文件
-            df = load_parquet_data([file_path], if_file_pattern=False) # 读取数据
-        elif file_path.suffix == '.csv':
-            print("正在读取单个csv文件...")
-            # 读取单个文件
-            df = load_csv_data([file_path], if_file_pattern=False) # 读取数据
-        else:
-            print(f"警告：不支持的文件类型 {file_path.suffix}")
+    # 检查文件类型（CSV/Parquet/Feather可混合读取）
+    unsupported = [p for p in valid_files if file_format(p) is None]
+    if unsupported:
+        print(f"警告：不支持的文件类型 {', '.join(sorted(set(p.suffix for p in unsupported)))}")
+        return False
+    # 行组索引：概况模式直接输出；筛选运行据此跳过不相关的行组
+    row_filter = None
+    if args.summary or args.start or args.end or args.provinces:
+        from rowgroups import INDEX_DIR, RowGroupFilter, RowGroupIndex, format_summary
+        index = RowGroupIndex(args.index_dir or Path(output_dir or '.') / INDEX_DIR,
+                              province_cache=ProvinceCache(path=args.province_cache),
+                              beside_source=args.index_beside_data)
+        if args.summary:
+            print(format_summary(index.summary(sorted(valid_files))))
+            return True
+        try:
+            row_filter = RowGroupFilter(args.start, args.end, args.provinces.split(',') if args.provinces else None,
+                                        index=index)
+        except ValueError as e:
+            print(f"错误：{e}")
             return False
-    else:
-        # 读取多个文件
-        if valid_files[0].suffix in ['.parquet', '.parq']:
-            print("正在读取多个parquet文件...")
-            # 读取多个文件
-            df = load_parquet_data(valid_files, if_file_pattern=False) # 读取数据
-        elif valid_files[0].suffix == '.csv':
-            print("正在读取多个csv文件...")
-            # 读取多个文件
-            df = load_csv_data(valid_files, if_file_pattern=False) # 读取数据
-        else:
-            print(f"警告：不支持的文件类型 {valid_files[0].suffix}")
+        selected = [row_filter.selected_rows(p) for p in valid_files]
+        print(f"筛选：{row_filter.describe()}" + (f"，parquet保留行组共{sum(n for n in selected if n is not None):,}行"
+                                                 if any(n is not None for n in selected) else ''))
+    print(f"正在读取{len(valid_files)}个文件...")
+    # 只读取所选阶段需要的列，加载过程中顺带统计数据质量
+    quality = QualityStats()
+    columns = required_columns(stages)
+    # 加载时构建的汇总所需的列也要读取（并写入检查点，恢复时据此重建）
+    cube = sketches = None
+    if args.cube:
+        from cube import CUBE_COLUMNS, Cube
+        cube = Cube()
+        columns = sorted(set(columns) | set(CUBE_COLUMNS)) if columns is not None else None
+    if args.sketches:
+        from sketches import SKETCH_COLUMNS, Sketches
+        sketches = Sketches()
+        columns = sorted(set(columns) | set(SKETCH_COLUMNS)) if columns is not None else None
+    sampler = None
+    if args.sample is not None:
+        from sampling import Sampler
+        try:
+            sampler = Sampler(args.sample, stratify=args.stratify, seed=args.seed)
+        except ValueError as e:
+            print(f"错误：{e}")
             return False
+        print(f"抽样预览：抽样率{args.sample:.2%}" + ("（按省份分层）" if args.stratify else ""))
+    checkpoint = None
+    if (args.checkpoint or args.resume) and (sampler is not None or row_filter is not None):
+        print("提示：抽样/筛选运行不写出/使用检查点")
+    elif args.checkpoint or args.resume:
+        from checkpoint import Checkpoint
+        checkpoint = Checkpoint(Path(output_dir or '.') / 'checkpoints', columns=columns, geo_level=args.geo,
+                                resume=args.resume)
+    workers = args.workers or PARSE_WORKERS
+    governor = None
+    if args.max_memory:
+        from memory import MemoryGovernor, parse_size
+        try:
+            governor = MemoryGovernor(parse_size(args.max_memory), in_flight=workers + args.prefetch + 1)
+        except ValueError as e:
+            print(f"错误：{e}")
+            return False
+    data = load_dataset(valid_files, if_file_pattern=False, as_pandas=args.processes <= 0,
+                      workers=workers, prefetch_depth=args.prefetch,
+                      province_cache=ProvinceCache(path=args.province_cache),
+                      geo_level=args.geo, columns=columns,
+                      quality=quality, checkpoint=checkpoint, sampler=sampler, governor=governor,
+                      cube=cube, sketches=sketches, row_filter=row_filter) # 读取数据
+    handle = None
+    if args.processes > 0:
+        # 子进程按句柄内存映射读取数据集，主进程的DataFrame也由同一文件转换
+        from shared import DatasetHandle
+        handle = DatasetHandle.create(data, directory=output_dir or '.')
+        data = None
+        df = handle.to_pandas()
+    else:
+        df = data
     load_time = time.time() - start_time
+    print(f"已保存 {quality.save(Path(output_dir or '.') / 'quality_report.json')}")
+    if cube is not None:
+        print(f"已保存 {cube.save(Path(output_dir or '.') / 'cube.npz')}")
+    if sketches is not None:
+        report = sketches.report(args.top)
+        print(report)
+        report_path = Path(output_dir or '.') / 'sketches_report.txt'
+        report_path.write_text(report + '\n', encoding='utf-8')
+        print(f"已保存 {sketches.save(Path(output_dir or '.') / 'sketches.npz')}、{report_path}")
     
     """正式分析流程"""
-    # 执行分析流程
-    plot_province_distribution(df, base_dir=output_dir) # 地域分布热力图
-    plot_consumption_analysis(df, base_dir=output_dir) # 消费分析三联图
-    
-    rfm = build_user_profiles(df) # 用户画像构建
-    hv_users = identify_high_value_users(rfm, df) # 高价值用户识别
-    
-    # 保存结果
-    if output_dir:
-        hv_users.to_csv(output_dir / 'hv_users.csv', index=False)
-        print(f"RFM分析结果已保存到 {output_dir / 'hv_users.csv'}")
-    else:
-        hv_users.to_csv("./high_value_users.csv", index=False)
-        print("高价值用户数据已保存到 high_value_users.csv")
+    # 按依赖关系执行所选阶段，互不依赖的阶段并发执行
+    try:
+        results = run_stages(stages, df, base_dir=output_dir, workers=args.jobs,
+                             handle=handle, processes=args.processes, results={'cube': cube})
+        
+        # 保存结果（多个结果表、多种格式并行写出）
+        outputs = {}
+        if 'hv' in results:
+            outputs['hv_users' if output_dir else 'high_value_users'] = results['hv']
+        if args.export_intermediates:
+            outputs.update(intermediate_outputs(results))
+        write_outputs(outputs, output_dir or '.', formats=formats)
+    finally:
+        if handle is not None:
+            handle.release()
 
     # 显示运行时间
     end_time = time.time() - start_time
@@ -109,4 +341,4 @@ def main():
     return True
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
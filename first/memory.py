@@ -0,0 +1,193 @@
+"""
+内存预算：加载过程中监控进程RSS，自适应调整批大小，接近上限时压缩/落盘已累计的数据
+
+- 批大小：扫描端按较小的粒度读取，再按当前目标行数合并成批次；目标行数根据剩余内存、
+  每行内存占用（原始批次 + 标准化结果）与在途批次数计算，放大时每次最多翻倍，缩小立即生效
+- 压缩：RSS超过上限的HIGH_WATER时，已累计表中重复值多的字符串列转为字典编码（转pandas后为Categorical）
+- 落盘：压缩后仍超过上限时，已累计表写出为Arrow IPC并以内存映射读回（由操作系统按需换入换出）
+- 转换pandas时逐列释放Arrow内存（split_blocks + self_destruct），避免两份数据同时驻留
+- 上限只作用于加载过程：最终转换为DataFrame时落盘的数据全部读回内存，之后的峰值约为整个数据集的大小
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import psutil
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+# 扫描粒度（行），实际批次由若干扫描批次合并而成
+SCAN_ROWS = 65536
+# 批大小上下限（行）
+MIN_BATCH_ROWS = 65536
+MAX_BATCH_ROWS = 4000000
+# 在途批次最多占用剩余内存的比例
+BATCH_SHARE = 0.5
+# RSS超过上限的该比例时压缩/落盘已累计数据
+HIGH_WATER = 0.8
+# 唯一值占比不超过该值的字符串列压缩为字典编码
+DICTIONARY_RATIO = 0.5
+# 落盘目录名前缀（收集输入文件时跳过）
+SPILL_PREFIX = 'spill-'
+
+# schema元数据中记录压缩/落盘状态的键
+STATE_KEY = b'memory_state'
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+def parse_size(text):
+    """内存大小：'4G'、'512M'、'1.5g'或字节数"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', str(text), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"无法识别的内存大小: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def format_size(size):
+    return f"{size / 1024**2:,.0f}MB"
+
+def compact_table(table):
+    """重复值多的字符串列转为字典编码，并合并为连续内存"""
+    columns = []
+    for column in table.columns:
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            if len(column) and pc.count_distinct(column).as_py() <= len(column) * DICTIONARY_RATIO:
+                column = pc.dictionary_encode(column)
+        columns.append(column)
+    return pa.table(columns, names=table.column_names).combine_chunks()
+
+def memory_state(table):
+    """表的处理状态（记录在schema元数据中）：None、'compacted'或'spilled'"""
+    metadata = table.schema.metadata or {}
+    state = metadata.get(STATE_KEY)
+    return state.decode() if state is not None else None
+
+def mark(table, state):
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), STATE_KEY: state.encode()})
+
+def conform_tables(tables):
+    """合并前统一列类型：某列在任一表中为字典编码时，其余表中的同名字符串列也转为字典编码"""
+    encoded = {field.name for table in tables for field in table.schema
+               if pa.types.is_dictionary(field.type)}
+    conformed = []
+    for table in tables:
+        for i, field in enumerate(table.schema):
+            if field.name in encoded and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+                table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i)))
+        conformed.append(table)
+    return conformed
+
+class MemoryGovernor:
+    """加载过程的内存预算（线程安全）
+
+    limit: 内存上限（字节）；batch_size: 初始批大小；in_flight: 同时驻留的批次数（解析线程数 + 预取深度）
+    """
+    def __init__(self, limit, batch_size=MIN_BATCH_ROWS, in_flight=1,
+                 min_rows=MIN_BATCH_ROWS, max_rows=MAX_BATCH_ROWS):
+        self.limit = limit
+        self.min_rows, self.max_rows = min_rows, max_rows
+        self.batch_size = min(max(batch_size, min_rows), max_rows)
+        self.in_flight = max(in_flight, 1)
+        self.row_bytes = {}  # 'raw'/'normalized' -> 每行字节数
+        self.process = psutil.Process()
+        self.peak = 0
+        self.resizes = 0
+        self.compactions = 0
+        self.spills = 0
+        self.spill_dir = None
+        self.lock = threading.Lock()
+
+    def usage(self):
+        """当前进程RSS（字节）"""
+        rss = self.process.memory_info().rss
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def observe(self, kind, nbytes, num_rows):
+        """记录批次每行内存占用（kind为'raw'或'normalized'），取滑动平均"""
+        if not num_rows:
+            return
+        with self.lock:
+            per_row = nbytes / num_rows
+            previous = self.row_bytes.get(kind)
+            self.row_bytes[kind] = per_row if previous is None else 0.8 * previous + 0.2 * per_row
+
+    def next_batch_rows(self):
+        """下一个批次的目标行数"""
+        with self.lock:
+            if not self.row_bytes:
+                return self.batch_size
+            free = max(self.limit - self.usage(), 0)
+            rows = int(free * BATCH_SHARE / (self.in_flight * sum(self.row_bytes.values())))
+            rows = min(max(rows, self.min_rows), self.max_rows, self.batch_size * 2)
+            if rows != self.batch_size:
+                self.resizes += 1
+                self.batch_size = rows
+            return rows
+
+    def coalesce(self, items):
+        """合并同一文件的连续扫描批次(file, batch, offset)，每批约为当前目标行数；异常原样传递"""
+        current, pending, rows, target, start = None, [], 0, self.batch_size, 0
+
+        def flush():
+            batch = pending[0] if len(pending) == 1 else pa.concat_batches(pending)
+            self.observe('raw', batch.nbytes, batch.num_rows)
+            return current, batch, start
+
+        for file, batch, offset in items:
+            if pending and (file != current or isinstance(batch, Exception)):
+                yield flush()
+                pending, rows, target = [], 0, self.next_batch_rows()
+            if isinstance(batch, Exception):
+                yield file, batch, offset
+                continue
+            if not pending:
+                current, start = file, offset
+            pending.append(batch)
+            rows += batch.num_rows
+            if rows >= target:
+                yield flush()
+                pending, rows, target = [], 0, self.next_batch_rows()
+        if pending:
+            yield flush()
+
+    def under_pressure(self):
+        return self.usage() > self.limit * HIGH_WATER
+
+    def relieve(self, tables):
+        """内存接近上限时压缩tables（原地替换），仍超限时落盘；已处理过的表跳过"""
+        if not tables or not self.under_pressure():
+            return
+        for i, table in enumerate(tables):
+            if memory_state(table) is None:
+                tables[i] = mark(compact_table(table), 'compacted')
+        self.compactions += 1
+        pa.default_memory_pool().release_unused()
+        if self.under_pressure():
+            for i, table in enumerate(tables):
+                if memory_state(table) != 'spilled':
+                    tables[i] = mark(self.spill(table), 'spilled')
+            pa.default_memory_pool().release_unused()
+
+    def spill(self, table):
+        """表写出为Arrow IPC并以内存映射读回"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix=SPILL_PREFIX)
+        path = os.path.join(self.spill_dir, f"{self.spills}.arrow")
+        feather.write_feather(table, path, compression='uncompressed')
+        self.spills += 1
+        return feather.read_table(path, memory_map=True)
+
+    def cleanup(self):
+        """删除落盘文件（仍被内存映射引用的文件在Windows上无法删除，忽略）"""
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def summary(self):
+        self.usage()
+        return (f"内存: 上限{format_size(self.limit)}，峰值{format_size(self.peak)}，"
+                f"最终批大小{self.batch_size:,}行（调整{self.resizes}次），"
+                f"压缩{self.compactions}次，落盘{self.spills}个表")
@@ -0,0 +1,110 @@
+"""
+分析阶段调度：按依赖关系按需执行
+
+每个阶段声明所需的数据列与依赖的上游阶段，只运行被选中的阶段及其依赖；
+上游阶段的返回值作为共享中间结果传给下游，互不依赖的阶段并发执行。
+提供DatasetHandle与processes时，绘图阶段在子进程中执行（各进程独立的pyplot，无需串行），
+子进程按句柄内存映射读取数据集，只传递句柄与上游结果。
+"""
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# matplotlib的pyplot接口不是线程安全的，绘图阶段之间串行执行
+PLOT_LOCK = threading.Lock()
+
+class Stage:
+    """分析阶段
+
+    name: 阶段名称
+    func: func(df, results, base_dir)，results为已完成阶段的返回值
+    columns: 所需数据列
+    requires: 依赖的上游阶段
+    plotting: 是否使用pyplot（绘图阶段持有PLOT_LOCK执行）
+    """
+    def __init__(self, name, func, columns=(), requires=(), plotting=False):
+        self.name = name
+        self.func = func
+        self.columns = tuple(columns)
+        self.requires = tuple(requires)
+        self.plotting = plotting
+
+def select_stages(stages, only=None):
+    """选出需要执行的阶段（含依赖），保持注册顺序"""
+    registry = {stage.name: stage for stage in stages}
+    if not only:
+        return list(stages)
+    unknown = [name for name in only if name not in registry]
+    if unknown:
+        raise ValueError(f"未知的分析阶段: {', '.join(unknown)}（可选: {', '.join(registry)}）")
+
+    selected, todo = set(), list(only)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(registry[name].requires)
+    return [stage for stage in stages if stage.name in selected]
+
+def required_columns(stages):
+    """阶段所需数据列的并集"""
+    return sorted({column for stage in stages for column in stage.columns})
+
+def run_in_process(func, handle, columns, results, base_dir):
+    """子进程入口：从共享数据集读取阶段所需的列后执行（绘图阶段必须声明所需列）"""
+    from shared import as_frame
+    return func(as_frame(handle, columns or None), results, base_dir)
+
+def run_stages(stages, df, base_dir=None, workers=4, handle=None, processes=0, results=None):
+    """按依赖关系执行阶段，互不依赖的阶段并发执行，返回{阶段名: 返回值}
+
+    handle为df对应的DatasetHandle且processes > 0时，绘图阶段在processes个子进程中执行；
+    results为执行前已有的共享结果（如加载时构建的聚合立方体'cube'）
+    """
+    results, timings = dict(results or {}), {}
+    pending = {stage.name: stage for stage in stages}
+    use_processes = handle is not None and processes > 0 and any(stage.plotting for stage in stages)
+    # spawn启动：避免在已有线程（Arrow线程池、阶段线程）的进程中fork
+    process_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) \
+        if use_processes else None
+
+    def execute(stage):
+        start_time = time.time()
+        if process_pool is not None and stage.plotting:
+            requires = {name: results[name] for name in stage.requires}
+            result = process_pool.submit(run_in_process, stage.func, handle, stage.columns,
+                                         requires, base_dir).result()
+        else:
+            result = stage.func(df, results, base_dir)
+        timings[stage.name] = time.time() - start_time
+        return result
+
+    def run(stage):
+        if stage.plotting and process_pool is None:
+            with PLOT_LOCK:
+                return execute(stage)
+        return execute(stage)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="stage") as pool:
+            running = {}
+            while pending or running:
+                # 提交依赖已全部完成的阶段
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.requires):
+                        running[pool.submit(run, stage)] = name
+                        del pending[name]
+                if not running:
+                    raise RuntimeError(f"阶段依赖无法满足: {', '.join(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+
+    for name, cost in timings.items():
+        print(f"阶段 {name} 用时: {cost:.2f}秒")
+    return results
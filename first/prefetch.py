@@ -0,0 +1,79 @@
+"""
+后台预取流水线：读取、解码与解析重叠执行
+
+- prefetch: 后台线程提前拉取数据，队列有界（队列满时读取线程阻塞，形成背压）
+- parallel_map: 线程池并行处理，限制在途任务数并保持输出顺序
+
+pyarrow的读取、解码与compute函数会释放GIL，线程即可获得真实并行。
+"""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认预取深度（队列中最多缓存的批次数）
+PREFETCH_DEPTH = 4
+
+_END = object()
+
+class _Failure:
+    """包装后台线程中的异常，交由消费端重新抛出"""
+    def __init__(self, error):
+        self.error = error
+
+def prefetch(iterable, depth=PREFETCH_DEPTH):
+    """后台线程提前读取iterable，最多缓存depth个元素"""
+    buffer = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def put(item):
+        # 队列满时等待，消费端提前退出时放弃
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            put(_END)
+
+    thread = threading.Thread(target=producer, name="prefetch-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def parallel_map(func, iterable, workers=4, depth=None):
+    """有序并行map：最多depth个任务在途，超出时等待最早的任务完成"""
+    depth = depth or workers * 2
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch-worker") as pool:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= depth:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # 消费端提前退出时取消尚未开始的任务
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,70 @@
+"""
+数据质量统计：加载过程中按批次累计，不额外扫描数据
+
+每个批次在标准化时用已有的掩码计数，得到一个QualityStats；
+加载主线程按文件合并（读取失败的文件不计入），最终写出quality_report.json。
+"""
+
+import json
+import os
+from pathlib import Path
+
+# 客单价合理范围（含边界），超出视为异常值
+PRICE_RANGE = (0, 100000)
+
+# 统计项 -> 说明
+QUALITY_FIELDS = {
+    'rows': '总行数',
+    'purchase_parse_failures': '购买记录解析失败',
+    'null_purchases': '购买记录为空',
+    'unknown_provinces': '省份未识别',
+    'null_timestamps': '时间戳为空或无法解析',
+    'out_of_range_prices': '客单价超出范围',
+    'duplicate_user_rows_in_batch': '批次内重复记录（同一用户同一时间，只在同一批次内比较，不跨批次去重）',
+}
+
+class QualityStats:
+    """数据质量计数器，可按文件合并"""
+    def __init__(self):
+        self.counts = dict.fromkeys(QUALITY_FIELDS, 0)
+        self.files = {}
+        self.failed_files = []
+
+    def add(self, name, count):
+        self.counts[name] += int(count)
+
+    def merge(self, other, file=None):
+        """合并另一个计数器，指定file时同时记录该文件的明细"""
+        for name, count in other.counts.items():
+            self.counts[name] += count
+        if file is not None:
+            self.files[str(file)] = dict(other.counts)
+
+    def report(self):
+        """汇总报告：计数、占总行数的比例与各文件明细"""
+        rows = self.counts['rows']
+        return {
+            'counts': dict(self.counts),
+            'rates': {name: round(count / rows, 6) if rows else 0.0
+                      for name, count in self.counts.items() if name != 'rows'},
+            'descriptions': QUALITY_FIELDS,
+            'price_range': PRICE_RANGE,
+            'files': self.files,
+            'failed_files': self.failed_files,
+        }
+
+    def summary(self):
+        """单行摘要（只列出非零项）"""
+        rows = self.counts['rows']
+        items = [f"{QUALITY_FIELDS[name]} {count:,}({count / rows:.2%})"
+                 for name, count in self.counts.items() if name != 'rows' and count and rows]
+        return f"数据质量: 共{rows:,}行" + (f"，{'，'.join(items)}" if items else "，未发现问题")
+
+    def save(self, path):
+        """写出JSON报告（先写临时文件再替换）"""
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return path
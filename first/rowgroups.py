@@ -0,0 +1,273 @@
+# rowgroups.py
+"""
+Parquet行组统计索引：每个parquet文件一个JSON索引，无需解码数据即可回答"数据覆盖哪些日期/省份"
+
+- 行数、字节数、收入范围来自parquet footer（无统计信息时在扫描中补算）
+- 时间范围与各省行数需要一次轻量扫描：每个行组只读取时间戳与地址两列，按加载时相同的规则标准化与解析
+- 索引记录源文件大小与修改时间，源文件变化后自动重建
+- 索引默认写在索引目录（rgindex）下，不修改数据目录；--index-beside-data时写在源文件旁（sidecar）
+- 筛选运行（日期范围、省份）据此跳过不相关的行组，保留的行组按批大小重新划分为均衡的工作单元
+
+python rowgroups.py 文件/文件夹... [--index-dir 目录 | --index-beside-data]
+"""
+import argparse
+import hashlib
+import json
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from checkpoint import atomic_replace, source_key, source_state
+from geo import PROVINCE_DICTIONARY
+from load_and_preprocess import (COLUMN_ALIASES, ProvinceCache, collect_files, file_format,
+                                 normalize_timestamp, resolve_province)
+
+INDEX_SUFFIX = '.rgindex.json'
+# 默认索引目录名（main中位于输出目录下）
+INDEX_DIR = 'rgindex'
+INDEX_VERSION = 1
+EPOCH = date(1970, 1, 1)
+
+def standard_column(names, standard):
+    """文件中对应标准列名的原始列（考虑旧版列名），不存在时返回None"""
+    for name in names:
+        if name == standard or (COLUMN_ALIASES.get(name) == standard and standard not in names):
+            return name
+    return None
+
+def footer_range(metadata, row_group, column):
+    """footer中的数值列最小/最大值，没有统计信息时返回None"""
+    if column is None:
+        return None
+    chunk = metadata.row_group(row_group).column(metadata.schema.names.index(column))
+    stats = chunk.statistics
+    if stats is None or not stats.has_min_max or not isinstance(stats.min, (int, float)):
+        return None
+    return [float(stats.min), float(stats.max)]
+
+def scan_row_group(parquet, row_group, timestamp, address, income, province_cache=None):
+    """轻量扫描单个行组：时间范围、各省行数，以及footer没有统计信息时的收入范围"""
+    columns = [c for c in (timestamp, address, income) if c is not None]
+    table = parquet.read_row_group(row_group, columns=columns)
+    entry = {}
+    if timestamp is not None:
+        ts, _, days = normalize_timestamp(table.column(timestamp).combine_chunks())
+        bounds = pc.min_max(ts)
+        entry['timestamp'] = None if bounds['min'].as_py() is None \
+            else [bounds['min'].as_py().isoformat(), bounds['max'].as_py().isoformat()]
+        days = pc.min_max(days)
+        entry['days'] = None if days['min'].as_py() is None else [days['min'].as_py(), days['max'].as_py()]
+    if address is not None:
+        column = table.column(address).combine_chunks()
+        if not pa.types.is_dictionary(column.type):
+            column = pc.dictionary_encode(column)
+        codes = resolve_province(column, province_cache).indices.to_numpy(zero_copy_only=False)
+        counts = np.bincount(codes, minlength=len(PROVINCE_DICTIONARY))
+        entry['provinces'] = {PROVINCE_DICTIONARY[i].as_py(): int(counts[i]) for i in np.flatnonzero(counts)}
+    if income is not None:
+        bounds = pc.min_max(table.column(income))
+        entry['income'] = None if bounds['min'].as_py() is None \
+            else [float(bounds['min'].as_py()), float(bounds['max'].as_py())]
+    return entry
+
+def build_file_index(file, province_cache=None):
+    """读取footer并轻量扫描，返回文件的行组索引"""
+    parquet = pq.ParquetFile(file)
+    metadata, names = parquet.metadata, parquet.schema_arrow.names
+    timestamp, address = standard_column(names, 'timestamp'), standard_column(names, 'address')
+    income = standard_column(names, 'income')
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        entry = {'row_group': i, 'rows': metadata.row_group(i).num_rows,
+                 'bytes': metadata.row_group(i).total_byte_size, 'income': footer_range(metadata, i, income)}
+        missing_income = income if entry['income'] is None else None
+        entry.update(scan_row_group(parquet, i, timestamp, address, missing_income, province_cache))
+        row_groups.append(entry)
+    return {'version': INDEX_VERSION, 'source': source_state(file), 'row_groups': row_groups}
+
+class RowGroupIndex:
+    """parquet文件的行组索引：按需构建，写出到directory下并在之后的运行中复用
+
+    beside_source为True时写在源文件旁；两者都未指定时只在内存中使用
+    """
+    def __init__(self, directory=None, province_cache=None, beside_source=False):
+        self.directory = Path(directory) if directory else None
+        self.beside_source = beside_source
+        self.province_cache = province_cache if province_cache is not None else ProvinceCache()
+        self.files = {}
+
+    def index_path(self, file):
+        """索引文件路径，只在内存中使用时返回None"""
+        if self.beside_source:
+            return Path(file).with_name(Path(file).name + INDEX_SUFFIX)
+        if self.directory is None:
+            return None
+        key = hashlib.sha1(source_key(file).encode('utf-8')).hexdigest()[:16]
+        return self.directory / f"{Path(file).name}.{key}{INDEX_SUFFIX}"
+
+    def entries(self, file):
+        """文件的行组统计列表；非parquet文件返回None"""
+        key = source_key(file)
+        if key in self.files:
+            return self.files[key]
+        if file_format(file) != 'parquet':
+            return None
+        path, index = self.index_path(file), None
+        if path is not None and path.exists():
+            try:
+                index = json.loads(path.read_text(encoding='utf-8'))
+            except ValueError:
+                index = None
+        if index is None or index.get('version') != INDEX_VERSION or index.get('source') != source_state(file):
+            index = build_file_index(file, self.province_cache)
+            if path is not None:
+                try:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    atomic_replace(path, lambda tmp: tmp.write_text(json.dumps(index, ensure_ascii=False),
+                                                                    encoding='utf-8'))
+                except OSError as e:
+                    print(f"警告：无法写出行组索引 {path}（{e}），本次运行仅在内存中使用")
+        self.files[key] = index['row_groups']
+        return self.files[key]
+
+    def summary(self, files):
+        """文件级汇总：行数、行组数、时间范围、收入范围、各省行数；非parquet文件列入unindexed"""
+        result = {'files': 0, 'row_groups': 0, 'rows': 0, 'timestamp': None, 'income': None,
+                  'provinces': {}, 'unindexed': []}
+
+        def widen(current, bounds):
+            if bounds is None:
+                return current
+            return list(bounds) if current is None else [min(current[0], bounds[0]), max(current[1], bounds[1])]
+
+        for file in files:
+            entries = self.entries(file)
+            if entries is None:
+                result['unindexed'].append(str(file))
+                continue
+            result['files'] += 1
+            result['row_groups'] += len(entries)
+            for entry in entries:
+                result['rows'] += entry['rows']
+                result['timestamp'] = widen(result['timestamp'], entry.get('timestamp'))
+                result['income'] = widen(result['income'], entry.get('income'))
+                for province, count in entry.get('provinces', {}).items():
+                    result['provinces'][province] = result['provinces'].get(province, 0) + count
+        result['provinces'] = dict(sorted(result['provinces'].items(), key=lambda item: -item[1]))
+        return result
+
+def format_summary(summary):
+    """summary的文本形式"""
+    lines = [f"{summary['files']}个parquet文件，{summary['row_groups']}个行组，共{summary['rows']:,}行"]
+    if summary['timestamp']:
+        lines.append(f"时间范围: {summary['timestamp'][0]} ~ {summary['timestamp'][1]}")
+    if summary['income']:
+        lines.append(f"收入范围: {summary['income'][0]:,.2f} ~ {summary['income'][1]:,.2f}")
+    if summary['provinces']:
+        lines.append(f"覆盖{sum(p != 'unknown' for p in summary['provinces'])}个省份（各省行数）：")
+        lines += [f"  {province}: {count:,}" for province, count in summary['provinces'].items()]
+    if summary['unindexed']:
+        lines.append(f"另有{len(summary['unindexed'])}个非parquet文件没有行组统计，需完整读取")
+    return '\n'.join(lines)
+
+def parse_day(value):
+    """YYYY-MM-DD -> 距1970-01-01的天数（与date派生列相同）"""
+    try:
+        return (date.fromisoformat(value) - EPOCH).days
+    except ValueError:
+        raise ValueError(f"日期格式应为YYYY-MM-DD: {value}") from None
+
+class RowGroupFilter:
+    """筛选运行：日期范围（含首尾，按标准化后的本地日期）与省份
+
+    select按索引选出可能含有符合条件记录的行组，apply在标准化后的批次上按行筛选
+    """
+    def __init__(self, start=None, end=None, provinces=None, index=None):
+        self.start = parse_day(start) if start else None
+        self.end = parse_day(end) if end else None
+        if self.start is not None and self.end is not None and self.start > self.end:
+            raise ValueError(f"开始日期晚于结束日期: {start} > {end}")
+        known = set(PROVINCE_DICTIONARY.to_pylist())
+        unknown = [p for p in provinces or () if p not in known]
+        if unknown:
+            raise ValueError(f"未知省份: {', '.join(unknown)}")
+        self.provinces = set(provinces) if provinces else None
+        self.index = index if index is not None else RowGroupIndex()
+
+    @property
+    def columns(self):
+        """按行筛选需要的标准列"""
+        return (['date'] if self.start is not None or self.end is not None else []) \
+            + (['province'] if self.provinces is not None else [])
+
+    def matches(self, entry):
+        days = entry.get('days')
+        if self.start is not None or self.end is not None:
+            # 没有时间戳（列不存在或全部为空）的行组在按行筛选时也会被全部排除
+            if days is None:
+                return False
+            if (self.start is not None and days[1] < self.start) or (self.end is not None and days[0] > self.end):
+                return False
+        if self.provinces is not None and 'provinces' in entry:
+            return not self.provinces.isdisjoint(entry['provinces'])
+        return True
+
+    def select(self, file):
+        """保留的行组编号；非parquet文件返回None（读取全部）"""
+        entries = self.index.entries(file)
+        if entries is None:
+            return None
+        return [entry['row_group'] for entry in entries if self.matches(entry)]
+
+    def selected_rows(self, file):
+        """保留行组的总行数（按行筛选前），非parquet文件返回None"""
+        entries = self.index.entries(file)
+        if entries is None:
+            return None
+        return sum(entry['rows'] for entry in entries if self.matches(entry))
+
+    def mask(self, columns):
+        """columns为标准化过程中的列字典（已有province与date列），返回行筛选掩码（BooleanArray）"""
+        num_rows = len(next(iter(columns.values())))
+        mask = pa.array(np.ones(num_rows, dtype=bool))
+        if self.start is not None or self.end is not None:
+            if 'date' in columns:
+                days = columns['date']
+                if self.start is not None:
+                    mask = pc.and_kleene(mask, pc.greater_equal(days, self.start))
+                if self.end is not None:
+                    mask = pc.and_kleene(mask, pc.less_equal(days, self.end))
+            else:
+                mask = pa.array(np.zeros(num_rows, dtype=bool))
+        if self.provinces is not None:
+            if 'province' in columns:
+                mask = pc.and_kleene(mask, pc.is_in(columns['province'], value_set=pa.array(sorted(self.provinces))))
+            else:
+                mask = pa.array(np.zeros(num_rows, dtype=bool))
+        return mask.fill_null(False)
+
+    def describe(self):
+        parts = []
+        if self.start is not None or self.end is not None:
+            start, end = ((EPOCH + timedelta(days=day)).isoformat() if day is not None else '...'
+                          for day in (self.start, self.end))
+            parts.append(f"日期 {start} ~ {end}")
+        if self.provinces is not None:
+            parts.append(f"省份 {','.join(sorted(self.provinces))}")
+        return '，'.join(parts)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="parquet行组统计索引（构建并显示数据集概况）")
+    parser.add_argument('paths', nargs='+', help="数据文件或目录")
+    parser.add_argument('--index-dir', default=INDEX_DIR, help=f"索引目录（默认当前目录下的{INDEX_DIR}）")
+    parser.add_argument('--index-beside-data', action='store_true', help="索引写在源文件旁（需要数据目录可写）")
+    args = parser.parse_args(argv)
+    index = RowGroupIndex(args.index_dir, beside_source=args.index_beside_data)
+    print(format_summary(index.summary(sorted(collect_files(args.paths)))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+抽样预览：Parquet行组抽样 + 批次内伯努利抽样（可按省份分层）
+
+- 行组抽样：行组较多的Parquet文件只读取约sqrt(rate)比例的行组，减少IO与解码
+- 批次内抽样：剩余比例在批次内按行抽取；分层时每个省份按比例抽取且至少保留min_stratum行
+- 每行带sample_weight列（入样概率的倒数），计数类结果按权重放大为总体估计值；
+  sample_cluster列为行所在的入样行组（整行组入样的文件），其余行为-1
+- 随机数只由(seed, 文件, 行在文件中的位置)决定，与解析线程的调度顺序和批次划分无关，同一seed结果可复现
+- 置信区间：逐行入样的部分按Horvitz-Thompson方差估计（泊松抽样近似）Var = Σ w(w-1)y²；
+  整行组入样的部分按行组（每个文件为一层）计算组间方差，不把同一行组内的行当作独立抽样
+"""
+
+import zlib
+
+import numpy as np
+
+# 行组数少于该值的文件不做行组抽样（避免整文件被跳过导致方差过大）
+MIN_ROW_GROUPS = 16
+# 分层抽样时每个批次中每个省份至少保留的行数
+MIN_STRATUM_ROWS = 50
+# 95%置信区间的z值
+Z_95 = 1.96
+# 逐行随机数按固定大小的行块生成：每块由(seed, 文件, 块号)确定
+RANDOM_BLOCK_ROWS = 65536
+# 随机数流的用途标记
+ROW_GROUP_STREAM, ROW_STREAM = 0, 1
+# 抽样结果附带的列
+SAMPLE_COLUMNS = ['sample_weight', 'sample_cluster']
+
+def file_key(file):
+    """文件的稳定编号（路径的CRC32），不依赖文件列表顺序"""
+    return zlib.crc32(str(file).encode('utf-8'))
+
+class Sampler:
+    """抽样器：rate为总体抽样率，stratify为'province'时按省份分层（线程安全）"""
+    def __init__(self, rate, stratify=None, seed=0, min_stratum=MIN_STRATUM_ROWS):
+        if not 0 < rate <= 1:
+            raise ValueError(f"抽样率必须在(0, 1]之间: {rate}")
+        self.rate = rate
+        self.stratify = stratify
+        self.seed = seed
+        self.min_stratum = min_stratum
+        self.group_rates = {}
+        self.group_bounds = {}  # 文件 -> (读取的行组编号, 各行组在读取数据中的结束位置)
+
+    def uniforms(self, file, offset, num_rows):
+        """文件中第offset行起num_rows行的均匀随机数"""
+        if not num_rows:
+            return np.empty(0)
+        first, last = offset // RANDOM_BLOCK_ROWS, (offset + num_rows - 1) // RANDOM_BLOCK_ROWS
+        blocks = [np.random.default_rng([self.seed, file_key(file), ROW_STREAM, block]).random(RANDOM_BLOCK_ROWS)
+                  for block in range(first, last + 1)]
+        start = offset - first * RANDOM_BLOCK_ROWS
+        return np.concatenate(blocks)[start:start + num_rows]
+
+    def row_groups(self, file, num_row_groups):
+        """选出要读取的行组编号，同时记录该文件的行组入样概率"""
+        group_rate = self.rate ** 0.5 if num_row_groups >= MIN_ROW_GROUPS else 1.0
+        self.group_rates[str(file)] = group_rate
+        if group_rate == 1.0:
+            return list(range(num_row_groups))
+        rng = np.random.default_rng([self.seed, file_key(file), ROW_GROUP_STREAM])
+        return np.flatnonzero(rng.random(num_row_groups) < group_rate).tolist()
+
+    def record_row_groups(self, file, row_groups, sizes):
+        """记录最终读取的行组及其行数（行组抽样后可能还被筛选跳过一部分），用于确定每行所在的行组"""
+        if self.group_rates.get(str(file), 1.0) < 1.0:
+            self.group_bounds[str(file)] = (np.asarray(row_groups, dtype=np.int64), np.cumsum(sizes))
+
+    def clusters(self, file, offset, index):
+        """入样行所在行组的编号（文件编号与行组号组合），非整行组入样的文件为-1"""
+        bounds = self.group_bounds.get(str(file))
+        if bounds is None:
+            return np.full(len(index), -1, dtype=np.int64)
+        row_groups, ends = bounds
+        group = row_groups[np.searchsorted(ends, offset + np.asarray(index), side='right')]
+        # 高位为文件编号（取31位，保证非负），低32位为行组号
+        return (np.int64(file_key(file) & 0x7FFFFFFF) << 32) | group
+
+    def sample(self, num_rows, file=None, strata=None, offset=0):
+        """批次内抽样，返回(入样行号, 权重, 所在行组)
+
+        file为批次所属文件，offset为批次首行在该文件读取数据中的位置：
+        行组已抽样时批次内只需抽取rate/行组入样概率，权重同时计入两级概率；
+        strata为每行的分层编码（如省份编码）
+        """
+        draws = self.uniforms(file, offset, num_rows)
+        group_rate = self.group_rates.get(str(file), 1.0)
+        row_rate = self.rate / group_rate
+        if strata is None:
+            index = np.flatnonzero(draws < row_rate)
+            return index, np.full(len(index), 1.0 / self.rate), self.clusters(file, offset, index)
+
+        # 分层：每层抽取max(按比例, min_stratum)行（不超过该层行数），层内随机
+        strata = np.asarray(strata, dtype=np.int64)
+        sizes = np.bincount(strata)
+        quotas = np.minimum(sizes, np.maximum(np.rint(sizes * row_rate), self.min_stratum)).astype(np.int64)
+        order = np.lexsort((draws, strata))
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        ranks = np.arange(num_rows) - starts[strata[order]]
+        index = np.sort(order[ranks < quotas[strata[order]]])
+        stratum = strata[index]
+        return index, sizes[stratum] / quotas[stratum] / group_rate, self.clusters(file, offset, index)
+
+def sample_weights(df):
+    """抽样权重（非抽样数据返回None）"""
+    return df['sample_weight'].to_numpy(dtype=float) if 'sample_weight' in df.columns else None
+
+def sample_clusters(df):
+    """每行所在的入样行组（-1为逐行入样；没有该列时返回None）"""
+    return df['sample_cluster'].to_numpy(dtype=np.int64) if 'sample_cluster' in df.columns else None
+
+def sample_note(df):
+    """图表标注：样本量与有效抽样率（非抽样数据返回空字符串）"""
+    weights = sample_weights(df)
+    if weights is None:
+        return ''
+    return f"抽样预览：样本{len(weights):,}行（抽样率约{len(weights) / weights.sum():.2%}），数值为加权估计"
+
+def weighted_totals(codes, size, weights, values=None, clusters=None):
+    """分组总量的加权估计与95%置信区间半宽，返回(估计值, 半宽)两个数组
+
+    codes为每行的分组编码（负数表示缺失，忽略），values为None时估计行数；
+    clusters为每行所在的入样行组（-1表示逐行入样），同一行组的行整体计算方差
+    """
+    codes = np.asarray(codes)
+    valid = codes >= 0
+    codes, weights = codes[valid], weights[valid]
+    y = np.ones(len(codes)) if values is None else np.nan_to_num(np.asarray(values, dtype=float)[valid])
+    total = np.bincount(codes, weights=weights * y, minlength=size)
+    rowwise = np.ones(len(codes), dtype=bool) if clusters is None else np.asarray(clusters)[valid] < 0
+    variance = np.bincount(codes[rowwise], weights=(weights * (weights - 1) * y * y)[rowwise],
+                           minlength=size).astype(float)
+    if not rowwise.all():
+        variance += cluster_variance(codes[~rowwise], size, (weights * y)[~rowwise], np.asarray(clusters)[valid][~rowwise])
+    return total, Z_95 * np.sqrt(variance)
+
+def cluster_variance(codes, size, weighted, clusters):
+    """整行组入样部分的方差估计（最终抽样单元法）：每个文件为一层，
+    层内n个行组的加权总量z按 n/(n-1)·Σ(z-z̄)² 计；层内只有一个行组时按z²计（偏保守）
+    """
+    groups, group_index = np.unique(clusters, return_inverse=True)
+    z = np.bincount(group_index * size + codes, weights=weighted, minlength=len(groups) * size).reshape(-1, size)
+    _, stratum = np.unique(groups >> 32, return_inverse=True)
+    n = np.bincount(stratum)
+    sums = np.zeros((len(n), size))
+    np.add.at(sums, stratum, z)
+    squares = np.zeros((len(n), size))
+    np.add.at(squares, stratum, z * z)
+    # Σ(z-z̄)² = Σz² - (Σz)²/n
+    spread = (squares - sums * sums / n[:, None]) * (n / np.maximum(n - 1, 1))[:, None]
+    return np.where((n == 1)[:, None], squares, np.maximum(spread, 0)).sum(axis=0)
@@ -0,0 +1,250 @@
+# server.py
+"""
+分析服务：数据只加载一次并常驻内存，通过本地HTTP接口查询
+
+python server.py 文件/文件夹... [--host 127.0.0.1] [--port 8765] [--refresh 30]
+
+接口（GET，返回JSON）：
+  /health              数据版本、行数、文件数
+  /province            各省记录数
+  /category?top=10     品类销售额top N
+  /hourly              各小时活跃记录数
+  /rfm?limit=100       RFM表（按monetary降序）
+  /hv?limit=100        高价值用户
+  /refresh             立即检查新增/变更的文件
+
+数据以DataFrame常驻（低基数字符串列为Categorical，只保留这一份），聚合结果按数据版本缓存；
+后台线程定期检查文件变化：只有新增文件时只加载、转换新文件并追加，文件变更或删除时全量重新加载。
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from load_and_preprocess import PARSE_WORKERS, ProvinceCache, collect_files, file_format, load_dataset
+
+# 默认检查新文件的间隔（秒）
+REFRESH_INTERVAL = 30
+
+def append_frame(df, new):
+    """追加新文件的数据：两边都是Categorical的列先合并类别，拼接后保持分类类型"""
+    recoded = {}
+    for name in df.columns.intersection(new.columns):
+        old_dtype, new_dtype = df[name].dtype, new[name].dtype
+        if isinstance(old_dtype, pd.CategoricalDtype) and isinstance(new_dtype, pd.CategoricalDtype) \
+                and not old_dtype.categories.equals(new_dtype.categories):
+            categories = old_dtype.categories.union(new_dtype.categories, sort=False)
+            recoded[name] = (df[name].cat.set_categories(categories), new[name].cat.set_categories(categories))
+    if recoded:
+        # assign返回新表，不修改查询线程可能仍在使用的旧表
+        df = df.assign(**{name: pair[0] for name, pair in recoded.items()})
+        new = new.assign(**{name: pair[1] for name, pair in recoded.items()})
+    return pd.concat([df, new], ignore_index=True)
+
+class DatasetStore:
+    """常驻内存的数据集：按需加载新文件，聚合结果按数据版本缓存（线程安全）"""
+    def __init__(self, paths, geo_level='province', workers=PARSE_WORKERS):
+        self.paths = list(paths)
+        self.geo_level = geo_level
+        self.workers = workers
+        self.province_cache = ProvinceCache()
+        self.files = {}  # 文件 -> 修改时间
+        self.df = None
+        self.version = 0
+        self.loaded_at = None
+        self.results = {}
+        self.lock = threading.Lock()          # 保护df/version/results
+        self.refresh_lock = threading.Lock()  # 刷新串行执行
+
+    def scan(self):
+        """当前可读取的文件及其修改时间"""
+        return {str(p): p.stat().st_mtime_ns for p in collect_files(self.paths)
+                if p.exists() and file_format(p) is not None}
+
+    def load(self, files):
+        """加载指定文件为DataFrame（转换时逐列释放Arrow内存）"""
+        return load_dataset(files, workers=self.workers,
+                            province_cache=self.province_cache, geo_level=self.geo_level)
+
+    def refresh(self):
+        """检查文件变化并更新数据，有更新时返回True"""
+        with self.refresh_lock:
+            current = self.scan()
+            added = [f for f in current if f not in self.files]
+            stale = [f for f in self.files if current.get(f) != self.files[f]]
+            if not added and not stale:
+                return False
+            if stale or self.df is None:
+                # 文件变更或删除：全量重新加载
+                df = self.load(list(current))
+            else:
+                df = append_frame(self.df, self.load(added))
+            with self.lock:
+                self.df, self.files = df, current
+                self.version += 1
+                self.loaded_at = time.time()
+                self.results = {}
+            print(f"数据已更新：版本{self.version}，{len(current)}个文件，{len(df):,}行")
+            return True
+
+    def snapshot(self):
+        with self.lock:
+            return self.df, self.version
+
+    def cached(self, name, compute):
+        """按数据版本缓存的计算结果，compute(df)只在数据更新后执行一次"""
+        df, version = self.snapshot()
+        if df is None:
+            raise LookupError("数据尚未加载")
+        with self.lock:
+            hit = self.results.get(name)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        result = compute(df)
+        with self.lock:
+            if self.version == version:
+                self.results[name] = (version, result)
+        return result
+
+"""查询接口：store与查询参数 -> 可JSON序列化的结果"""
+def records(frame):
+    """DataFrame -> 记录列表（缺失值为None）"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+def int_param(params, name, default):
+    return int(params.get(name, [default])[0])
+
+def route_health(store, params):
+    df, version = store.snapshot()
+    return {'version': version, 'files': len(store.files), 'rows': 0 if df is None else len(df),
+            'loaded_at': store.loaded_at}
+
+def route_province(store, params):
+    from visualization import count_by
+    counts = store.cached('province', lambda df: count_by(df['province']))
+    counts = counts[(counts > 0) & (counts.index != 'unknown')]
+    return {'province': records(counts.rename_axis('province').rename('count').reset_index())}
+
+def route_category(store, params):
+    from visualization import category_sales
+    sales = store.cached('category', category_sales).nlargest(int_param(params, 'top', 10))
+    return {'category': records(sales.rename_axis('categories').rename('sales').reset_index())}
+
+def route_hourly(store, params):
+    from visualization import hourly_counts
+    counts = store.cached('hourly', hourly_counts)
+    return {'hourly': records(counts.rename('count').reset_index())}
+
+def rfm_table(store):
+    from user_analysis import build_user_profiles
+    return store.cached('rfm', build_user_profiles)
+
+def route_rfm(store, params):
+    rfm = rfm_table(store)
+    top = rfm.nlargest(int_param(params, 'limit', 100), 'monetary')
+    return {'users': len(rfm), 'rfm': records(top)}
+
+def route_hv(store, params):
+    from user_analysis import identify_high_value_users
+    rfm = rfm_table(store)
+    hv = store.cached('hv', lambda df: identify_high_value_users(rfm, df))
+    return {'count': len(hv), 'hv': records(hv.head(int_param(params, 'limit', 100)))}
+
+def route_refresh(store, params):
+    updated = store.refresh()
+    return {'updated': updated, **route_health(store, params)}
+
+ROUTES = {
+    '/health': route_health,
+    '/province': route_province,
+    '/category': route_category,
+    '/hourly': route_hourly,
+    '/rfm': route_rfm,
+    '/hv': route_hv,
+    '/refresh': route_refresh,
+}
+
+def json_default(value):
+    """numpy标量、时间戳等的JSON转换"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def make_handler(store):
+    """构造绑定store的请求处理类"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            route = ROUTES.get(url.path)
+            start_time = time.perf_counter()
+            try:
+                if route is None:
+                    status, payload = 404, {'error': f"未知接口: {url.path}", 'routes': list(ROUTES)}
+                else:
+                    status, payload = 200, route(store, parse_qs(url.query))
+            except LookupError as e:
+                status, payload = 503, {'error': str(e)}
+            except ValueError as e:
+                status, payload = 400, {'error': str(e)}
+            except Exception as e:
+                status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+            payload['elapsed_ms'] = round((time.perf_counter() - start_time) * 1000, 3)
+            body = json.dumps(payload, ensure_ascii=False, default=json_default).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def make_server(store, host='127.0.0.1', port=8765):
+    """创建HTTP服务（port为0时由系统分配端口，见server.server_address）"""
+    return ThreadingHTTPServer((host, port), make_handler(store))
+
+def start_refresher(store, interval=REFRESH_INTERVAL):
+    """后台线程定期检查新文件，返回用于停止的Event"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                store.refresh()
+            except Exception as e:
+                print(f"刷新失败: {e}")
+
+    threading.Thread(target=run, name="dataset-refresher", daemon=True).start()
+    return stop
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="乐学数据分析服务：数据常驻内存，本地HTTP接口查询")
+    parser.add_argument('paths', nargs='+', metavar='文件/文件夹', help="数据文件或目录（CSV/Parquet/Feather）")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口（0为自动分配）")
+    parser.add_argument('--refresh', type=float, default=REFRESH_INTERVAL, help="检查新文件的间隔（秒），0为不检查")
+    parser.add_argument('--workers', type=int, default=PARSE_WORKERS, help="解析线程数")
+    parser.add_argument('--geo', choices=['province', 'city'], default='province', help="地址解析层级")
+    args = parser.parse_args(argv)
+
+    store = DatasetStore(args.paths, geo_level=args.geo, workers=args.workers)
+    store.refresh()
+    stop = start_refresher(store, args.refresh) if args.refresh > 0 else None
+    server = make_server(store, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"分析服务已启动: http://{host}:{port}/ （接口: {', '.join(ROUTES)}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if stop is not None:
+            stop.set()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
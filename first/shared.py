@@ -0,0 +1,79 @@
+"""
+进程间共享数据集：标准化后的表写出为未压缩的Arrow IPC文件，子进程按路径内存映射读取
+
+- DatasetHandle只记录文件路径、列名与行数，传给子进程时无需序列化整个DataFrame
+- 子进程中的Arrow表为内存映射（零拷贝、只读），多个进程共享操作系统页缓存中的同一份数据
+- 转换为pandas时无缺失值的数值列零拷贝（只读视图），字符串列在各进程中物化
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from sampling import SAMPLE_COLUMNS
+
+class DatasetHandle:
+    """内存映射Arrow文件的句柄，可pickle传给子进程；创建者负责release删除文件"""
+    def __init__(self, path, columns, num_rows, owner=False):
+        self.path = str(path)
+        self.columns = list(columns)
+        self.num_rows = num_rows
+        self.owner = owner
+
+    @classmethod
+    def create(cls, data, directory=None):
+        """写出DataFrame或Arrow表（未压缩，保证可内存映射），返回句柄"""
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+        fd, path = tempfile.mkstemp(prefix='.dataset-', suffix='.arrow', dir=directory)
+        os.close(fd)
+        feather.write_feather(table, path, compression='uncompressed')
+        return cls(path, table.column_names, table.num_rows, owner=True)
+
+    def table(self, columns=None):
+        """内存映射读取（零拷贝），columns为None时读取全部列，不存在的列忽略"""
+        if columns is not None:
+            columns = [c for c in self.columns if c in columns]
+        return feather.read_table(self.path, columns=columns, memory_map=True)
+
+    def to_pandas(self, columns=None):
+        """转换为DataFrame：按列分块，数值列直接引用内存映射的数据，日期列为datetime64"""
+        return self.table(columns).to_pandas(split_blocks=True, date_as_object=False)
+
+    def release(self):
+        """删除文件（仅创建者；仍被内存映射引用的文件在Windows上无法删除，忽略）"""
+        if self.owner:
+            self.owner = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __getstate__(self):
+        # 子进程得到的句柄不负责删除文件
+        return {**self.__dict__, 'owner': False}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __repr__(self):
+        return f"DatasetHandle({self.path!r}, {len(self.columns)}列, {self.num_rows:,}行)"
+
+def as_frame(data, columns=None):
+    """DataFrame原样返回；DatasetHandle读取columns列（抽样数据同时读取sample_weight、sample_cluster列）
+
+    子进程中必须指定columns：读取全部列会让每个子进程物化整个数据集
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    if columns is None and multiprocessing.parent_process() is not None:
+        raise ValueError("子进程中读取共享数据集必须指定所需列（阶段未声明columns）")
+    if columns is not None:
+        columns = list(columns) + SAMPLE_COLUMNS
+    return data.to_pandas(columns)
@@ -0,0 +1,278 @@
+# sketches.py
+"""
+概要统计（sketch）：固定内存的去重计数与高频项统计，在加载时按批次构建，可跨批次、文件、进程合并
+
+- HyperLogLog：各省去重用户数（每省一组寄存器，全国去重数为各组寄存器取最大值后估计），相对误差约1.04/√(2^precision)
+- Count-Min：任意取值的出现次数估计（只会高估），用于收紧高频项的计数上界
+- Space-Saving：地址、品类的Top-N高频项，固定保留capacity个候选，计数为上界，减去error为下界
+- 字符串按固定密钥的64位哈希（pandas.util.hash_array），不同进程、不同运行结果一致
+- 批次按SKETCH_CHUNK_ROWS行分块累计：块内先按取值精确汇总，临时内存随块内不同取值数增长，上界与批大小无关
+- 抽样数据（带sample_weight列）的计数按权重累计；去重用户数只统计入样的用户，是总体的下界
+
+python sketches.py sketches.npz [--top 20]
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from cube import column_codes, float_column
+from geo import PROVINCE_DICTIONARY
+
+HLL_PRECISION = 14
+CM_WIDTH = 2 ** 14
+CM_DEPTH = 4
+TOP_CAPACITY = 1000
+# 统计高频项的列
+HEAVY_COLUMNS = ('address', 'categories')
+# 构建概要统计需要的数据列
+SKETCH_COLUMNS = ['user_name', 'province', *HEAVY_COLUMNS]
+# 每次累计的最大行数
+SKETCH_CHUNK_ROWS = 65536
+
+def column_hashes(column):
+    """字符串列按字典编码后哈希：返回(字典取值, 字典取值的哈希, 各行字典下标, 非空掩码)"""
+    if pa.types.is_dictionary(column.type) and len(column.dictionary) > len(column):
+        # 切片后的字典列仍引用整个字典，只对本块出现的取值重新编码
+        column = column.dictionary_decode()
+    if not pa.types.is_dictionary(column.type):
+        column = pc.dictionary_encode(column)
+    values = np.asarray(column.dictionary.to_numpy(zero_copy_only=False), dtype=object)
+    hashes = pd.util.hash_array(values.astype(str).astype(object), categorize=False)
+    valid = column.indices.is_valid().to_numpy(zero_copy_only=False)
+    index = column.indices.fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+    return values, hashes, index, valid
+
+class HyperLogLog:
+    """分组HyperLogLog：registers[组, 2^precision]，合并为逐位取最大值"""
+    def __init__(self, precision=HLL_PRECISION, groups=1, registers=None):
+        # 哈希低位部分需能被float64精确表示（64 - precision <= 53）
+        if not 11 <= precision <= 18:
+            raise ValueError(f"precision应在11-18之间: {precision}")
+        self.precision = precision
+        self.registers = np.zeros((groups, 1 << precision), dtype=np.uint8) if registers is None else registers
+
+    def add(self, hashes, groups=None):
+        """hashes为uint64哈希，groups为各哈希所属组（默认第0组）"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # 低位部分首个1之前的0的个数 + 1；frexp(0)的指数为0，对应全0时的bits + 1
+        _, exponent = np.frexp(rest.astype(float))
+        rank = (bits + 1 - exponent).astype(np.uint8)
+        groups = np.zeros(len(hashes), dtype=np.int64) if groups is None else groups
+        np.maximum.at(self.registers, (groups, index), rank)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f"precision不一致: {self.precision} != {other.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @staticmethod
+    def _estimate(registers):
+        m = registers.shape[-1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=-1)
+        # 小基数时改用线性计数
+        zeros = np.count_nonzero(registers == 0, axis=-1)
+        with np.errstate(divide='ignore'):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+    def estimate(self):
+        """各组去重数估计"""
+        return self._estimate(self.registers)
+
+    def union(self):
+        """所有组合并后的去重数估计"""
+        return float(self._estimate(self.registers.max(axis=0)))
+
+class CountMin:
+    """Count-Min：table[depth, width]，第i行位置为(h1 + i·h2) mod width，估计值取各行最小"""
+    def __init__(self, width=CM_WIDTH, depth=CM_DEPTH, table=None):
+        self.table = np.zeros((depth, width)) if table is None else table
+
+    def _positions(self, hashes):
+        depth, width = self.table.shape
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1 = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        h2 = (hashes >> np.uint64(32)).astype(np.int64)
+        return (h1 + np.arange(depth)[:, None] * h2) % width
+
+    def add(self, hashes, counts):
+        depth, width = self.table.shape
+        flat = (self._positions(hashes) + np.arange(depth)[:, None] * width).ravel()
+        self.table += np.bincount(flat, weights=np.tile(counts, depth), minlength=self.table.size).reshape(depth, width)
+        return self
+
+    def query(self, hashes):
+        return self.table[np.arange(self.table.shape[0])[:, None], self._positions(hashes)].min(axis=0)
+
+    def merge(self, other):
+        if other.table.shape != self.table.shape:
+            raise ValueError(f"Count-Min尺寸不一致: {self.table.shape} != {other.table.shape}")
+        self.table += other.table
+        return self
+
+class SpaceSaving:
+    """Space-Saving高频项：最多保留capacity个候选，counts为计数上界，counts - errors为下界
+
+    合并（Agarwal等的可合并摘要）：一方没有的候选按该方的最小计数补齐（已满时），相加后保留计数最大的capacity个
+    """
+    def __init__(self, capacity=TOP_CAPACITY, labels=(), counts=(), errors=()):
+        self.capacity = capacity
+        self.labels = list(labels)
+        self.counts = np.asarray(counts, dtype=float)
+        self.errors = np.asarray(errors, dtype=float)
+
+    @classmethod
+    def from_counts(cls, labels, counts, capacity=TOP_CAPACITY):
+        """由精确计数构建：超过capacity时只保留最大的，误差为被舍弃的最大计数"""
+        labels, counts = np.asarray(labels, dtype=object), np.asarray(counts, dtype=float)
+        keep = counts > 0
+        labels, counts = labels[keep], counts[keep]
+        error = 0.0
+        if len(counts) > capacity:
+            order = np.argsort(-counts, kind='stable')
+            error = counts[order[capacity]]
+            labels, counts = labels[order[:capacity]], counts[order[:capacity]]
+        return cls(capacity, labels, counts, np.full(len(counts), error))
+
+    @property
+    def floor(self):
+        """未被保留的取值计数上界"""
+        return self.counts.min() if len(self.labels) >= self.capacity else 0.0
+
+    def merge(self, other):
+        mine = pd.DataFrame({'count': self.counts, 'error': self.errors}, index=pd.Index(self.labels, dtype=object))
+        theirs = pd.DataFrame({'count': other.counts, 'error': other.errors}, index=pd.Index(other.labels, dtype=object))
+        index = mine.index.union(theirs.index, sort=False)
+        combined = mine.reindex(index, fill_value=self.floor) + theirs.reindex(index, fill_value=other.floor)
+        combined = combined.sort_values('count', ascending=False, kind='stable').iloc[:self.capacity]
+        self.labels = combined.index.tolist()
+        self.counts, self.errors = combined['count'].to_numpy(), combined['error'].to_numpy()
+        return self
+
+class Sketches:
+    """加载过程中的概要统计：各省去重用户数 + 地址/品类高频项"""
+    def __init__(self, precision=HLL_PRECISION, capacity=TOP_CAPACITY, width=CM_WIDTH, depth=CM_DEPTH,
+                 weighted=False):
+        self.provinces = PROVINCE_DICTIONARY.to_pylist()
+        self.users = HyperLogLog(precision, groups=len(self.provinces))
+        self.heavy = {name: SpaceSaving(capacity) for name in HEAVY_COLUMNS}
+        self.frequency = {name: CountMin(width, depth) for name in HEAVY_COLUMNS}
+        self.weighted = weighted
+
+    @classmethod
+    def from_table(cls, table, **options):
+        """从标准化后的Arrow表（或批次）构建"""
+        sketches = cls(**options)
+        batches = table.to_batches() if isinstance(table, pa.Table) else [table]
+        for batch in batches:
+            sketches.update(batch)
+        return sketches
+
+    def update(self, batch):
+        """累计一个批次（缺少的列跳过），每次最多累计SKETCH_CHUNK_ROWS行"""
+        self.weighted = self.weighted or 'sample_weight' in batch.schema.names
+        for start in range(0, batch.num_rows, SKETCH_CHUNK_ROWS):
+            self.update_chunk(batch.slice(start, SKETCH_CHUNK_ROWS))
+        return self
+
+    def update_chunk(self, batch):
+        names = batch.schema.names
+        if 'user_name' in names:
+            _, hashes, index, valid = column_hashes(batch.column('user_name'))
+            province = column_codes(batch, 'province', len(self.provinces), len(self.provinces) - 1)
+            self.users.add(hashes[index[valid]], province[valid])
+        weights = float_column(batch, 'sample_weight', 1.0)
+        for name in HEAVY_COLUMNS:
+            if name not in names:
+                continue
+            values, hashes, index, valid = column_hashes(batch.column(name))
+            # 先按字典取值汇总，每个取值只更新一次
+            counts = np.bincount(index[valid], weights=weights[valid], minlength=len(values))
+            present = counts > 0
+            self.frequency[name].add(hashes[present], counts[present])
+            self.heavy[name].merge(SpaceSaving.from_counts(values.astype(str), counts, self.heavy[name].capacity))
+
+    def merge(self, other):
+        self.users.merge(other.users)
+        for name in HEAVY_COLUMNS:
+            self.heavy[name].merge(other.heavy[name])
+            self.frequency[name].merge(other.frequency[name])
+        self.weighted = self.weighted or other.weighted
+        return self
+
+    def distinct_users(self):
+        """各省去重用户数估计（降序，去掉为0的省份），全国合计见total_users"""
+        counts = pd.Series(np.rint(self.users.estimate()).astype(np.int64), index=self.provinces, name='users')
+        return counts[counts > 0].sort_values(ascending=False, kind='stable')
+
+    def total_users(self):
+        return int(round(self.users.union()))
+
+    def top(self, name, n=20):
+        """name列的Top-N：count为Space-Saving与Count-Min上界中较小者，lower为下界"""
+        summary = self.heavy[name]
+        if not summary.labels:
+            return pd.DataFrame(columns=[name, 'count', 'lower'])
+        labels = np.asarray(summary.labels, dtype=object)
+        hashes = pd.util.hash_array(labels, categorize=False)
+        count = np.minimum(summary.counts, self.frequency[name].query(hashes))
+        lower = np.maximum(summary.counts - summary.errors, 0)
+        result = pd.DataFrame({name: labels, 'count': count, 'lower': np.minimum(lower, count)})
+        return result.sort_values('count', ascending=False, kind='stable', ignore_index=True).head(n)
+
+    def report(self, n=20):
+        """文本报告：各省去重用户数与各列Top-N"""
+        lines = [f"去重用户数（HyperLogLog，相对误差约{1.04 / np.sqrt(self.users.registers.shape[1]):.1%}）："
+                 f"全国约{self.total_users():,}"]
+        if self.weighted:
+            lines.append("（抽样数据：去重用户数只统计入样用户；高频项计数为按权重放大的估计值）")
+        lines += [f"  {province}: {count:,}" for province, count in self.distinct_users().items()]
+        for name in HEAVY_COLUMNS:
+            top = self.top(name, n)
+            if top.empty:
+                continue
+            lines.append(f"{name} Top {len(top)}（计数上界 / 下界）：")
+            lines += [f"  {row[name]}: {row['count']:,.0f} / {row['lower']:,.0f}" for _, row in top.iterrows()]
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """保存为.npz（标签以字符串数组保存，不依赖pickle）"""
+        arrays = {'registers': self.users.registers, 'weighted': self.weighted}
+        for name in HEAVY_COLUMNS:
+            summary = self.heavy[name]
+            arrays.update({f'{name}_labels': np.array(summary.labels, dtype=str), f'{name}_counts': summary.counts,
+                           f'{name}_errors': summary.errors, f'{name}_capacity': summary.capacity,
+                           f'{name}_table': self.frequency[name].table})
+        np.savez_compressed(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            sketches = cls(weighted=bool(f['weighted']))
+            registers = f['registers']
+            sketches.users = HyperLogLog(int(np.log2(registers.shape[1])), registers=registers)
+            for name in HEAVY_COLUMNS:
+                sketches.heavy[name] = SpaceSaving(int(f[f'{name}_capacity']), f[f'{name}_labels'].tolist(),
+                                                   f[f'{name}_counts'], f[f'{name}_errors'])
+                sketches.frequency[name] = CountMin(table=f[f'{name}_table'])
+        return sketches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="概要统计报告")
+    parser.add_argument('path', help="sketches.npz文件（main.py --sketches生成）")
+    parser.add_argument('--top', type=int, default=20, help="高频项显示数量")
+    args = parser.parse_args(argv)
+    print(Sketches.load(args.path).report(args.top))
+
+if __name__ == "__main__":
+    main()
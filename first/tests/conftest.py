@@ -0,0 +1,76 @@
+"""
+测试公共部分：生成小规模数据集（parquet/CSV/压缩CSV，含旧版列名与异常记录）
+
+运行：在first目录下执行 python -m pytest tests
+"""
+import gzip
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# 被测模块位于first目录下（平铺的模块，没有包结构）
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+ADDRESSES = ['广东省深圳市南山区', '北京市海淀区', '上海市浦东新区', '浙江省杭州市西湖区',
+             '四川省成都市武侯区', '新疆维吾尔自治区乌鲁木齐市天山区', '内蒙古自治区呼和浩特市', '火星基地']
+CATEGORIES = ['电子产品', '服装', '食品', '家居', '办公用品', '玩具']
+ROWS = 6000
+
+def make_frame(rows=ROWS, seed=0, old_names=False, bad_every=0):
+    """生成原始数据：old_names为True时使用旧版列名，bad_every > 0时每隔若干行插入无法解析的购买记录"""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp('2023-01-01', tz='UTC') + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit='s')
+    purchases = [json.dumps({'avg_price': int(rng.integers(10, 10000)),
+                             'categories': CATEGORIES[rng.integers(len(CATEGORIES))],
+                             'items': [{'id': int(i)} for i in rng.integers(0, 1000, rng.integers(1, 5))]},
+                            ensure_ascii=False) for _ in range(rows)]
+    if bad_every:
+        purchases[::bad_every] = ['not json'] * len(purchases[::bad_every])
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'last_login' if old_names else 'timestamp': [t.isoformat() for t in timestamps],
+        'user_name': [f'user{i}' for i in rng.integers(0, rows // 3, rows)],
+        'fullname' if old_names else 'chinese_name': ['张三'] * rows,
+        'income': rng.integers(1000, 1000000, rows).astype(float),
+        'chinese_address': [ADDRESSES[k] + '某路1号' for k in rng.integers(len(ADDRESSES), size=rows)],
+        'purchase_history': purchases,
+        'is_active': rng.integers(0, 2, rows).astype(bool),
+        'registration_date': (pd.Timestamp('2020-01-01')
+                              + pd.to_timedelta(rng.integers(0, 1000, rows), unit='D')).strftime('%Y-%m-%d'),
+        'credit_score': rng.integers(300, 850, rows),
+    })
+
+@pytest.fixture(scope='session')
+def dataset_dir(tmp_path_factory):
+    """两个parquet文件（多个行组）+ 一个旧版列名的CSV（含异常记录）"""
+    directory = tmp_path_factory.mktemp('data')
+    for seed in range(2):
+        make_frame(seed=seed).to_parquet(directory / f'part{seed}.parquet', row_group_size=ROWS // 4)
+    make_frame(seed=5, old_names=True, bad_every=97).to_csv(directory / 'old.csv', index=False)
+    return directory
+
+@pytest.fixture(scope='session')
+def csv_pair(tmp_path_factory):
+    """同一份数据的parquet、CSV与gzip压缩CSV"""
+    directory = tmp_path_factory.mktemp('formats')
+    frame = make_frame(seed=7)
+    frame.to_parquet(directory / 'data.parquet')
+    frame.to_csv(directory / 'data.csv', index=False)
+    with gzip.open(directory / 'data.csv.gz', 'wt', encoding='utf-8') as f:
+        frame.to_csv(f, index=False)
+    return directory
+
+@pytest.fixture(scope='session')
+def dataset_files(dataset_dir):
+    from load_and_preprocess import collect_files
+    return sorted(collect_files([dataset_dir]))
+
+@pytest.fixture(scope='session')
+def frame(dataset_files):
+    """标准化后的完整数据（会话内共用，测试中不要修改）"""
+    from load_and_preprocess import load_dataset
+    return load_dataset(dataset_files)
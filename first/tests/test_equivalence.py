@@ -0,0 +1,609 @@
+"""
+结果一致性：优化实现（向量化内核、缓存、共享数据集、立方体、内存预算加载等）与直接写法的结果一致
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from conftest import ADDRESSES
+
+PROFILE_COLUMNS = ['user_name', 'recency', 'frequency', 'monetary', 'R', 'F', 'M']
+
+def sort_frame(frame):
+    """按全部列排序后比较（并发加载时行序可能不同）"""
+    return frame.sort_values(list(frame.columns)).reset_index(drop=True)
+
+def reference_profiles(df):
+    """RFM直接写法：groupby聚合 + 百分比排名 + qcut"""
+    data = pd.DataFrame({'user_name': df['user_name'], 'timestamp': df['timestamp'],
+                         'monetary': df['avg_price'] * df['items_count']})
+    snapshot_date = data['timestamp'].max() + pd.Timedelta(days=1)
+    rfm = data.groupby('user_name').agg(recency=('timestamp', 'max'), frequency=('timestamp', 'count'),
+                                        monetary=('monetary', 'sum')).reset_index()
+    rfm['recency'] = (snapshot_date - rfm['recency']).dt.days
+
+    def binning(series, ascending=True):
+        q = min(5, series.nunique())
+        bins = pd.qcut(series.rank(pct=True, method='first'), q=q, labels=False, duplicates='drop') + 1
+        return bins if ascending else q - bins + 1
+
+    rfm['R'] = binning(rfm['recency'], ascending=False)
+    rfm['F'] = binning(rfm['frequency'])
+    rfm['M'] = binning(rfm['monetary'])
+    return rfm
+
+def test_build_user_profiles_matches_reference(frame):
+    from user_analysis import build_user_profiles
+    # 不需要purchase_history列
+    actual = build_user_profiles(frame.drop(columns='purchase_history'))[PROFILE_COLUMNS]
+    expected = reference_profiles(frame)[PROFILE_COLUMNS]
+    pd.testing.assert_frame_equal(sort_frame(actual), sort_frame(expected), check_dtype=False)
+
+def test_build_user_profiles_from_shared_handle(frame, tmp_path):
+    from shared import DatasetHandle
+    from user_analysis import build_user_profiles
+    with DatasetHandle.create(frame, directory=tmp_path) as handle:
+        shared = build_user_profiles(handle)
+    pd.testing.assert_frame_equal(shared, build_user_profiles(frame))
+
+def test_identify_high_value_users_matches_reference(frame):
+    from user_analysis import build_user_profiles, identify_high_value_users
+    profiles = build_user_profiles(frame)
+    columns = list(profiles.columns)
+    actual = identify_high_value_users(profiles, frame)
+    expected = identify_high_value_users(reference_profiles(frame), frame)
+    assert len(actual) > 0
+    # 不修改传入的rfm表（main与server在多个阶段间共享该表）
+    assert list(profiles.columns) == columns
+    pd.testing.assert_frame_equal(sort_frame(actual[expected.columns]), sort_frame(expected), check_dtype=False)
+
+def reference_province(address):
+    """逐行子串匹配（与match_provinces相同：最早出现的省份名称优先）"""
+    from geo import PROVINCE_LIST
+    if address is None:
+        return 'unknown'
+    matched = [(address.find(p), p) for p in PROVINCE_LIST if p in address]
+    return min(matched)[1] if matched else 'unknown'
+
+# 含多个省份名称的地址：省份名称在缓存前缀内、跨越前缀边界或在前缀之后
+MULTI_PROVINCE = ['北京市朝阳区吉林省路1号', '吉林省长春市北京市路2号', '中国北京市朝阳区吉林省路3号',
+                  '中国内蒙古自治区吉林省路', '某某小区北京市', '上海市上海市', '广东省北京市', '河北省北京市']
+
+@pytest.mark.parametrize('dictionary', [False, True])
+@pytest.mark.parametrize('cached', [False, True])
+def test_resolve_province_matches_reference(dictionary, cached):
+    from load_and_preprocess import ProvinceCache, resolve_province
+    addresses = [a + suffix for a in ADDRESSES for suffix in ('某路1号', '')] + [None, '', '广东省'] + MULTI_PROVINCE
+    array = pa.array(addresses * 3)
+    if dictionary:
+        array = array.dictionary_encode()
+    cache = ProvinceCache() if cached else None
+    # 带缓存时解析两次，第二次全部命中缓存
+    for _ in range(2 if cached else 1):
+        result = resolve_province(array, cache)
+    assert result.to_pylist() == [reference_province(a) for a in addresses * 3]
+    if cached:
+        assert cache.hit_rate > 0
+
+def test_province_cache_agrees_with_uncached(tmp_path):
+    from load_and_preprocess import ProvinceCache, resolve_province
+    array = pa.array(MULTI_PROVINCE)
+    expected = resolve_province(array).to_pylist()
+    assert expected[:3] == ['北京市', '吉林省', '北京市']
+    # 先以共享前缀的其他地址填充缓存，再解析多省份地址；保存后重新加载的缓存结果相同
+    cache = ProvinceCache(path=tmp_path / 'provinces.json')
+    resolve_province(pa.array(['北京市朝阳区吉林大街', '中国北京市朝阳区', '某某小区']), cache)
+    assert resolve_province(array, cache).to_pylist() == expected
+    cache.save()
+    assert resolve_province(array, ProvinceCache(path=tmp_path / 'provinces.json')).to_pylist() == expected
+
+GEO_ADDRESSES = {
+    '广东省深圳市南山区科技园路1号': ('广东省', '深圳市', '南山区'),
+    '广东省深圳南山区': ('广东省', '深圳市', '南山区'),
+    '北京市朝阳区吉林省路1号': ('北京市', '北京市', '朝阳区'),
+    '吉林省长春市朝阳区人民大街': ('吉林省', '长春市', '朝阳区'),
+    '中国浙江省杭州市西湖区': ('浙江省', '杭州市', '西湖区'),
+    '新疆维吾尔自治区克孜勒苏柯尔克孜自治州阿图什市某路': ('新疆维吾尔自治区', '克孜勒苏柯尔克孜自治州', '阿图什市'),
+    # 市不属于该省、重名区县缺少市、省份未识别：下级为unknown
+    '广东省杭州市西湖区': ('广东省', 'unknown', 'unknown'),
+    '广东省西湖区': ('广东省', 'unknown', 'unknown'),
+    '深圳市南山区': ('unknown', 'unknown', 'unknown'),
+    '': ('unknown', 'unknown', 'unknown'),
+}
+
+@pytest.mark.parametrize('dictionary', [False, True])
+def test_geo_resolver_agrees_with_province(dictionary):
+    from geo import AREA_LIST, AREA_PARENT, CITY_LIST, CITY_PARENT, GeoResolver
+    from load_and_preprocess import resolve_province
+    rng = np.random.default_rng(3)
+    # 地址开头长短不一：去重解析（按开头若干字符）与逐行完整匹配结果相同
+    addresses = list(GEO_ADDRESSES) + [None] + [
+        f'{ADDRESSES[k]}{"建设人民解放"[k % 3 * 2:k % 3 * 2 + 2]}路{n}号' for k, n in
+        zip(rng.integers(len(ADDRESSES), size=3000), rng.integers(1, 500, 3000))] + MULTI_PROVINCE
+    array = pa.array(addresses)
+    if dictionary:
+        array = array.dictionary_encode()
+    province = resolve_province(array)
+    resolver = GeoResolver()
+    city, area = resolver.resolve_columns(array, province)
+    for address, expected in GEO_ADDRESSES.items():
+        i = addresses.index(address)
+        assert (province[i].as_py(), city[i].as_py(), area[i].as_py()) == expected, address
+    codes = [column.indices.to_numpy(zero_copy_only=False).astype(np.int64) for column in (province, city, area)]
+    exact_city, exact_area, _, _ = resolver.match(pa.array(addresses), codes[0])
+    np.testing.assert_array_equal(codes[1], exact_city)
+    np.testing.assert_array_equal(codes[2], exact_area)
+    # 三级一致：已识别的市属于该省，已识别的区县属于该市（重名区县除外）
+    known = codes[1] != len(CITY_LIST)
+    assert (CITY_PARENT[codes[1][known]] == codes[0][known]).all()
+    area_known = codes[2] != len(AREA_LIST)
+    parent = AREA_PARENT[codes[2][area_known]]
+    assert known[area_known].all() and ((parent == codes[1][area_known]) | (parent == len(CITY_LIST))).all()
+    assert known.mean() > 0.8
+
+@pytest.mark.parametrize('dictionary', [False, True])
+def test_address_encoding_follows_distinct_ratio(dictionary):
+    from load_and_preprocess import normalize_batch
+    unique = pa.array([f'{ADDRESSES[i % len(ADDRESSES)]}某路{i}号' for i in range(5000)])
+    repeated = pa.array([ADDRESSES[i % len(ADDRESSES)] for i in range(5000)])
+    if dictionary:
+        unique, repeated = unique.dictionary_encode(), repeated.dictionary_encode()
+    # 几乎每行唯一的地址保持普通字符串，重复多的地址字典编码；省份解析结果不受影响
+    for array, encoded in ((unique, False), (repeated, True)):
+        table = normalize_batch(pa.record_batch({'address': array}))
+        assert pa.types.is_dictionary(table.column('address').type) == encoded
+        assert table.column('address').to_pylist() == array.to_pylist()
+        assert table.column('province').to_pylist() == [reference_province(a) for a in array.to_pylist()]
+
+QUANTILE_CASES = [
+    ('exponential', lambda rng: rng.exponential(2000, 10001).round()),
+    # 大量重复值：分位点落在重复值上，检验边界与pandas.qcut一致
+    ('ties', lambda rng: rng.integers(0, 3, 1000).astype(float)),
+    ('small', lambda rng: np.arange(7.0)),
+]
+
+@pytest.mark.parametrize('name, make', QUANTILE_CASES)
+def test_quantile_bins_matches_qcut(name, make, monkeypatch):
+    import kernels
+    from benchmark import qcut_baseline
+    values = make(np.random.default_rng(0))
+    q = min(5, len(np.unique(values)))
+    expected = qcut_baseline(values, q)
+    # 强制走NumPy回退路径；安装了numba时两条路径都与qcut一致
+    with monkeypatch.context() as patch:
+        patch.setattr(kernels, 'HAS_NUMBA', False)
+        np.testing.assert_array_equal(kernels.quantile_bins(values, q), expected)
+    if kernels.HAS_NUMBA:
+        np.testing.assert_array_equal(kernels.quantile_bins(values, q), expected)
+
+def test_hour_counts_and_histogram():
+    from benchmark import hour_baseline
+    from kernels import fixed_histogram, hour_counts
+    rng = np.random.default_rng(1)
+    hours = rng.integers(0, 24, 5000).astype(np.int8)
+    np.testing.assert_array_equal(hour_counts(hours), hour_baseline(hours))
+    weights = rng.random(5000)
+    np.testing.assert_allclose(hour_counts(hours, weights), np.bincount(hours, weights=weights, minlength=24))
+    prices = rng.lognormal(7, 1, 5000)
+    edges = np.linspace(prices.min(), np.quantile(prices, 0.95), 30)
+    np.testing.assert_array_equal(fixed_histogram(prices, edges), np.histogram(prices, bins=edges)[0])
+
+@pytest.mark.parametrize('name', ['data.csv', 'data.csv.gz'])
+def test_csv_loader_matches_parquet(csv_pair, name):
+    from load_and_preprocess import load_dataset
+    expected = load_dataset([csv_pair / 'data.parquet'])
+    actual = load_dataset([csv_pair / name])
+    for column in expected.columns:
+        np.testing.assert_array_equal(actual[column].astype(object).to_numpy(),
+                                      expected[column].astype(object).to_numpy(), err_msg=column)
+
+def test_loader_columns_and_quality(dataset_files):
+    from load_and_preprocess import load_dataset
+    from quality import QualityStats
+    quality = QualityStats()
+    df = load_dataset(dataset_files, columns=['province', 'avg_price', 'hour'], quality=quality)
+    assert sorted(df.columns) == ['avg_price', 'hour', 'province']
+    assert quality.counts['rows'] == len(df)
+    # old.csv每97行一条无法解析的购买记录
+    assert quality.counts['purchase_parse_failures'] == len(range(0, 6000, 97))
+    assert quality.counts['unknown_provinces'] == (df['province'] == 'unknown').sum() > 0
+
+def test_memory_governor_loader_matches(dataset_files, frame):
+    from load_and_preprocess import load_dataset
+    from memory import MemoryGovernor
+    # 上限低于进程当前内存：每个批次后都会压缩并落盘
+    governor = MemoryGovernor(1, in_flight=4, min_rows=1000)
+    df = load_dataset(dataset_files, governor=governor)
+    assert governor.compactions > 0 and governor.spills > 0
+    for column in frame.columns:
+        np.testing.assert_array_equal(df[column].astype(object).to_numpy(),
+                                      frame[column].astype(object).to_numpy(), err_msg=column)
+
+def test_cube_matches_dataframe_aggregates(dataset_files):
+    from cube import Cube
+    from load_and_preprocess import load_dataset
+    from sampling import sample_weights
+    from visualization import category_sales, count_by, hourly_counts
+    cube = Cube()
+    df = load_dataset(dataset_files, cube=cube)
+    pd.testing.assert_series_equal(cube.province_counts(), count_by(df['province'], sample_weights(df)))
+    pd.testing.assert_series_equal(cube.hourly_counts(), hourly_counts(df))
+    sales = category_sales(df)
+    np.testing.assert_allclose(cube.category_sales().reindex(sales.index), sales)
+    # 下钻：广东省20点各品类销售额
+    mask = (df['province'] == '广东省') & (df['hour'] == 20)
+    expected = df[mask].groupby('categories', observed=True)['avg_price'].sum()
+    actual = cube.query('price', by='categories', province='广东省', hour=20)
+    np.testing.assert_allclose(actual.reindex(expected.index), expected)
+
+def test_cohort_retention_matches_reference(frame):
+    from user_analysis import cohort_retention
+    # date32列转为datetime64（不是datetime.date对象），month_codes无需逐值解析
+    assert pd.api.types.is_datetime64_any_dtype(frame['registration_date'])
+    retention = cohort_retention(frame)
+    data = pd.DataFrame({'user': frame['user_name'],
+                         'registration': pd.to_datetime(frame['registration_date']).dt.to_period('M'),
+                         'activity': frame['timestamp'].dt.to_period('M')})
+    cohort = data.groupby('user')['registration'].min()
+    data['offset'] = (data['activity'].dt.year - data['user'].map(cohort).dt.year) * 12 \
+        + data['activity'].dt.month - data['user'].map(cohort).dt.month
+    active = data[data['offset'] >= 0].drop_duplicates(['user', 'offset']).groupby(['user', 'offset']).size()
+    active = active.reset_index().assign(cohort=lambda d: d['user'].map(cohort).astype(str))
+    counts = active.groupby(['cohort', 'offset']).size()
+    sizes = cohort.astype(str).value_counts()
+    np.testing.assert_array_equal(retention['users'], sizes.reindex(retention.index))
+    for (month, offset), count in counts.items():
+        assert retention.loc[month, offset] == pytest.approx(count / sizes[month])
+
+@pytest.mark.parametrize('chunk_rows', [None, 1000])
+def test_sketches_match_exact_counts(dataset_files, frame, chunk_rows, monkeypatch):
+    import sketches as module
+    from load_and_preprocess import load_dataset
+    from sketches import Sketches
+    if chunk_rows is not None:
+        # 批次分为多块累计，结果不变
+        monkeypatch.setattr(module, 'SKETCH_CHUNK_ROWS', chunk_rows)
+    sketches = Sketches()
+    load_dataset(dataset_files, sketches=sketches)
+    # HyperLogLog：各省去重用户数误差在几个标准误差以内
+    exact = frame.groupby('province', observed=True)['user_name'].nunique()
+    estimate = sketches.distinct_users().reindex(exact.index)
+    np.testing.assert_allclose(estimate, exact, rtol=0.05)
+    assert sketches.total_users() == pytest.approx(frame['user_name'].nunique(), rel=0.05)
+    # 取值数不超过容量时高频项计数精确
+    top = sketches.top('categories', n=3).set_index('categories')['count']
+    expected = frame['categories'].value_counts().head(3)
+    np.testing.assert_array_equal(top.to_numpy(), expected.to_numpy())
+
+def test_space_saving_bounds_and_merge(tmp_path):
+    from sketches import Sketches
+    rng = np.random.default_rng(2)
+    values = rng.zipf(1.5, 50000)
+    addresses = pa.array([f'地址{v}' for v in values])
+    # 分片构建后合并（模拟多个文件/工作线程），容量远小于取值数
+    sketches = Sketches(capacity=50)
+    for start in range(0, len(addresses), 5000):
+        sketches.merge(Sketches.from_table(pa.table({'address': addresses[start:start + 5000]}), capacity=50))
+    sketches = Sketches.load(sketches.save(tmp_path / 'sketches.npz'))
+    exact = pd.Series(addresses.to_pylist()).value_counts()
+    top = sketches.top('address', n=10).set_index('address')
+    assert top.index.tolist() == exact.index[:10].tolist()
+    assert (top['lower'] <= exact[top.index]).all() and (exact[top.index] <= top['count']).all()
+
+def test_row_group_index_summary(dataset_files, frame, tmp_path):
+    from rowgroups import RowGroupIndex
+    index = RowGroupIndex(tmp_path)
+    summary = index.summary(dataset_files)
+    assert summary['files'] == 2 and summary['unindexed'] == [str(f) for f in dataset_files if f.suffix == '.csv']
+    # 第二次从索引文件读取，结果不变
+    assert RowGroupIndex(tmp_path).summary(dataset_files) == summary
+    # 文件按名称排序，old.csv在前
+    parquet = frame.iloc[-summary['rows']:]
+    assert summary['provinces'] == parquet['province'].astype(str).value_counts().to_dict()
+    assert summary['timestamp'] == [parquet['timestamp'].min().isoformat(), parquet['timestamp'].max().isoformat()]
+
+def test_row_filter_parses_timestamps_once(monkeypatch):
+    import load_and_preprocess
+    import rowgroups
+    from conftest import make_frame
+    calls = []
+
+    def counting(values, *args, **kwargs):
+        calls.append(len(values))
+        return normalize(values, *args, **kwargs)
+
+    normalize = load_and_preprocess.normalize_timestamp
+    monkeypatch.setattr(load_and_preprocess, 'normalize_timestamp', counting)
+    monkeypatch.setattr(rowgroups, 'normalize_timestamp', counting)
+    batch = pa.RecordBatch.from_pandas(make_frame(1000, seed=2), preserve_index=False)
+    row_filter = rowgroups.RowGroupFilter('2023-03-01', '2023-06-30', index=rowgroups.RowGroupIndex())
+    table = load_and_preprocess.normalize_batch(batch, row_filter=row_filter)
+    assert calls == [1000]
+    start, end = rowgroups.parse_day('2023-03-01'), rowgroups.parse_day('2023-06-30')
+    days = table.column('date').to_numpy()
+    assert 0 < len(days) < 1000 and ((days >= start) & (days <= end)).all()
+
+def test_summary_index_location(dataset_files, tmp_path):
+    import shutil
+    from main import main
+    data, output = tmp_path / 'data', tmp_path / 'out'
+    data.mkdir()
+    for file in dataset_files:
+        shutil.copy(file, data)
+    before = sorted(p.name for p in data.iterdir())
+    # 默认写在输出目录下，不修改数据目录
+    assert main([str(data), '-o', str(output), '--summary'])
+    assert sorted(p.name for p in data.iterdir()) == before
+    assert len(list((output / 'rgindex').glob('*.rgindex.json'))) == 2
+    # 显式指定时写在源文件旁
+    assert main([str(data), '-o', str(output), '--summary', '--index-beside-data'])
+    assert len(list(data.glob('*.rgindex.json'))) == 2
+
+def test_filtered_load_skips_row_groups(tmp_path):
+    from conftest import make_frame
+    from load_and_preprocess import load_dataset
+    from rowgroups import RowGroupFilter, RowGroupIndex
+    # 按时间排序写出，每个行组只覆盖一段时间，日期筛选可跳过大部分行组
+    path = tmp_path / 'sorted.parquet'
+    make_frame(seed=3).sort_values('timestamp').to_parquet(path, row_group_size=500)
+    row_filter = RowGroupFilter('2023-03-01', '2023-04-15', ['广东省', '北京市'], index=RowGroupIndex(tmp_path))
+    assert 0 < len(row_filter.select(path)) < 12
+    actual = load_dataset([path], row_filter=row_filter, batch_size=700)
+    full = load_dataset([path])
+    start, end = (pd.Timestamp(d) - pd.Timestamp('1970-01-01') for d in ('2023-03-01', '2023-04-15'))
+    mask = full['date'].between(start.days, end.days) & full['province'].isin(['广东省', '北京市'])
+    expected = full[mask].reset_index(drop=True)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(actual.astype(object), expected.astype(object))
+
+@pytest.fixture(scope='module')
+def sampled_files(tmp_path_factory):
+    """行组较多的parquet（触发行组抽样）+ CSV"""
+    from conftest import make_frame
+    directory = tmp_path_factory.mktemp('sampled')
+    make_frame(seed=11).to_parquet(directory / 'many.parquet', row_group_size=250)
+    make_frame(seed=12).to_csv(directory / 'plain.csv', index=False)
+    return [directory / 'many.parquet', directory / 'plain.csv']
+
+@pytest.mark.parametrize('stratify', [None, 'province'])
+def test_sampler_is_reproducible(sampled_files, stratify):
+    from load_and_preprocess import load_dataset
+    from sampling import Sampler
+    runs = [load_dataset(sampled_files, workers=4, batch_size=700, sampler=Sampler(0.2, stratify=stratify, seed=1))
+            for _ in range(3)]
+    for df in runs[1:]:
+        pd.testing.assert_frame_equal(df, runs[0])
+    assert (runs[0]['sample_cluster'] >= 0).any() and (runs[0]['sample_cluster'] == -1).any()
+    other = load_dataset(sampled_files, workers=4, batch_size=700, sampler=Sampler(0.2, stratify=stratify, seed=2))
+    assert not other['id'].equals(runs[0]['id'])
+    if stratify is None:
+        # 随机数按行在文件中的位置生成，与批次划分无关
+        pd.testing.assert_frame_equal(load_dataset(sampled_files, workers=2, batch_size=333,
+                                                   sampler=Sampler(0.2, seed=1)), runs[0])
+
+def test_cluster_intervals_cover_row_group_sampling():
+    from sampling import Sampler, weighted_totals
+    # 40个行组，每个行组的品类高度集中：按独立行计算的区间明显偏窄
+    groups, rows, size = 40, 500, 4
+    rng = np.random.default_rng(0)
+    population = [np.where(rng.random(rows) < 0.8, g % size, rng.integers(0, size, rows)) for g in range(groups)]
+    truth = np.bincount(np.concatenate(population), minlength=size)
+    covered, naive = [], []
+    for seed in range(200):
+        sampler = Sampler(0.1, seed=seed)
+        selected = sampler.row_groups('f.parquet', groups)
+        sampler.record_row_groups('f.parquet', selected, [rows] * len(selected))
+        codes = np.concatenate([population[g] for g in selected])
+        index, weights, clusters = sampler.sample(len(codes), 'f.parquet')
+        total, half = weighted_totals(codes[index], size, weights, clusters=clusters)
+        _, naive_half = weighted_totals(codes[index], size, weights)
+        covered.append(np.abs(total - truth) <= half)
+        naive.append(np.abs(total - truth) <= naive_half)
+    assert np.mean(covered) > 0.85
+    assert np.mean(naive) < 0.5
+
+def test_cohort_stage_skips_without_registration_date(tmp_path, capsys):
+    from conftest import make_frame
+    from main import STAGES, intermediate_outputs
+    from pipeline import run_stages, select_stages
+    df = make_frame(rows=200).drop(columns='registration_date')
+    results = run_stages(select_stages(STAGES, ['retention']), df, base_dir=tmp_path, workers=2)
+    assert results['cohort'] is None and 'cohort' not in intermediate_outputs(results)
+    assert "registration_date" in capsys.readouterr().out
+
+def test_plotting_stages_declare_columns(frame, tmp_path, monkeypatch):
+    import multiprocessing
+    from main import STAGES
+    from shared import DatasetHandle, as_frame
+    # 子进程只读取声明的列
+    assert all(stage.columns for stage in STAGES if stage.plotting)
+    with DatasetHandle.create(frame, directory=tmp_path) as handle:
+        assert list(as_frame(handle, ['hour']).columns) == ['hour']
+        monkeypatch.setattr(multiprocessing, 'parent_process', lambda: object())
+        with pytest.raises(ValueError):
+            as_frame(handle)
+
+def test_collect_files_skips_generated_files(dataset_files, tmp_path):
+    import shutil
+    from load_and_preprocess import collect_files
+    from main import main
+    from shared import DatasetHandle
+    # 输出目录位于数据目录内：输出、检查点与共享数据集文件不作为下一次运行的输入
+    data = tmp_path / 'data'
+    data.mkdir()
+    for file in dataset_files:
+        shutil.copy(file, data)
+    expected = sorted(collect_files([data]))
+    output = data / 'out'
+    assert main([str(data), '-o', str(output), '--only', 'province_counts', '--checkpoint',
+                 '--format', 'parquet,csv', '--export-intermediates'])
+    assert list((output / 'checkpoints').glob('*.arrow')) and list(output.glob('*.parquet'))
+    handle = DatasetHandle.create(pd.DataFrame({'x': [1]}), directory=data)
+    (data / 'spill-test').mkdir()
+    shutil.copy(expected[0], data / 'spill-test' / '0.parquet')
+    assert sorted(collect_files([data], exclude=[output])) == expected
+    # 未指定exclude时检查点目录、落盘目录与隐藏文件同样跳过
+    assert not any(f.name.startswith('.') or 'checkpoints' in f.parts or 'spill-test' in f.parts
+                   for f in collect_files([data]))
+    handle.release()
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet', 'arrow'])
+def test_write_table_round_trip(fmt, tmp_path):
+    from writers import write_table
+    frame = pd.DataFrame({
+        'user_name': ['张三', 'a,b', 'say "hi"', '多行\n文本'],
+        'income': [1.5, 2.0, np.nan, 4.25],
+        'frequency': [1, 2, 3, 4],
+        'is_active': [True, False, True, False],
+        'recency': pd.to_datetime(['2023-01-01 08:00', '2023-02-01 00:00', '2023-03-01 00:00', '2023-04-01 00:00']),
+    })
+    series = pd.Series([3.5, 1.0], index=pd.Index(['广东省', '北京市'], name='province'), name='sales')
+    path = write_table(frame, tmp_path / 'hv_users', fmt)
+    series_path = write_table(series, tmp_path / 'category_sales', fmt)
+    read = {'csv': lambda p: pd.read_csv(p, parse_dates=['recency']) if p == path else pd.read_csv(p),
+            'parquet': pd.read_parquet, 'arrow': pd.read_feather}[fmt]
+    # CSV读回的时间精度由pandas推断，只比较数值
+    pd.testing.assert_frame_equal(read(path), frame, check_dtype=fmt != 'csv')
+    pd.testing.assert_frame_equal(read(series_path), series.reset_index())
+
+def test_memory_governor_spill_keeps_tables(frame):
+    from memory import MemoryGovernor, memory_state
+    # 上限1字节：压缩后仍超限，全部落盘并以内存映射读回
+    governor = MemoryGovernor(1)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    original = [table.slice(start, 2000) for start in range(0, 6000, 2000)]
+    tables = list(original)
+    try:
+        governor.relieve(tables)
+        assert governor.spills == 3 and all(memory_state(table) == 'spilled' for table in tables)
+        for table, expected in zip(tables, original):
+            pd.testing.assert_frame_equal(table.to_pandas().astype(object), expected.to_pandas().astype(object))
+    finally:
+        governor.cleanup()
+
+def test_checkpoint_resume_skips_finished_files(dataset_files, tmp_path, monkeypatch):
+    import json
+    import os
+    import shutil
+    from pathlib import Path
+    import load_and_preprocess
+    from checkpoint import MANIFEST_NAME, Checkpoint
+    from load_and_preprocess import load_dataset
+    from quality import QualityStats
+    data = tmp_path / 'data'
+    data.mkdir()
+    files = [Path(shutil.copy(file, data)) for file in dataset_files]
+    directory = tmp_path / 'checkpoints'
+    quality = QualityStats()
+    expected = load_dataset(files, checkpoint=Checkpoint(directory), quality=quality)
+
+    scanned = []
+    scan_files = load_and_preprocess.scan_files
+    monkeypatch.setattr(load_and_preprocess, 'scan_files',
+                        lambda files, *args: scan_files(scanned.extend(files) or files, *args))
+    # 模拟中断：最后一个文件未写入manifest；另一个源文件在中断后被修改
+    manifest = json.loads((directory / MANIFEST_NAME).read_text(encoding='utf-8'))
+    del manifest[str(files[-1].resolve())]
+    (directory / MANIFEST_NAME).write_text(json.dumps(manifest), encoding='utf-8')
+    os.utime(files[0], ns=(0, 0))
+    resumed_quality = QualityStats()
+    actual = load_dataset(files, checkpoint=Checkpoint(directory, resume=True), quality=resumed_quality)
+    assert sorted(scanned) == sorted([files[0], files[-1]])
+    # 恢复的文件排在重新加载的文件之前，按行内容比较
+    key = ['id', 'timestamp', 'user_name']
+    pd.testing.assert_frame_equal(sort_frame(actual.astype(object).sort_values(key)[expected.columns]),
+                                  sort_frame(expected.astype(object).sort_values(key)))
+    assert resumed_quality.counts == quality.counts
+
+    # 检查点缺少本次需要的列时重新加载
+    scanned.clear()
+    for columns in (['province'], ['province', 'hour'], ['hour']):
+        load_dataset(files, columns=columns, checkpoint=Checkpoint(tmp_path / 'partial', columns=columns, resume=True))
+    assert len(scanned) == 2 * len(files)
+
+def test_prefetch_back_pressure_and_stop():
+    import threading
+    import time
+    from prefetch import prefetch
+    produced = []
+
+    def source():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    items = prefetch(source(), depth=3)
+    assert next(items) == 0
+    time.sleep(0.3)
+    # 队列满时读取线程阻塞：已消费1个 + 队列3个 + 等待入队1个
+    assert len(produced) <= 5
+    # 消费端提前退出：读取线程结束，不再继续读取
+    items.close()
+    assert not any(t.name == 'prefetch-reader' and t.is_alive() for t in threading.enumerate())
+    assert len(produced) <= 5
+
+    def failing():
+        yield 1
+        raise OSError("读取失败")
+
+    with pytest.raises(OSError):
+        list(prefetch(failing(), depth=2))
+
+def test_parallel_map_keeps_order_and_bounds_in_flight():
+    import time
+    from prefetch import parallel_map
+    pulled = []
+
+    def source():
+        for i in range(30):
+            pulled.append(i)
+            yield i
+
+    def work(i):
+        time.sleep(0.01 * (i % 3))  # 完成顺序与提交顺序不同
+        return i * i
+
+    results = []
+    for result in parallel_map(work, source(), workers=4, depth=6):
+        # 在途任务（已提交未输出）不超过depth个
+        assert len(pulled) - len(results) <= 6
+        results.append(result)
+    assert results == [i * i for i in range(30)]
+
+def test_select_stages_for_only():
+    from main import STAGES, main
+    from pipeline import required_columns, select_stages
+    # 自动包含依赖，保持注册顺序
+    names = [stage.name for stage in select_stages(STAGES, ['timeline', 'retention'])]
+    assert names == ['hourly_counts', 'timeline', 'cohort', 'retention']
+    assert required_columns(select_stages(STAGES, ['category'])) == ['avg_price', 'categories']
+    assert len(select_stages(STAGES, None)) == len(STAGES)
+    with pytest.raises(ValueError):
+        select_stages(STAGES, ['nope'])
+    assert main(['unused.csv', '--only', 'nope']) is False
+
+def test_run_stages_follows_dependencies():
+    import threading
+    from pipeline import Stage, run_stages
+    order = []
+    # 两个互不依赖的阶段须并发执行才能同时通过barrier
+    barrier = threading.Barrier(2, timeout=10)
+
+    def independent(name):
+        def run(df, results, base_dir):
+            barrier.wait()
+            order.append(name)
+            return len(df)
+        return run
+
+    def combine(df, results, base_dir):
+        order.append('combine')
+        return results['left'] + results['right']
+
+    stages = [Stage('combine', combine, requires=['left', 'right']),
+              Stage('left', independent('left')), Stage('right', independent('right'))]
+    results = run_stages(stages, pd.DataFrame({'x': range(3)}), workers=2)
+    assert results['combine'] == 6 and order[-1] == 'combine'
+    with pytest.raises(RuntimeError):
+        run_stages([Stage('orphan', combine, requires=['missing'])], pd.DataFrame(), workers=1)
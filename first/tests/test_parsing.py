@@ -0,0 +1,107 @@
+"""
+解析规则：时间戳标准化、购买记录解析等逐值规则的边界情况
+"""
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+@pytest.mark.parametrize('values', [
+    # 格式混杂（带偏移与不带偏移），走pandas回退路径
+    ['2023-06-01T12:00:00', '2023-06-01T12:00:00+00:00', '2023-03-12T02:30:00', '2023-11-05T01:30:00', 'bad', None],
+    # 全部不带偏移但含夏令时切换时刻，Arrow路径失败后回退
+    ['2023-06-01T12:00:00', '2023-06-01T12:00:00', '2023-03-12T02:30:00', '2023-11-05T01:30:00', None, None],
+])
+def test_normalize_timestamp_naive_uses_timezone(values):
+    from load_and_preprocess import normalize_timestamp
+    ts, hour, _ = normalize_timestamp(pa.array(values), tz='America/New_York')
+    result = ts.to_pylist()
+    # 不带偏移的时间视为纽约本地时间，原样保留；带UTC偏移的换算为本地时间
+    assert result[0] == datetime(2023, 6, 1, 12)
+    assert result[1] == datetime(2023, 6, 1, 8 if values[1].endswith('+00:00') else 12)
+    # 不存在（春季拨快）与重复（秋季拨慢）的本地时刻无法确定，记为空
+    assert result[2] is None and result[3] is None
+    assert result[4:] == [None, None]
+    assert hour.to_pylist()[:2] == [t.hour for t in result[:2]]
+
+def test_normalize_timestamp_naive_timestamp_column():
+    from load_and_preprocess import normalize_timestamp
+    ts, _, _ = normalize_timestamp(pa.array(pd.to_datetime(['2023-03-12T02:30:00', '2023-06-01T12:00:00'])),
+                                   tz='America/New_York')
+    assert ts.to_pylist() == [None, datetime(2023, 6, 1, 12)]
+
+PURCHASE_RECORDS = [
+    '{"avg_price": 120, "categories": "电子产品", "items": [{"id": 1}, {"id": 2}]}',
+    "{'avg_price': 99.5, 'category': '服装', 'items': [1, 2, 3]}",
+    '{"items": [], "average_price": -3, "categories": "食品"}',
+    # items内对象的键与顶层键同名：取顶层的值
+    '{"items": [{"category": "书"}], "categories": "电子", "avg_price": 1}',
+    # 指数形式的数字
+    '{"avg_price": 1.5e3, "categories": "家居", "items": [1]}',
+    # 值中含引号：替换单引号后不是合法JSON
+    '{"avg_price": 1, \'categories\': "it\'s", "items": [1]}',
+    # 嵌套数组
+    '{"avg_price": 2, "categories": "玩具", "items": [[1, 2], [3]]}',
+    # 值中含逗号与括号
+    '{"avg_price": 2, "categories": "a,b", "items": ["x,y", "z"]}',
+    '{"avg_price": 2, "categories": "a[b]", "items": [{"name": "{x}"}]}',
+    # 转义字符
+    '{"avg_price": 2, "categories": "a\\\\"b", "items": [1]}',
+    # 重复键、别名同时出现
+    '{"avg_price": 1, "avg_price": 5, "categories": "x", "items": [1]}',
+    '{"average_price": 1, "avg_price": 5, "categories": "x", "items": [1]}',
+    # 缺少字段、类型不符
+    '{"categories": "x", "items": [1]}',
+    '{"avg_price": "12", "categories": 3, "items": [1, 2]}',
+    '{"avg_price": 1, "categories": "x", "items": null}',
+    '{"avg_price": 1, "categories": "x", "items": [1], "extra": {"k": [1]}}',
+    # 非法JSON（正则看似能匹配）
+    '{"avg_price": 1, "categories": "x", "items": [1] ',
+    '{"avg_price": 1 "categories": "x", "items": [1]}',
+    '{"avg_price": 01, "categories": "x", "items": [1]}',
+    '{"avg_price": 1., "categories": "x", "items": [1,]}',
+    'not json',
+    '',
+]
+
+def expected_purchase(record):
+    from load_and_preprocess import PURCHASE_DEFAULTS, PURCHASE_ERRORS, parse_purchase_record
+    try:
+        parsed = parse_purchase_record(record)
+        return (float(parsed['avg_price']), str(parsed['categories']), parsed['items_count']), 0
+    except PURCHASE_ERRORS:
+        return tuple(PURCHASE_DEFAULTS.values()), 1
+
+def check_purchase_column(records):
+    from load_and_preprocess import parse_purchase_column
+    from quality import QualityStats
+    stats = QualityStats()
+    avg_price, categories, items_count = parse_purchase_column(pa.array(records, pa.string()), stats)
+    expected = [expected_purchase(r) for r in records]
+    actual = list(zip(avg_price.to_pylist(), categories.to_pylist(), items_count.to_pylist()))
+    for record, (price, category, count), (want, _) in zip(records, actual, expected):
+        assert (price, category, count) == (pytest.approx(want[0]), *want[1:]), record
+    assert stats.counts['purchase_parse_failures'] == sum(failed for _, failed in expected)
+
+@pytest.mark.parametrize('record', PURCHASE_RECORDS)
+def test_parse_purchase_column_matches_json(record):
+    check_purchase_column([record])
+
+def test_parse_purchase_column_random_records():
+    import json
+    import numpy as np
+    rng = np.random.default_rng(4)
+    records = []
+    for _ in range(500):
+        data = {'avg_price': float(rng.normal(100, 50)), 'categories': str(rng.choice(['a', 'b,c', "d'e", '书'])),
+                'items': [{'id': int(i)} for i in range(rng.integers(0, 4))]}
+        keys = list(data)
+        rng.shuffle(keys)
+        text = json.dumps({k: data[k] for k in keys}, ensure_ascii=False)
+        # 随机截断或删掉一个字符，制造非法记录
+        if rng.random() < 0.2:
+            cut = int(rng.integers(len(text)))
+            text = text[:cut] + text[cut + 1:]
+        records.append(text)
+    check_purchase_column(records)
@@ -0,0 +1,117 @@
+"""
+吞吐量回归：pytest-benchmark计时，换算为行/秒，再除以同一会话中参考内核的行/秒，
+得到与机器快慢无关的相对吞吐量，与tests/baselines.json中的基线比较
+
+- 默认只记录（报告的extra_info中有rows_per_second与relative），不做比较；
+  PERF_CHECK=1时相对吞吐量低于基线 × (1 - PERF_THRESHOLD)则失败，PERF_THRESHOLD默认0.25
+- UPDATE_BASELINES=1时以本次结果覆盖基线文件
+- 没有安装pytest-benchmark时整个文件跳过；--benchmark-disable时只运行一次、不做比较
+
+python -m pytest tests/test_performance.py [--benchmark-only]
+PERF_CHECK=1 python -m pytest tests/test_performance.py
+UPDATE_BASELINES=1 python -m pytest tests/test_performance.py
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pytest
+
+from conftest import ADDRESSES, make_frame
+
+pytest.importorskip('pytest_benchmark')
+
+BASELINES = Path(__file__).with_name('baselines.json')
+THRESHOLD = float(os.environ.get('PERF_THRESHOLD', 0.25))
+CHECK = os.environ.get('PERF_CHECK') == '1'
+UPDATE = os.environ.get('UPDATE_BASELINES') == '1'
+ROWS = 50000
+
+@pytest.fixture(scope='module')
+def baselines():
+    data = json.loads(BASELINES.read_text(encoding='utf-8')) if BASELINES.exists() else {}
+    yield data
+    if UPDATE:
+        BASELINES.write_text(json.dumps(data, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+
+def reference_kernel(values, strings):
+    """参考内核：数值排序 + 字符串哈希，代表本机的计算与内存速度"""
+    np.sort(values)
+    pc.dictionary_encode(strings)
+
+@pytest.fixture(scope='module')
+def reference_rate():
+    """参考内核的行/秒（取多轮最短耗时）"""
+    rng = np.random.default_rng(0)
+    values = rng.random(ROWS)
+    strings = pa.array([f'{ADDRESSES[i % len(ADDRESSES)]}某路{i % 5000}号' for i in range(ROWS)])
+    reference_kernel(values, strings)
+    timings = []
+    for _ in range(20):
+        start_time = time.perf_counter()
+        reference_kernel(values, strings)
+        timings.append(time.perf_counter() - start_time)
+    return ROWS / min(timings)
+
+@pytest.fixture(scope='module')
+def perf_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('perf')
+    frame = make_frame(ROWS, seed=11)
+    frame.to_parquet(directory / 'data.parquet', row_group_size=ROWS // 5)
+    frame.to_csv(directory / 'data.csv', index=False)
+    return directory
+
+@pytest.fixture(scope='module')
+def perf_frame(perf_dir):
+    from load_and_preprocess import load_dataset
+    return load_dataset([perf_dir / 'data.parquet'])
+
+def check_throughput(benchmark, baselines, reference_rate, name, rows):
+    """以最短耗时计算行/秒与相对吞吐量，记录到报告的extra_info中；PERF_CHECK=1时与基线比较"""
+    if benchmark.disabled:
+        return
+    rate = rows / benchmark.stats.stats.min
+    relative = rate / reference_rate
+    benchmark.extra_info['rows_per_second'] = round(rate)
+    benchmark.extra_info['relative'] = round(relative, 4)
+    if UPDATE:
+        baselines[name] = round(relative, 4)
+        return
+    if not CHECK:
+        return
+    if name not in baselines:
+        pytest.skip(f"{name}: 没有基线（UPDATE_BASELINES=1生成），本次相对吞吐量 {relative:.4f}")
+    floor = baselines[name] * (1 - THRESHOLD)
+    assert relative >= floor, \
+        f"{name}: 相对吞吐量 {relative:.4f}（{rate:,.0f} 行/秒），低于基线 {baselines[name]} 的 {1 - THRESHOLD:.0%}"
+
+@pytest.mark.parametrize('name', ['data.parquet', 'data.csv'])
+def test_load_throughput(benchmark, baselines, reference_rate, perf_dir, name):
+    from load_and_preprocess import load_dataset
+    df = benchmark.pedantic(load_dataset, args=([perf_dir / name],), rounds=3, warmup_rounds=1)
+    assert len(df) == ROWS
+    check_throughput(benchmark, baselines, reference_rate, f"load_{name.split('.', 1)[1]}", ROWS)
+
+def test_build_user_profiles_throughput(benchmark, baselines, reference_rate, perf_frame):
+    from user_analysis import build_user_profiles
+    profiles = benchmark.pedantic(build_user_profiles, args=(perf_frame,), rounds=10, warmup_rounds=2)
+    assert profiles['user_name'].nunique() == len(profiles)
+    check_throughput(benchmark, baselines, reference_rate, 'build_user_profiles', ROWS)
+
+def test_identify_high_value_users_throughput(benchmark, baselines, reference_rate, perf_frame):
+    from user_analysis import build_user_profiles, identify_high_value_users
+    profiles = build_user_profiles(perf_frame)
+    benchmark.pedantic(identify_high_value_users, args=(profiles, perf_frame), rounds=10, warmup_rounds=2)
+    check_throughput(benchmark, baselines, reference_rate, 'identify_high_value_users', ROWS)
+
+def test_resolve_province_throughput(benchmark, baselines, reference_rate):
+    from load_and_preprocess import resolve_province
+    # 不使用缓存：每轮都完整匹配，计时不受缓存命中影响
+    addresses = pa.array([f'{ADDRESSES[i % len(ADDRESSES)]}某路{i}号' for i in range(ROWS)])
+    result = benchmark.pedantic(resolve_province, args=(addresses,), rounds=10, warmup_rounds=2)
+    assert len(result) == ROWS
+    check_throughput(benchmark, baselines, reference_rate, 'resolve_province', ROWS)
@@ -0,0 +1,84 @@
+"""
+分析服务：在0端口启动服务，通过urllib检查各接口、增量刷新与参数错误
+"""
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pandas as pd
+import pytest
+
+from conftest import ROWS, make_frame
+
+@pytest.fixture
+def service(tmp_path):
+    """数据目录中先放一个文件，返回(数据目录, store, 请求函数)"""
+    from server import DatasetStore, make_server
+    make_frame(seed=0).to_parquet(tmp_path / 'part0.parquet')
+    store = DatasetStore([tmp_path], workers=1)
+    store.refresh()
+    server = make_server(store, port=0)
+    host, port = server.server_address[:2]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path):
+        """返回(状态码, JSON)"""
+        try:
+            with urlopen(f"http://{host}:{port}{path}", timeout=30) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    yield tmp_path, store, get
+    server.shutdown()
+    server.server_close()
+
+def test_endpoints(service):
+    _, store, get = service
+    df, _ = store.snapshot()
+    status, health = get('/health')
+    assert status == 200 and health['rows'] == ROWS and health['files'] == 1 and health['version'] == 1
+    status, province = get('/province')
+    counts = df['province'].value_counts()
+    assert status == 200
+    assert {r['province']: r['count'] for r in province['province']} == \
+        {name: count for name, count in counts.items() if count > 0 and name != 'unknown'}
+    status, category = get('/category?top=3')
+    assert status == 200 and len(category['category']) == 3
+    status, hourly = get('/hourly')
+    assert status == 200 and sum(r['count'] for r in hourly['hourly']) == df['hour'].notna().sum()
+    status, rfm = get('/rfm?limit=5')
+    assert status == 200 and len(rfm['rfm']) == 5 and rfm['users'] == df['user_name'].nunique()
+    assert [r['monetary'] for r in rfm['rfm']] == sorted((r['monetary'] for r in rfm['rfm']), reverse=True)
+    status, hv = get('/hv?limit=2')
+    assert status == 200 and len(hv['hv']) == min(2, hv['count'])
+
+def test_bad_requests(service):
+    _, _, get = service
+    status, payload = get('/rfm?limit=abc')
+    assert status == 400 and 'error' in payload
+    status, payload = get('/nope')
+    assert status == 404 and '/health' in payload['routes']
+
+def test_refresh_appends_new_files(service):
+    directory, store, get = service
+    status, payload = get('/refresh')
+    assert status == 200 and payload['updated'] is False
+    _, before = get('/province')
+
+    make_frame(seed=1).to_parquet(directory / 'part1.parquet')
+    status, payload = get('/refresh')
+    assert status == 200 and payload['updated'] is True
+    assert payload['rows'] == 2 * ROWS and payload['files'] == 2 and payload['version'] == 2
+    # 增量追加后分类列仍为Categorical，聚合结果随版本更新
+    df, _ = store.snapshot()
+    assert isinstance(df['province'].dtype, pd.CategoricalDtype)
+    assert isinstance(df['categories'].dtype, pd.CategoricalDtype)
+    _, after = get('/province')
+    assert sum(r['count'] for r in after['province']) > sum(r['count'] for r in before['province'])
+    from load_and_preprocess import load_dataset
+    full = load_dataset(sorted(directory.glob('*.parquet')))
+    pd.testing.assert_series_equal(df['province'].value_counts().sort_index(),
+                                   full['province'].value_counts().sort_index())
@@ -1,4 +1,7 @@
+import numpy as np
 import pandas as pd
+from kernels import quantile_bins
+from shared import as_frame
 
 def build_user_profiles_old(df):
     """构建用户画像标签体系"""
@@ -39,23 +42,31 @@ def build_user_profiles_old(df):
     return rfm
 
 def build_user_profiles(df):
-    """RFM模型"""
-    # 首先确保将timestamp列转换为datetime类型
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    # 计算Monetary（总消费金额）
-    df['monetary'] = df['avg_price'] * df['items_count']
+    """RFM模型，df可为DatasetHandle（只读取所需列）"""
+    df = as_frame(df, ['user_name', 'timestamp', 'avg_price', 'items_count'])
+    # timestamp已在加载阶段解析，仅在未经loader处理时兜底转换
+    timestamp = df['timestamp']
+    if not pd.api.types.is_datetime64_any_dtype(timestamp):
+        timestamp = pd.to_datetime(timestamp, format='ISO8601')
+    # 计算Monetary（总消费金额）；不修改传入的df，便于其他分析阶段并发读取
+    data = pd.DataFrame({
+        'user_name': df['user_name'],
+        'timestamp': timestamp,
+        'monetary': df['avg_price'] * df['items_count'],
+    })
     
-    snapshot_date = df['timestamp'].max() + pd.Timedelta(days=1)
+    snapshot_date = timestamp.max() + pd.Timedelta(days=1)
     
-    rfm = df.groupby('user_name').agg({
-        'timestamp': lambda x: (snapshot_date - x.max()).days,  # Recency
-        'purchase_history': 'count',  # Frequency（交易次数）
-        'monetary': 'sum'            # Monetary
-    }).rename(columns={
-        'timestamp': 'recency',
-        'purchase_history': 'frequency',
-        'monetary': 'monetary'
-    }).reset_index()
+    grouped = data.groupby('user_name')
+    rfm = grouped.agg(
+        recency=('timestamp', 'max'),  # 最近一次活跃时间
+        monetary=('monetary', 'sum'),  # Monetary
+    )
+    # Frequency（交易次数）：按用户计行数，无需读取purchase_history
+    rfm.insert(1, 'frequency', grouped.size())
+    rfm = rfm.reset_index()
+    # Recency：向量化计算距快照日的天数
+    rfm['recency'] = (snapshot_date - rfm['recency']).dt.days
     
     # 动态分箱函数
     def dynamic_binning(series, q=5, ascending=True):
@@ -68,11 +79,12 @@ def build_user_profiles(df):
             # 确保分箱数不超过唯一值数量
             valid_q = min(q, series.nunique())
             
-            # 使用百分比排名代替原始值
-            ranked = series.rank(pct=True, method='first')
-            
-            # 生成分箱标签（确保标签数比分箱边界数少1）
-            bins = pd.qcut(ranked, q=valid_q, labels=False, duplicates='drop') + 1
+            # 百分比排名 + 等分位数分箱（kernels单遍完成，结果与rank+qcut一致）
+            if series.isna().any():
+                ranked = series.rank(pct=True, method='first')
+                bins = pd.qcut(ranked, q=valid_q, labels=False, duplicates='drop') + 1
+            else:
+                bins = pd.Series(quantile_bins(series.to_numpy(), valid_q), index=series.index)
             
             # 处理反向分箱
             return (valid_q - bins + 1) if not ascending else bins
@@ -89,10 +101,10 @@ def build_user_profiles(df):
 
 def identify_high_value_users(rfm_df, df, method='composite'):
     """多维度高价值用户识别"""
-    # 复合评分模型
-    rfm_df['score'] = (rfm_df['R']*0.2 + 
-                      rfm_df['F']*0.2 + 
-                      rfm_df['M']*0.6)
+    # 复合评分模型（assign返回副本，不修改调用方的rfm表）
+    rfm_df = rfm_df.assign(score=rfm_df['R']*0.2 +
+                                 rfm_df['F']*0.2 +
+                                 rfm_df['M']*0.6)
     
     # 业务规则过滤
     # 判断df中是否包含'credit_score'列
@@ -122,6 +134,63 @@ def identify_high_value_users(rfm_df, df, method='composite'):
     
     return high_value.sort_values('score', ascending=False)
 
+def month_codes(values):
+    """日期/时间 -> 月份编码（距1970-01的月数）与有效掩码"""
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values, errors='coerce')
+    valid = values.notna().to_numpy()
+    codes = values.to_numpy().astype('datetime64[M]').astype(np.int64)
+    return codes, valid
+
+def cohort_retention(df, max_periods=None):
+    """注册月份 × 活跃月份的留存矩阵
+
+    每个用户按最早注册月份归入cohort；第k列为注册后第k个月有活跃记录的用户占cohort人数的比例，
+    不在活跃数据时间范围内（无法观察）的月份为NaN。
+    返回DataFrame：索引为cohort月份（YYYY-MM），users列为cohort人数，其余列为k = 0, 1, ...
+    """
+    users, _ = pd.factorize(df['user_name'])
+    registration, valid_registration = month_codes(df['registration_date'])
+    activity, valid_activity = month_codes(df['timestamp'])
+    has_user = users >= 0
+    num_users = users.max() + 1 if has_user.any() else 0
+
+    # 每个用户的cohort：最早注册月份（无注册日期的用户为哨兵值）
+    missing = np.iinfo(np.int64).max
+    cohort = np.full(num_users, missing, dtype=np.int64)
+    rows = has_user & valid_registration
+    np.minimum.at(cohort, users[rows], registration[rows])
+    known = cohort != missing
+    if not known.any():
+        return pd.DataFrame(columns=['users'])
+    first_month = cohort[known].min()
+    num_cohorts = cohort[known].max() - first_month + 1
+    sizes = np.bincount(cohort[known] - first_month, minlength=num_cohorts)
+
+    # 活跃月份相对注册月份的偏移，同一用户同一偏移只计一次
+    rows = has_user & valid_activity
+    rows[rows] = known[users[rows]]
+    offset = activity[rows] - cohort[users[rows]]
+    keep = offset >= 0
+    if max_periods is not None:
+        keep &= offset < max_periods
+    periods = int(offset[keep].max()) + 1 if keep.any() else 1
+    pairs = np.unique(users[rows][keep] * periods + offset[keep])
+    cells = (cohort[pairs // periods] - first_month) * periods + pairs % periods
+    active = np.bincount(cells, minlength=num_cohorts * periods).reshape(num_cohorts, periods)
+
+    rates = active / np.maximum(sizes, 1)[:, None]
+    # 不在活跃数据时间范围内的月份无法观察，记为缺失
+    span = activity[valid_activity] if valid_activity.any() else np.array([first_month])
+    months_since_first = np.arange(num_cohorts)[:, None] + np.arange(periods)
+    observed = (months_since_first >= span.min() - first_month) & (months_since_first <= span.max() - first_month)
+    rates[~observed] = np.nan
+    months = np.arange(first_month, first_month + num_cohorts).astype('datetime64[M]')
+    retention = pd.DataFrame(rates,
+                             index=pd.Index(months.astype(str), name='cohort'))
+    retention.insert(0, 'users', sizes)
+    return retention[sizes > 0]
+
 # 检查不可哈希类型
 # 例如：列表，字典，集合等
 def check_unhashable(df, columns):
@@ -1,17 +1,51 @@
-from pyecharts.charts import Map, Bar, Line
+from pyecharts.charts import Map, Bar, Line, Page, Timeline, HeatMap
 from pyecharts import options as opts
-import matplotlib.pyplot as plt
-import matplotlib.patheffects as pe
 import pandas as pd
 import numpy as np
-from scipy.stats import gaussian_kde
-import warnings
-import seaborn as sns
-from scipy.ndimage import gaussian_filter1d  # 添加高斯滤波依赖
-
-def plot_province_distribution(df, base_dir=None):
-    """地域分布热力图"""
-    province_count = df['province'].value_counts()
+# matplotlib/seaborn导入较慢，只在绘制对应图表时导入
+from geo import geo_breakdown, map_name
+from kernels import HOURS, hour_counts, fixed_histogram
+# 抽样数据（带sample_weight列）的计数按权重放大，图表标注抽样率与置信区间
+from sampling import sample_weights, sample_clusters, sample_note, weighted_totals
+# 数据可以是DataFrame或DatasetHandle（子进程中按需读取内存映射的共享数据集）
+from shared import as_frame
+
+def count_by(series, weights=None):
+    """按取值计数（降序）：Categorical直接对整数编码做bincount；提供weights时为加权计数（取整）"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        valid = codes >= 0
+        counts = np.bincount(codes[valid], weights=None if weights is None else weights[valid],
+                             minlength=len(series.cat.categories))
+        if weights is not None:
+            counts = np.rint(counts).astype(np.int64)
+        return pd.Series(counts, index=series.cat.categories).sort_values(ascending=False, kind='stable')
+    if weights is not None:
+        counts = pd.Series(weights, index=series.index).groupby(series).sum()
+        return np.rint(counts).astype(np.int64).sort_values(ascending=False, kind='stable')
+    return series.value_counts()
+
+def sum_by(keys, values):
+    """按keys分组求和：Categorical直接对整数编码做加权bincount"""
+    if isinstance(keys.dtype, pd.CategoricalDtype):
+        codes = keys.cat.codes.to_numpy()
+        valid = codes >= 0
+        sums = np.bincount(codes[valid], weights=values.to_numpy(dtype=float)[valid],
+                           minlength=len(keys.cat.categories))
+        return pd.Series(sums, index=keys.cat.categories)
+    return values.groupby(keys).sum()
+
+def plot_province_distribution(df, base_dir=None, province_count=None):
+    """地域分布热力图，province_count为预先聚合的各省记录数；df可为DatasetHandle"""
+    df = as_frame(df, ['province'])
+    weights = sample_weights(df)
+    if province_count is None:
+        province_count = count_by(df['province'], weights)
+    subtitle = "数据来源：乐学数据分析课程"
+    if weights is not None:
+        total, half = weighted_totals(np.zeros(len(weights), dtype=np.int64), 1, weights,
+                                      clusters=sample_clusters(df))
+        subtitle = f"{sample_note(df)}\n总记录数约{total[0]:,.0f}（95%置信区间±{half[0]:,.0f}）"
     # 将省份名称和数量转换为字典
     province_count = list(zip(province_count.index, province_count.values.tolist()))
     province_count = [(province, count) for province, count in province_count if (count > 0 and province != 'unknown')]
@@ -31,7 +65,7 @@ def plot_province_distribution(df, base_dir=None):
     m.set_global_opts(
         title_opts=opts.TitleOpts(
             title="用户地域分布",
-            subtitle="数据来源：乐学数据分析课程",
+            subtitle=subtitle,
         ),
         visualmap_opts=opts.VisualMapOpts(
             min_=min_count,  # 自动获取最小值
@@ -59,7 +93,136 @@ def plot_province_distribution(df, base_dir=None):
     else:
         m.render(path="province_distribution.html")
 
+# 省份看板指标：列名 -> 显示名称
+DASHBOARD_METRICS = {
+    'user_count': '用户数量',
+    'total_income': '总收入',
+    'avg_credit': '平均信用分',
+    'sales': '销售额',
+}
+
+def province_aggregates(df):
+    """各省聚合指标表：记录数、总收入、平均信用分、销售额（按省份编码bincount，缺列的指标跳过）"""
+    provinces = df['province']
+    if not isinstance(provinces.dtype, pd.CategoricalDtype):
+        provinces = provinces.astype('category')
+    codes = provinces.cat.codes.to_numpy()
+    valid = codes >= 0
+    codes, size = codes[valid], len(provinces.cat.categories)
+    # 抽样数据按权重放大
+    weights = sample_weights(df)
+    weights = weights[valid] if weights is not None else 1.0
+
+    def weighted(values):
+        return np.bincount(codes, weights=values.to_numpy(dtype=float)[valid] * weights, minlength=size)
+
+    user_count = np.bincount(codes, minlength=size) if np.isscalar(weights) \
+        else np.rint(np.bincount(codes, weights=weights, minlength=size)).astype(np.int64)
+    result = {'province': provinces.cat.categories.astype(str), 'user_count': user_count}
+    if 'income' in df.columns:
+        result['total_income'] = weighted(df['income'].fillna(0))
+    if 'credit_score' in df.columns:
+        credit = df['credit_score']
+        scored = weighted(credit.notna().astype(float))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['avg_credit'] = weighted(credit.fillna(0)) / scored
+    if 'avg_price' in df.columns and 'items_count' in df.columns:
+        result['sales'] = weighted((df['avg_price'] * df['items_count']).fillna(0))
+    return pd.DataFrame(result).sort_values('user_count', ascending=False, ignore_index=True)
+
+def plot_province_dashboard(province_data, base_dir=None, metrics=None, assets_host=None,
+                            title="用户地域分布看板", note=''):
+    """多指标省份地图：所有指标的数据嵌入同一个页面，由时间轴在浏览器端切换
+
+    province_data: 预先聚合的省份指标表（province列 + 各指标列，见province_aggregates）
+    assets_host: ECharts资源地址（如本地目录"assets/"），为空时使用pyecharts默认地址
+    note: 副标题附加说明（如抽样说明）
+    """
+    data = province_data[province_data['province'] != 'unknown']
+    if 'user_count' in data.columns:
+        data = data[data['user_count'] > 0]
+    metrics = [m for m in (metrics or DASHBOARD_METRICS) if m in data.columns]
+    provinces = data['province'].astype(str).tolist()
+
+    timeline = Timeline(init_opts=opts.InitOpts(width="1200px", height="800px", page_title=title,
+                                                js_host=assets_host or ""))
+    for metric in metrics:
+        label = DASHBOARD_METRICS.get(metric, metric)
+        values = data[metric].round(2)
+        m = Map()
+        m.add(label, list(zip(provinces, values.tolist())), "china", is_map_symbol_show=False)
+        m.set_global_opts(
+            title_opts=opts.TitleOpts(title=title, subtitle=f"指标：{label}" + (f"\n{note}" if note else "")),
+            visualmap_opts=opts.VisualMapOpts(
+                min_=float(values.min()),
+                max_=float(values.max()),
+                is_piecewise=False,
+                range_color=["#FFE4E1", "#FF6347"],
+                pos_left="10%",
+                pos_bottom="20%"
+            ),
+            tooltip_opts=opts.TooltipOpts(
+                trigger="item",
+                formatter=f"{{b}}<br/>{label}：{{c}}"
+            )
+        )
+        m.set_series_opts(itemstyle_opts={"borderColor": "#fff", "borderWidth": 0.5})
+        timeline.add(m, label)
+    timeline.add_schema(is_auto_play=False, is_loop_play=False, pos_left="20%", pos_right="20%")
+
+    if base_dir:
+        timeline.render(path=f"{base_dir}/province_dashboard.html")
+    else:
+        timeline.render(path="province_dashboard.html")
+
+def plot_city_distribution(df, base_dir=None, top_n=5, province_count=None):
+    """城市级下钻热力图：用户最多的top_n个省份各一张地图（直辖市下钻到区县）"""
+    if province_count is None:
+        province_count = count_by(df['province'], sample_weights(df))
+    note = sample_note(df)
+    provinces = [p for p in province_count.index if p != 'unknown' and province_count[p] > 0][:top_n]
+    
+    page = Page(page_title="城市分布下钻")
+    for province in provinces:
+        # 直辖市的地图单元为区县，其余省份为地级市
+        level = 'area' if map_name(province) in ('北京', '天津', '上海', '重庆') else 'city'
+        detail = geo_breakdown(df, level=level, province=province)
+        detail = detail[detail[level] != 'unknown']
+        if detail.empty:
+            continue
+        data_pair = list(zip(detail[level].astype(str), detail['count'].tolist()))
+        
+        m = Map()
+        m.add("用户分布", data_pair, map_name(province))
+        m.set_global_opts(
+            title_opts=opts.TitleOpts(
+                title=f"{province}用户分布",
+                subtitle=f"共{province_count[province]:,}条记录，已识别{detail['count'].sum():,}条"
+                         + (f"\n{note}" if note else ""),
+            ),
+            visualmap_opts=opts.VisualMapOpts(
+                min_=int(detail['count'].min()),
+                max_=int(detail['count'].max()),
+                is_piecewise=False,
+                range_color=["#FFE4E1", "#FF6347"],
+                pos_left="10%",
+                pos_bottom="20%"
+            ),
+            tooltip_opts=opts.TooltipOpts(
+                trigger="item",
+                formatter="{b}<br/>用户数量：{c}"
+            )
+        )
+        page.add(m)
+    
+    if base_dir:
+        page.render(path=f"{base_dir}/city_distribution.html")
+    else:
+        page.render(path="city_distribution.html")
+
 def plot_price_distribution(df, base_dir=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 # 配色方案设置
     COLORS = {
         'hist': "#000066",    # 深蓝色柱形
@@ -86,9 +249,15 @@ def plot_price_distribution(df, base_dir=None):
     # 分箱与绘图
     bins = np.linspace(prices.min(), prices.quantile(0.95), bin_width)
     
+    # 等宽分箱计数由kernels单遍完成，再换算为概率密度（与density=True一致）；抽样数据按权重计数
+    weights = sample_weights(df)
+    if weights is None:
+        counts = fixed_histogram(prices.to_numpy(), bins)
+    else:
+        counts = np.histogram(prices.to_numpy(), bins=bins, weights=weights[df['avg_price'].notna().to_numpy()])[0]
+    density = counts / (counts.sum() * np.diff(bins))
     # 使用对比色方案
-    plt.hist(prices, bins=bins, 
-            density=True,    # 启用密度模式
+    plt.hist(bins[:-1], bins=bins, weights=density,
             edgecolor='black',
             color=COLORS['hist'], 
             alpha=0.7)
@@ -116,7 +285,8 @@ def plot_price_distribution(df, base_dir=None):
                 bbox=dict(boxstyle='round', alpha=0.9, facecolor='white'))
     
     # 图表美化
-    plt.title('客单价分布核心趋势', color=COLORS['text'], pad=20, fontsize=16)
+    note = sample_note(df)
+    plt.title('客单价分布核心趋势' + (f"\n{note}" if note else ''), color=COLORS['text'], pad=20, fontsize=16)
     plt.xlabel('价格区间（元）', color=COLORS['text'], fontsize=12)
     plt.ylabel('概率密度', color=COLORS['text'], fontsize=12)
     
@@ -140,7 +310,23 @@ def plot_price_distribution(df, base_dir=None):
     plt.close()
 
 # ===== 用户活跃时段分析（增强对比度版） =====
-def plot_activity_timeline(df, base_dir=None):
+def hour_column(df):
+    """小时列：优先使用加载阶段预计算的hour列，避免重复解析时间戳"""
+    return df['hour'] if 'hour' in df.columns else pd.to_datetime(df['timestamp']).dt.hour
+
+def hourly_counts(df):
+    """各小时活跃记录数（抽样数据按权重放大）"""
+    weights = sample_weights(df)
+    counts = hour_counts(hour_column(df).to_numpy(), weights)
+    if weights is not None:
+        counts = np.rint(counts).astype(np.int64)
+    counts = pd.Series(counts, index=pd.RangeIndex(HOURS, name='hour'), name='count')
+    # 只保留出现过的小时（与value_counts一致）
+    return counts[counts > 0]
+
+def plot_activity_timeline(df, base_dir=None, hourly_count=None):
+    import matplotlib.pyplot as plt
+    import matplotlib.patheffects as pe
     # 专业配色方案
     COLORS = {
         'fill': '#2ecc71',      # 填充主色
@@ -156,8 +342,8 @@ def plot_activity_timeline(df, base_dir=None):
     ax = plt.gca()
 
     # 数据处理
-    time_data = pd.to_datetime(df['timestamp']).dt.floor('h').dt.hour
-    hourly_count = time_data.value_counts().sort_index()
+    if hourly_count is None:
+        hourly_count = hourly_counts(df)
 
     # 动态Y轴范围调整（保留10%头部空间）
     y_min, y_max = hourly_count.min(), hourly_count.max()
@@ -185,6 +371,17 @@ def plot_activity_timeline(df, base_dir=None):
            color=COLORS['line'], lw=4, 
            marker='o', markersize=10, markerfacecolor='white',
            zorder=3, path_effects=[pe.Stroke(linewidth=6, foreground='#ffffff'), pe.Normal()])
+    # 抽样数据：各小时估计值的95%置信区间
+    weights = sample_weights(df)
+    if weights is not None:
+        hours = hour_column(df).fillna(-1).to_numpy().astype(np.int64)
+        _, half = weighted_totals(hours, HOURS, weights, clusters=sample_clusters(df))
+        ax.errorbar(hourly_count.index, hourly_count, yerr=half[hourly_count.index],
+                    fmt='none', ecolor=COLORS['peak'], elinewidth=1.5, capsize=4, zorder=4,
+                    label='95%置信区间')
+        # 纵轴范围包含置信区间
+        low, high = (hourly_count - half[hourly_count.index]).min(), (hourly_count + half[hourly_count.index]).max()
+        ax.set_ylim(min(low, y_min - y_padding), max(high, y_max + y_padding))
 
     # 3. 对比度刻度系统
     # ax.yaxis.set_major_locator(plt.MaxNLocator(10))  # 增加主刻度密度
@@ -209,7 +406,8 @@ def plot_activity_timeline(df, base_dir=None):
     ax.axvspan(18, 21, color=COLORS['night_fill'], alpha=0.15, label='晚间高峰')
     
     # 专业级标签系统
-    ax.set_title('用户活跃时段分布热力分析', fontsize=16, pad=20, color=COLORS['text'])
+    note = sample_note(df)
+    ax.set_title('用户活跃时段分布热力分析' + (f"\n{note}" if note else ''), fontsize=16, pad=20, color=COLORS['text'])
     ax.set_xlabel('时间（小时）', fontsize=12, color=COLORS['text'], labelpad=15)
     ax.set_ylabel('活跃用户数', fontsize=12, color=COLORS['text'], labelpad=15)
     
@@ -234,8 +432,9 @@ def plot_activity_timeline(df, base_dir=None):
     plt.savefig(save_path, dpi=300, bbox_inches='tight', facecolor=COLORS['bg'])
     plt.close()
 
-def plot_consumption_analysis(df, base_dir=None):
-    # 样式初始化
+def init_plot_style():
+    """matplotlib样式初始化"""
+    import matplotlib.pyplot as plt
     plt.style.use('seaborn-v0_8-darkgrid')
     plt.rcParams.update({
         'font.sans-serif': ['Microsoft YaHei', 'SimHei'],
@@ -245,56 +444,37 @@ def plot_consumption_analysis(df, base_dir=None):
         'axes.titleweight': 'bold'
     })
 
-    """客单价分布可视化"""
-    plot_price_distribution(df, base_dir=base_dir)
-    '''plt.figure(figsize=(12, 7), facecolor='#f5f5f5')
-    ax = plt.gca()
-    
-    # 优化分箱策略
-    prices = df['avg_price'].dropna()
-    bins = np.linspace(prices.min(), prices.quantile(0.95), 15)  # 聚焦95%的数据
-    
-    # 直方图 + KDE曲线
-    sns.histplot(prices, bins=bins, kde=True, 
-                color='#2ecc71', edgecolor='white',
-                alpha=0.8)
-    
-    # 标注核心区间
-    median_price = prices.median()
-    ax.axvline(median_price, color='#e74c3c', linestyle='--', linewidth=2)
-    ax.text(median_price*1.05, ax.get_ylim()[1]*0.8, 
-           f'中位数 ¥{median_price:.0f}', 
-           color='#e74c3c', fontsize=12)
-    
-    # 自动标注密集区间
-    mode_price = prices.mode()[0]
-    ax.annotate(f'最密集区间\n¥{mode_price:.0f}±{bins[1]-bins[0]:.0f}',
-                xy=(mode_price, ax.get_ylim()[1]*0.6),
-                xytext=(mode_price*1.2, ax.get_ylim()[1]*0.5),
-                arrowprops=dict(arrowstyle='->', color='#34495e'),
-                bbox=dict(boxstyle='round', alpha=0.9, facecolor='white'))
-    
-    # 图表美化
-    plt.title('客单价核心分布分析', pad=20)
-    plt.xlabel('价格区间（元）', fontsize=12)
-    plt.ylabel('订单数量', fontsize=12)
-    plt.grid(axis='y', alpha=0.4)
-    
-    plt.tight_layout()
-    plt.savefig('price_simple.png', dpi=150, bbox_inches='tight')
-    plt.close()'''
+def category_sales(df):
+    """各品类销售额（avg_price求和，抽样数据按权重放大）"""
+    if 'sample_weight' in df.columns:
+        return sum_by(df['categories'], df['avg_price'] * df['sample_weight'])
+    return sum_by(df['categories'], df['avg_price'])
 
-    # ===== 品类销售分析 =====
+def plot_category_sales(df, base_dir=None, category_data=None):
+    """品类销售额分析(top 10)，category_data为预先聚合的各品类销售额"""
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(12, 7), facecolor='#f8f9fa')
     ax = plt.gca()
     flag = False
     
-    category_data = df.groupby('categories')['avg_price'].sum().nlargest(10).sort_values()
+    if category_data is None:
+        category_data = category_sales(df)
+    category_data = category_data.nlargest(10).sort_values()
+    
+    # 抽样数据：各品类销售额估计值的95%置信区间半宽
+    weights = sample_weights(df)
+    ci = None
+    if weights is not None:
+        categories = df['categories'].astype('category')
+        _, half = weighted_totals(categories.cat.codes.to_numpy(), len(categories.cat.categories),
+                                  weights, df['avg_price'], sample_clusters(df))
+        ci = pd.Series(half, index=categories.cat.categories).reindex(category_data.index)
     
     # 当数值过大时，降低category_data的数量级（使用亿元为单位）
     if category_data.max() > 100000000:
         flag = True
         category_data = category_data / 100000000
+        ci = ci / 100000000 if ci is not None else None
     # category_data = category_data / 100000000
     
     # 使用渐变颜色条
@@ -312,15 +492,16 @@ def plot_consumption_analysis(df, base_dir=None):
     
     # 动态数据标签
     max_val = category_data.max()
-    for bar in bars:
+    for bar, category in zip(bars, category_data.index):
         width = bar.get_width()
         label_x = width + max_val*0.02
-        label_text = f'¥{width:,.0f}'
+        label_text = f'¥{width:,.0f}' + (f' ±{ci[category]:,.0f}' if ci is not None else '')
         color = '#2c3e50' if width > max_val*0.3 else '#7f8c8d'
         plt.text(label_x, bar.get_y()+bar.get_height()/2, 
                 label_text, va='center', color=color, fontsize=10)
 
-    plt.title('品类销售额分析(top 10)\n(Category sales analysis top 10)', pad=20)
+    note = sample_note(df)
+    plt.title('品类销售额分析(top 10)\n(Category sales analysis top 10)' + (f"\n{note}" if note else ''), pad=20)
     if flag:
         plt.xlabel('销售额（亿元）', labelpad=12)
     else:
@@ -334,6 +515,80 @@ def plot_consumption_analysis(df, base_dir=None):
         plt.savefig('category_sales.png', bbox_inches='tight')
     plt.close()
 
+def plot_cohort_retention(retention, base_dir=None, note=''):
+    """注册月份留存热力图，retention为user_analysis.cohort_retention的结果"""
+    periods = [c for c in retention.columns if c != 'users']
+    rates = retention[periods].to_numpy()
+    # 热力图数据：[列(注册后月数), 行(cohort), 留存率%]，无法观察的月份不绘制
+    rows, cols = np.nonzero(~np.isnan(rates))
+    data = [[int(c), int(r), round(float(rates[r, c]) * 100, 1)] for r, c in zip(rows, cols)]
+    cohorts = [f"{cohort}（{users:,}人）" for cohort, users in zip(retention.index, retention['users'])]
+    
+    heatmap = HeatMap(init_opts=opts.InitOpts(width="1200px", height=f"{max(400, 28 * len(cohorts) + 160)}px"))
+    heatmap.add_xaxis([f"第{k}月" for k in periods])
+    heatmap.add_yaxis("留存率(%)", cohorts, data, label_opts=opts.LabelOpts(is_show=len(periods) <= 24, font_size=9))
+    heatmap.set_global_opts(
+        title_opts=opts.TitleOpts(title="注册月份留存分析", subtitle=note or None),
+        xaxis_opts=opts.AxisOpts(name="注册后月数", type_="category"),
+        yaxis_opts=opts.AxisOpts(name="注册月份", type_="category", is_inverse=True),
+        visualmap_opts=opts.VisualMapOpts(min_=0, max_=100, range_color=["#f7fbff", "#08306b"],
+                                          orient="horizontal", pos_left="center", pos_bottom="0"),
+        tooltip_opts=opts.TooltipOpts(formatter="{c}"),
+    )
+    
+    if base_dir:
+        heatmap.render(path=f"{base_dir}/cohort_retention.html")
+    else:
+        heatmap.render(path="cohort_retention.html")
+
+def plot_consumption_analysis(df, base_dir=None):
+    """消费分析图表（客单价、品类销售额、活跃时段），df可为DatasetHandle"""
+    df = as_frame(df, ['avg_price', 'categories', 'timestamp', 'hour'])
+    # 样式初始化
+    init_plot_style()
+
+    """客单价分布可视化"""
+    plot_price_distribution(df, base_dir=base_dir)
+    '''plt.figure(figsize=(12, 7), facecolor='#f5f5f5')
+    ax = plt.gca()
+    
+    # 优化分箱策略
+    prices = df['avg_price'].dropna()
+    bins = np.linspace(prices.min(), prices.quantile(0.95), 15)  # 聚焦95%的数据
+    
+    # 直方图 + KDE曲线
+    sns.histplot(prices, bins=bins, kde=True, 
+                color='#2ecc71', edgecolor='white',
+                alpha=0.8)
+    
+    # 标注核心区间
+    median_price = prices.median()
+    ax.axvline(median_price, color='#e74c3c', linestyle='--', linewidth=2)
+    ax.text(median_price*1.05, ax.get_ylim()[1]*0.8, 
+           f'中位数 ¥{median_price:.0f}', 
+           color='#e74c3c', fontsize=12)
+    
+    # 自动标注密集区间
+    mode_price = prices.mode()[0]
+    ax.annotate(f'最密集区间\n¥{mode_price:.0f}±{bins[1]-bins[0]:.0f}',
+                xy=(mode_price, ax.get_ylim()[1]*0.6),
+                xytext=(mode_price*1.2, ax.get_ylim()[1]*0.5),
+                arrowprops=dict(arrowstyle='->', color='#34495e'),
+                bbox=dict(boxstyle='round', alpha=0.9, facecolor='white'))
+    
+    # 图表美化
+    plt.title('客单价核心分布分析', pad=20)
+    plt.xlabel('价格区间（元）', fontsize=12)
+    plt.ylabel('订单数量', fontsize=12)
+    plt.grid(axis='y', alpha=0.4)
+    
+    plt.tight_layout()
+    plt.savefig('price_simple.png', dpi=150, bbox_inches='tight')
+    plt.close()'''
+
+    # ===== 品类销售分析 =====
+    plot_category_sales(df, base_dir=base_dir)
+
     # ===== 用户活跃时段分析 =====
     plot_activity_timeline(df, base_dir=base_dir)
     '''plt.figure(figsize=(12, 6), facecolor='#f8f9fa')
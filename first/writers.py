@@ -0,0 +1,59 @@
+"""
+结果输出：CSV / Parquet(zstd) / Arrow IPC
+
+CSV通过pyarrow分块写出，Parquet与Arrow IPC使用zstd压缩；
+多个结果表、多种格式在线程池中并行写出（pyarrow写出时释放GIL）。
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# pandas/pyarrow在写出时才导入，命令行解析（如--help）不需要加载
+
+# 输出格式 -> 文件后缀
+OUTPUT_FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+# CSV分块写出的行数
+CSV_CHUNK_ROWS = 500000
+
+def to_table(data):
+    """DataFrame/Series转换为Arrow表（Series的索引作为第一列）"""
+    import pandas as pd
+    import pyarrow as pa
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pd.Series):
+        data = data.rename(data.name or 'value').rename_axis(data.index.name or 'key').reset_index()
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+def write_table(data, path_stem, fmt='csv'):
+    """按指定格式写出单个结果表，返回文件路径"""
+    import pyarrow.csv as pacsv
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    table = to_table(data)
+    path = Path(f"{path_stem}{OUTPUT_FORMATS[fmt]}")
+    if fmt == 'csv':
+        # 分块写出，避免整表一次性格式化
+        with pacsv.CSVWriter(path, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=CSV_CHUNK_ROWS):
+                writer.write_batch(batch)
+    elif fmt == 'parquet':
+        pq.write_table(table, path, compression='zstd')
+    elif fmt == 'arrow':
+        feather.write_feather(table, path, compression='zstd')
+    return path
+
+def write_outputs(outputs, base_dir, formats=('csv',), workers=4):
+    """并行写出多个结果表，outputs为{文件名: DataFrame/Series/Arrow表}"""
+    base_dir = Path(base_dir)
+    tasks = [(data, base_dir / name, fmt) for name, data in outputs.items() for fmt in formats]
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="writer") as pool:
+        paths = list(pool.map(lambda task: write_table(*task), tasks))
+    for path in paths:
+        print(f"已保存 {path}")
+    return paths